@@ -1,45 +1,798 @@
+import atexit
+import base64
+import json
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
 import uuid
-import json
-from datetime import datetime
-from typing import Dict, Any
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from audit_blobs import SCHEMA as _SCHEMA_BLOBS, Pending, TraceStore
+from logging_utils import log_event
+from metrics import (
+    AUDIT_BACKPRESSURE_TOTAL,
+    AUDIT_BATCH_SIZE,
+    AUDIT_GROUP_WAIT_TIMEOUTS_TOTAL,
+    AUDIT_PARTITION_MAINTENANCE_TOTAL,
+    AUDIT_PARTITIONS,
+    AUDIT_QUEUE_DEPTH,
+    AUDIT_QUEUE_WAIT_MS,
+    AUDIT_ROWS_FAILED_TOTAL,
+    AUDIT_WRITE_LATENCY_MS,
+    PIPELINE_STAGE_LATENCY_MS,
+    observe_ms,
+)
 
 DB_PATH = os.getenv("AUDIT_DB_PATH","/tmp/genai-policy-gateway/audit.db")
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("""
+# sync  : row committed on the caller thread before write_audit returns
+# group : caller waits until the writer thread commits the batch containing its row
+# async : caller returns immediately; the writer commits within AUDIT_FLUSH_INTERVAL_MS
+DURABILITY = os.getenv("AUDIT_DURABILITY", "async").lower()
+if DURABILITY not in ("sync", "group", "async"):
+    DURABILITY = "async"
+
+QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+BATCH_MAX = int(os.getenv("AUDIT_BATCH_MAX", "500"))
+FLUSH_INTERVAL_S = float(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "50")) / 1000.0
+# how long a producer may block on a full queue before writing its row itself
+QUEUE_TIMEOUT_S = float(os.getenv("AUDIT_QUEUE_TIMEOUT_S", "1.0"))
+# how long a group-durability caller waits for the writer before writing its row itself
+GROUP_WAIT_S = float(os.getenv("AUDIT_GROUP_WAIT_S", "5.0"))
+
+# cas    : traces stored as a compressed skeleton + content-addressed fragment blobs (audit_blobs.py)
+# inline : full trace JSON in guardrails_json, as before
+TRACE_STORAGE = os.getenv("AUDIT_TRACE_STORAGE", "cas").lower()
+if TRACE_STORAGE not in ("cas", "inline"):
+    TRACE_STORAGE = "cas"
+
+# day  : one SQLite file per UTC day next to AUDIT_DB_PATH (audit-YYYYMMDD.db)
+# none : everything in AUDIT_DB_PATH, as before
+PARTITIONING = os.getenv("AUDIT_PARTITIONING", "day").lower()
+if PARTITIONING not in ("day", "none"):
+    PARTITIONING = "day"
+
+# retention drops (or moves to AUDIT_ARCHIVE_DIR) whole day files; 0 keeps everything
+RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "0"))
+ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", "")
+# cold partitions get their WAL folded in and truncated, and are vacuumed if they have free pages
+COMPACT_AFTER_DAYS = int(os.getenv("AUDIT_COMPACT_AFTER_DAYS", "2"))
+MAINTENANCE_INTERVAL_S = float(os.getenv("AUDIT_MAINTENANCE_INTERVAL_S", "3600"))
+# today and yesterday may still receive writes; maintenance never touches them
+_MIN_COLD_DAYS = 2
+
+_INSERT_SQL = """
+    INSERT INTO audit_log (
+        audit_id, timestamp, user_role, decision, rule_id, reason, policy_version,
+        at_stage, action, mode, would_deny, tool_name, injection_score, guardrails_json,
+        trace_skel, trace_dict_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+Row = Tuple[
+    str, str, str, Optional[str], Optional[str], Optional[str], Optional[str],
+    Optional[str], Optional[str], Optional[str], Optional[int], Optional[str], Optional[float], str,
+]
+
+
+
+class _GroupWaiter:
+    """Group-commit handshake. Whichever side claims the row first (writer or timed-out caller) writes it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._claimed = False
+
+    def claim(self) -> bool:
+        with self._lock:
+            if self._claimed:
+                return False
+            self._claimed = True
+            return True
+
+
+# queued row, its group-commit waiter (None unless AUDIT_DURABILITY=group), enqueue time (perf_counter)
+QueueItem = Tuple[Row, Optional[_GroupWaiter], float]
+
+SCHEMA_VERSION = 2
+
+# v1: integer primary key, promoted query columns, indexes for time-ordered keyset paging
+_SCHEMA_V1 = [
+    """
     CREATE TABLE IF NOT EXISTS audit_log (
-        audit_id TEXT,
-        timestamp TEXT,
+        id INTEGER PRIMARY KEY,
+        audit_id TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
         user_role TEXT,
         decision TEXT,
         rule_id TEXT,
         reason TEXT,
         policy_version TEXT,
+        at_stage TEXT,
+        action TEXT,
+        mode TEXT,
+        would_deny INTEGER,
+        tool_name TEXT,
+        injection_score REAL,
         guardrails_json TEXT
     )
-    """)
-    conn.commit()
-    conn.close()
+    """,
+    # every index implicitly ends in `id`, so (filter, timestamp, id) keyset scans never touch unrelated rows
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_audit_log_audit_id ON audit_log (audit_id)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_log_ts ON audit_log (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_log_rule_ts ON audit_log (rule_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_log_decision_ts ON audit_log (decision, timestamp)",
+]
 
-def write_audit(user_role: str, decision_obj: Dict[str, Any], guardrails: Dict[str, Any]) -> str:
-    audit_id = str(uuid.uuid4())
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("""
+# v2: content-addressed trace storage; rows written before v2 keep their inline guardrails_json
+_SCHEMA_V2 = [
+    "ALTER TABLE audit_log ADD COLUMN trace_skel BLOB",
+    "ALTER TABLE audit_log ADD COLUMN trace_dict_id INTEGER",
+    *_SCHEMA_BLOBS,
+]
+
+# v0 rows: promoted columns are recovered from the stored trace JSON
+_BACKFILL_V0 = """
     INSERT INTO audit_log (
-        audit_id, timestamp, user_role, decision, rule_id, reason, policy_version, guardrails_json
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        audit_id,
-        datetime.utcnow().isoformat(),
+        audit_id, timestamp, user_role, decision, rule_id, reason, policy_version,
+        at_stage, action, mode, would_deny, tool_name, injection_score, guardrails_json
+    )
+    SELECT
+        COALESCE(audit_id, lower(hex(randomblob(16)))), COALESCE(timestamp, ''), user_role, decision,
+        rule_id, reason, policy_version,
+        CASE WHEN json_valid(guardrails_json) THEN json_extract(guardrails_json, '$.final.at_stage') END,
+        CASE WHEN json_valid(guardrails_json) THEN json_extract(guardrails_json, '$.final.action') END,
+        CASE WHEN json_valid(guardrails_json) THEN json_extract(guardrails_json, '$.final.mode') END,
+        CASE WHEN json_valid(guardrails_json) THEN json_extract(guardrails_json, '$.final.would_deny') END,
+        CASE WHEN json_valid(guardrails_json) THEN COALESCE(
+            json_extract(guardrails_json, '$.signals.tool_name'),
+            json_extract(guardrails_json, '$.effective_tool.name')) END,
+        CASE WHEN json_valid(guardrails_json) THEN json_extract(guardrails_json, '$.guardrails.injection_score') END,
+        guardrails_json
+    FROM audit_log_v0
+    ORDER BY rowid
+"""
+
+
+# -------------------------
+# Partitions
+# -------------------------
+LEGACY = ""  # partition key of AUDIT_DB_PATH itself (unpartitioned mode, or rows from before partitioning)
+
+_BASE, _EXT = os.path.splitext(os.path.abspath(DB_PATH))
+_PARTITION_RE = re.compile(re.escape(os.path.basename(_BASE)) + r"-(\d{8})" + re.escape(_EXT) + "$")
+
+
+def partition_key(timestamp: str) -> str:
+    if PARTITIONING != "day":
+        return LEGACY
+    return timestamp[:10].replace("-", "")
+
+
+def partition_path(key: str) -> str:
+    return DB_PATH if key == LEGACY else f"{_BASE}-{key}{_EXT}"
+
+
+def list_partitions() -> List[str]:
+    """Partition keys newest first; the AUDIT_DB_PATH file, if present, always comes last."""
+    try:
+        names = os.listdir(os.path.dirname(_BASE))
+    except FileNotFoundError:
+        return []
+    keys = sorted((m.group(1) for m in map(_PARTITION_RE.match, names) if m), reverse=True)
+    if os.path.exists(DB_PATH):
+        keys.append(LEGACY)
+    AUDIT_PARTITIONS.set(len(keys))
+    return keys
+
+
+def _connect(path: str = DB_PATH) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL never corrupts, but may lose the last commits on power loss
+    conn.execute(f"PRAGMA synchronous={'NORMAL' if DURABILITY == 'async' else 'FULL'}")
+    return conn
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    conn.isolation_level = None
+    conn.execute("BEGIN IMMEDIATE")  # serializes concurrent workers running init_db
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            cols = [r[1] for r in conn.execute("PRAGMA table_info(audit_log)")]
+            legacy = bool(cols) and "id" not in cols
+            if legacy:
+                conn.execute("ALTER TABLE audit_log RENAME TO audit_log_v0")
+            for stmt in _SCHEMA_V1:
+                conn.execute(stmt)
+            if legacy:
+                conn.execute(_BACKFILL_V0)
+                conn.execute("DROP TABLE audit_log_v0")
+        if version < 2:
+            for stmt in _SCHEMA_V2:
+                conn.execute(stmt)
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = ""
+
+
+def _open_partition(key: str) -> sqlite3.Connection:
+    conn = _connect(partition_path(key))
+    _migrate(conn)
+    return conn
+
+
+# blob dictionaries and dedupe state are per file, so a dropped partition takes its blobs with it
+_traces: Dict[str, TraceStore] = {}
+_traces_lock = threading.Lock()
+
+
+def _trace_store(key: str) -> TraceStore:
+    with _traces_lock:
+        store = _traces.get(key)
+        if store is None:
+            store = _traces[key] = TraceStore()
+        return store
+
+
+def _write(conn: sqlite3.Connection, key: str, rows: List[Row]) -> None:
+    """
+    Inserts rows on `conn` and commits; rolls back and re-raises on failure. In cas mode
+    the trace is split into blobs first.
+    """
+    store = _trace_store(key) if TRACE_STORAGE == "cas" else None
+    pending = Pending()
+    try:
+        if store is not None:
+            stored = [row[:-1] + (None, *store.encode(conn, row[-1], pending)) for row in rows]
+        else:
+            stored = [row + (None, None) for row in rows]
+        conn.executemany(_INSERT_SQL, stored)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if store is not None:
+            store.discard(pending)
+        raise
+    # only now may other connections skip these blobs or use a new dictionary
+    if store is not None:
+        store.publish(pending)
+
+
+def _by_partition(rows: List[Row]) -> Dict[str, List[Row]]:
+    groups: Dict[str, List[Row]] = {}
+    for row in rows:
+        groups.setdefault(partition_key(row[1]), []).append(row)
+    return groups
+
+
+class _PartitionConns:
+    """Write connections by partition key; only the two most recent partitions stay open. Not thread-safe."""
+
+    def __init__(self):
+        self._conns: Dict[str, sqlite3.Connection] = {}
+
+    def get(self, key: str) -> sqlite3.Connection:
+        conn = self._conns.get(key)
+        if conn is None:
+            conn = self._conns[key] = _open_partition(key)
+            for old in sorted(k for k in self._conns if k != key)[:-1]:
+                self._conns.pop(old).close()
+        return conn
+
+    def close(self) -> None:
+        for conn in self._conns.values():
+            conn.close()
+        self._conns.clear()
+
+
+def init_db():
+    # pre-partitioning rows stay readable in AUDIT_DB_PATH; it is only created in unpartitioned mode
+    if PARTITIONING == "none" or os.path.exists(DB_PATH):
+        _open_partition(LEGACY).close()
+    _writer.start()
+    _maintenance.start()
+
+
+class AuditWriter:
+    """
+    Bounded queue + one writer thread holding long-lived WAL connections to the
+    current partitions. Rows are group-committed with executemany when AUDIT_BATCH_MAX rows are
+    pending or AUDIT_FLUSH_INTERVAL_MS has elapsed, whichever comes first.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[QueueItem]" = queue.Queue(maxsize=QUEUE_MAX)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        # used for sync durability and backpressure fallbacks (caller-thread writes)
+        self._direct_conns = _PartitionConns()
+        self._direct_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def write_direct(self, row: Row) -> None:
+        key = partition_key(row[1])
+        with self._direct_lock, observe_ms(AUDIT_WRITE_LATENCY_MS.labels(path="direct")):
+            _write(self._direct_conns.get(key), key, [row])
+
+    def _running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def offer(self, row: Row) -> bool:
+        """Enqueues without blocking (safe on the event loop); False when submit() is needed instead."""
+        if not self._running():
+            return False
+        try:
+            self._queue.put_nowait((row, None, time.perf_counter()))
+        except queue.Full:
+            return False
+        AUDIT_QUEUE_DEPTH.set(self._queue.qsize())
+        return True
+
+    def submit(self, row: Row, wait: bool) -> None:
+        if not self._running():
+            self.write_direct(row)
+            return
+        waiter = _GroupWaiter() if wait else None
+        try:
+            self._queue.put((row, waiter, time.perf_counter()), timeout=QUEUE_TIMEOUT_S)
+        except queue.Full:
+            # backpressure: never drop audit rows; the slow producer pays for its own write
+            AUDIT_BACKPRESSURE_TOTAL.inc()
+            self.write_direct(row)
+            return
+        AUDIT_QUEUE_DEPTH.set(self._queue.qsize())
+        if waiter is not None and not waiter.done.wait(GROUP_WAIT_S):
+            # writer stuck or dead: write the row here, unless the writer is committing it right now
+            AUDIT_GROUP_WAIT_TIMEOUTS_TOTAL.inc()
+            if waiter.claim():
+                self.write_direct(row)
+            else:
+                waiter.done.wait(GROUP_WAIT_S)
+
+    def _drain(self, first: QueueItem) -> List[QueueItem]:
+        batch = [first]
+        # linger for a fuller batch only while nobody is blocked waiting on this commit;
+        # waiters get classic group commit (whatever queued up during the previous commit)
+        waiting = first[1] is not None
+        deadline = time.monotonic() + FLUSH_INTERVAL_S
+        while len(batch) < BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            try:
+                if waiting or remaining <= 0 or self._stop.is_set():
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            waiting = waiting or item[1] is not None
+        return batch
+
+    def _commit(self, conns: _PartitionConns, batch: List[QueueItem]) -> None:
+        start = time.perf_counter()
+        for _, _, enqueued in batch:
+            AUDIT_QUEUE_WAIT_MS.observe((start - enqueued) * 1000)
+        # rows whose group-commit caller gave up waiting were written by that caller
+        mine = [row for row, waiter, _ in batch if waiter is None or waiter.claim()]
+        try:
+            # a batch spans two partitions only around midnight
+            for key, rows in _by_partition(mine).items():
+                try:
+                    _write(conns.get(key), key, rows)
+                except sqlite3.Error:
+                    # fall back to row-by-row so one bad row cannot lose the batch
+                    for row in rows:
+                        try:
+                            self.write_direct(row)
+                        except sqlite3.Error as e:
+                            AUDIT_ROWS_FAILED_TOTAL.inc()
+                            log_event("ERROR", "audit_write_failed", {
+                                "audit_id": row[0], "partition": key, "error": f"{type(e).__name__}: {e}",
+                            })
+        finally:
+            AUDIT_WRITE_LATENCY_MS.labels(path="batch").observe((time.perf_counter() - start) * 1000)
+            AUDIT_BATCH_SIZE.observe(len(batch))
+            AUDIT_QUEUE_DEPTH.set(self._queue.qsize())
+            for _, waiter, _ in batch:
+                if waiter is not None:
+                    waiter.done.set()
+
+    def _run(self) -> None:
+        conns = _PartitionConns()
+        try:
+            while not (self._stop.is_set() and self._queue.empty()):
+                try:
+                    first = self._queue.get(timeout=FLUSH_INTERVAL_S)
+                except queue.Empty:
+                    continue
+                self._commit(conns, self._drain(first))
+        finally:
+            conns.close()
+
+    def shutdown(self, timeout_s: float = 10.0) -> None:
+        """Flushes everything queued, then stops the writer thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+        with self._direct_lock:
+            self._direct_conns.close()
+
+
+_writer = AuditWriter()
+atexit.register(_writer.shutdown)
+
+
+class AuditMaintenance:
+    """
+    Background job over day partitions (never today or yesterday):
+      - older than AUDIT_RETENTION_DAYS: file deleted, or moved to AUDIT_ARCHIVE_DIR
+      - older than AUDIT_COMPACT_AFTER_DAYS: WAL checkpointed and truncated, free pages VACUUMed
+    Both are whole-file operations, so their cost does not depend on how much history is kept.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if PARTITIONING != "day" or MAINTENANCE_INTERVAL_S <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-maintenance", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(MAINTENANCE_INTERVAL_S):
+            try:
+                self.run_once()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _compact(key: str) -> bool:
+        """Folds the WAL into the main file and drops free pages; False if the partition is busy."""
+        path = partition_path(key)
+        conn = sqlite3.connect(path)
+        try:
+            wal_bytes = os.path.getsize(path + "-wal") if os.path.exists(path + "-wal") else 0
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not wal_bytes and not free_pages:
+                return True  # already compact
+            busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+            if busy:
+                return False
+            if free_pages:
+                conn.execute("VACUUM")
+            AUDIT_PARTITION_MAINTENANCE_TOTAL.labels(action="compacted").inc()
+            return True
+        except sqlite3.OperationalError:
+            return False  # e.g. a reader mid-query; retried next cycle
+        finally:
+            conn.close()
+
+    @classmethod
+    def _expire(cls, key: str) -> None:
+        path = partition_path(key)
+        if ARCHIVE_DIR:
+            if not cls._compact(key):
+                return
+            os.makedirs(ARCHIVE_DIR, exist_ok=True)
+            os.replace(path, os.path.join(ARCHIVE_DIR, os.path.basename(path)))
+            action = "archived"
+        else:
+            os.remove(path)
+            action = "deleted"
+        for suffix in ("-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+        with _traces_lock:
+            _traces.pop(key, None)
+        AUDIT_PARTITION_MAINTENANCE_TOTAL.labels(action=action).inc()
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict[str, List[str]]:
+        today = (now or datetime.utcnow()).date()
+
+        def cutoff(days: int) -> str:
+            return (today - timedelta(days=max(days, _MIN_COLD_DAYS))).strftime("%Y%m%d")
+
+        expired: List[str] = []
+        compacted: List[str] = []
+        for key in list_partitions():
+            if key == LEGACY:
+                continue
+            if RETENTION_DAYS > 0 and key < cutoff(RETENTION_DAYS):
+                self._expire(key)
+                expired.append(key)
+            elif key < cutoff(COMPACT_AFTER_DAYS) and self._compact(key):
+                compacted.append(key)
+        list_partitions()  # refresh the partition gauge
+        return {"expired": expired, "compacted": compacted}
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+
+
+_maintenance = AuditMaintenance()
+
+
+def run_maintenance() -> Dict[str, List[str]]:
+    """Runs one retention/compaction pass now (also runs every AUDIT_MAINTENANCE_INTERVAL_S)."""
+    return _maintenance.run_once()
+
+
+def _promoted_columns(decision_obj: Dict[str, Any], payload: Dict[str, Any]) -> Tuple[Any, ...]:
+    final = payload.get("final") or {}
+    signals = payload.get("signals") or {}
+    guardrails = payload.get("guardrails") or {}
+    effective_tool = payload.get("effective_tool") or {}
+    would_deny = final.get("would_deny")
+    score = guardrails.get("injection_score")
+    try:
+        score = None if score is None else float(score)
+    except (TypeError, ValueError):
+        score = None
+    return (
+        final.get("at_stage"),
+        final.get("action") or decision_obj.get("action"),
+        final.get("mode") or decision_obj.get("mode"),
+        None if would_deny is None else int(bool(would_deny)),
+        signals.get("tool_name") or effective_tool.get("name"),
+        score,
+    )
+
+
+def _audit_row(user_role: str, decision_obj: Dict[str, Any], guardrails: Dict[str, Any]) -> Row:
+    return (
+        str(uuid.uuid4()),
+        datetime.utcnow().isoformat(timespec="microseconds"),
         user_role,
         decision_obj.get("decision"),
         decision_obj.get("rule_id"),
         decision_obj.get("reason"),
         decision_obj.get("policy_version"),
+        *_promoted_columns(decision_obj, guardrails),
         json.dumps(guardrails, ensure_ascii=False),
-    ))
-    conn.commit()
-    conn.close()
-    return audit_id
+    )
+
+
+def write_audit(user_role: str, decision_obj: Dict[str, Any], guardrails: Dict[str, Any]) -> str:
+    row = _audit_row(user_role, decision_obj, guardrails)
+    if DURABILITY == "sync":
+        _writer.write_direct(row)
+    else:
+        _writer.submit(row, wait=DURABILITY == "group")
+    return row[0]
+
+
+async def awrite_audit(user_role: str, decision_obj: Dict[str, Any], guardrails: Dict[str, Any]) -> str:
+    """
+    write_audit for the event loop. In async mode the row is enqueued without blocking;
+    a full queue or a stopped writer (backpressure) and the other modes wait off-loop.
+    """
+    from fastapi.concurrency import run_in_threadpool
+
+    with observe_ms(PIPELINE_STAGE_LATENCY_MS.labels(stage="audit")):
+        if DURABILITY != "async":
+            return await run_in_threadpool(write_audit, user_role, decision_obj, guardrails)
+        row = _audit_row(user_role, decision_obj, guardrails)
+        if not _writer.offer(row):
+            await run_in_threadpool(_writer.submit, row, False)
+        return row[0]
+
+
+def shutdown_audit() -> None:
+    _maintenance.shutdown()
+    _writer.shutdown()
+
+
+# -------------------------
+# Read API
+# -------------------------
+_SUMMARY_COLUMNS = (
+    "id", "audit_id", "timestamp", "user_role", "decision", "rule_id", "reason", "policy_version",
+    "at_stage", "action", "mode", "would_deny", "tool_name", "injection_score",
+)
+_EQ_FILTERS = ("rule_id", "decision", "user_role", "at_stage", "action", "mode", "tool_name")
+
+_TRACE_COLUMNS = ("guardrails_json", "trace_skel", "trace_dict_id")
+
+QUERY_MAX_LIMIT = 500
+
+_readers = threading.local()
+
+
+def _reader_conns() -> Dict[str, sqlite3.Connection]:
+    conns = getattr(_readers, "conns", None)
+    if conns is None:
+        conns = _readers.conns = {}
+    return conns
+
+
+def _prune_readers(keys: List[str]) -> None:
+    """Closes this thread's connections to partitions that were dropped or archived."""
+    conns = _reader_conns()
+    for stale in set(conns) - set(keys):
+        conns.pop(stale).close()
+
+
+def _reader(key: str) -> sqlite3.Connection:
+    conns = _reader_conns()
+    conn = conns.get(key)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{partition_path(key)}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conns[key] = conn
+    return conn
+
+
+def _trace_json(key: str, r: sqlite3.Row) -> Optional[str]:
+    """Exact trace JSON as written, whether stored inline or as skeleton + blobs."""
+    if r["guardrails_json"] is not None or r["trace_skel"] is None:
+        return r["guardrails_json"]
+    return _trace_store(key).decode(_reader(key), r["trace_skel"], r["trace_dict_id"])
+
+
+def encode_cursor(timestamp: str, row_id: int, partition: str = LEGACY) -> str:
+    raw = json.dumps([timestamp, row_id, partition], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, row_id, *rest = json.loads(raw)
+        # cursors issued before partitioning carry no partition key
+        return str(ts), int(row_id), str(rest[0]) if rest else LEGACY
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+
+def _day_key(timestamp: Optional[str]) -> Optional[str]:
+    key = (timestamp or "")[:10].replace("-", "")
+    return key if len(key) == 8 and key.isdigit() else None
+
+
+def _partitions_for(since: Optional[str], until: Optional[str], after: Optional[str]) -> List[str]:
+    """Partitions (newest first) that can hold rows for the range, starting at the cursor's partition."""
+    keys = list_partitions()
+    _prune_readers(keys)
+    if after is not None:
+        keys = [k for k in keys if k <= after]  # LEGACY ("") sorts below every day key
+    lo, hi = _day_key(since), _day_key(until)
+    return [k for k in keys if k == LEGACY or ((lo is None or k >= lo) and (hi is None or k <= hi))]
+
+
+def query_audit(
+    *,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    would_deny: Optional[bool] = None,
+    min_injection_score: Optional[float] = None,
+    include_trace: bool = False,
+    **eq_filters: Optional[str],
+) -> Dict[str, Any]:
+    """
+    Newest-first keyset pagination over audit_log, across partitions.
+
+    `cursor` is the opaque `next_cursor` of the previous page; each page is an index
+    range scan on (filter, timestamp, id) in the cursor's partition, continuing into
+    older ones only while the page is not full, so cost does not grow with page depth
+    or retained history.
+    """
+    unknown = set(eq_filters) - set(_EQ_FILTERS)
+    if unknown:
+        raise ValueError(f"unknown filter(s): {sorted(unknown)}")
+    limit = max(1, min(int(limit), QUERY_MAX_LIMIT))
+
+    where: List[str] = []
+    params: List[Any] = []
+    for name in _EQ_FILTERS:
+        value = eq_filters.get(name)
+        if value is not None:
+            where.append(f"{name} = ?")
+            params.append(value)
+    if since is not None:
+        where.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("timestamp < ?")
+        params.append(until)
+    if would_deny is not None:
+        where.append("would_deny = ?")
+        params.append(int(would_deny))
+    if min_injection_score is not None:
+        where.append("injection_score >= ?")
+        params.append(float(min_injection_score))
+    after: Optional[str] = None
+    keyset: List[Any] = []
+    if cursor:
+        ts, row_id, after = decode_cursor(cursor)
+        keyset = [ts, row_id]
+
+    columns = _SUMMARY_COLUMNS + (_TRACE_COLUMNS if include_trace else ())
+    rows: List[Tuple[str, sqlite3.Row]] = []
+    for key in _partitions_for(since, until, after):
+        # ids are per partition: the keyset applies only inside the cursor's own partition
+        part_where, part_params = list(where), list(params)
+        if keyset and key == after:
+            part_where.append("(timestamp, id) < (?, ?)")
+            part_params.extend(keyset)
+        sql = f"SELECT {', '.join(columns)} FROM audit_log"
+        if part_where:
+            sql += " WHERE " + " AND ".join(part_where)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        part_params.append(limit + 1 - len(rows))
+        try:
+            rows.extend((key, r) for r in _reader(key).execute(sql, part_params).fetchall())
+        except sqlite3.OperationalError:
+            continue  # partition dropped or archived mid-query
+        if len(rows) > limit:
+            break
+
+    items = []
+    for key, r in rows[:limit]:
+        item = {k: r[k] for k in _SUMMARY_COLUMNS if k != "id"}
+        if item["would_deny"] is not None:
+            item["would_deny"] = bool(item["would_deny"])
+        if include_trace:
+            trace_json = _trace_json(key, r)
+            item["trace"] = json.loads(trace_json) if trace_json else None
+        items.append(item)
+
+    next_cursor = None
+    if len(rows) > limit:
+        key, last = rows[limit - 1]
+        next_cursor = encode_cursor(last["timestamp"], last["id"], key)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def get_audit(audit_id: str) -> Optional[Dict[str, Any]]:
+    # one unique-index probe per partition, newest first (lookups are usually for recent rows)
+    sql = f"SELECT {', '.join(_SUMMARY_COLUMNS + _TRACE_COLUMNS)} FROM audit_log WHERE audit_id = ?"
+    keys = list_partitions()
+    _prune_readers(keys)
+    for key in keys:
+        try:
+            r = _reader(key).execute(sql, (audit_id,)).fetchone()
+        except sqlite3.OperationalError:
+            continue
+        if r is not None:
+            break
+    else:
+        return None
+    item = {k: r[k] for k in _SUMMARY_COLUMNS if k != "id"}
+    if item["would_deny"] is not None:
+        item["would_deny"] = bool(item["would_deny"])
+    item["guardrails_json"] = _trace_json(key, r)
+    return item
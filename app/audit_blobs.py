@@ -0,0 +1,258 @@
+"""
+Content-addressed, dictionary-compressed storage for audit stage traces.
+
+The large, highly repetitive parts of a trace are split out as fragments. These are
+guardrails, signals, each stage's decision object, the tool result, the effective
+tool and the llm summary. A fragment is stored once in `audit_blob`, keyed by the
+hash of its exact JSON text. The audit row keeps only a small skeleton, which is
+the trace with those values nulled out, together with the (path, hash) references.
+
+Fragments and skeletons are compressed with a shared dictionary. It is trained
+once from the first AUDIT_DICT_TRAIN_SAMPLES fragments and stored in `audit_dict`:
+zstd when `zstandard` is installed, otherwise zlib with a preset dictionary.
+dict_id 0 means plain zlib, which is used until a dictionary exists.
+
+Blobs and dictionaries are written inside the caller's transaction, so the dedupe
+state and a newly trained dictionary are only shared with other connections once it
+commits: encode() records them in a Pending, the caller publishes it after COMMIT
+and discards it after ROLLBACK.
+
+Decoding puts each fragment back at its path in the skeleton. Key order is preserved,
+so json.dumps(..., ensure_ascii=False) gives back the exact original trace JSON.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from lru import TTLLRUCache
+from metrics import AUDIT_TRACE_BYTES_TOTAL, AUDIT_TRACE_FRAGMENTS_TOTAL
+
+try:  # optional: better ratios and real dictionary training
+    import zstandard
+except ImportError:  # pragma: no cover - depends on environment
+    zstandard = None
+
+DICT_TRAIN_SAMPLES = int(os.getenv("AUDIT_DICT_TRAIN_SAMPLES", "2000"))
+DICT_SIZE = int(os.getenv("AUDIT_DICT_SIZE", "32768"))
+# smaller values stay inline in the skeleton; a reference would cost more than it saves
+MIN_FRAGMENT_BYTES = int(os.getenv("AUDIT_MIN_FRAGMENT_BYTES", "48"))
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS audit_blob (
+        hash TEXT PRIMARY KEY,
+        dict_id INTEGER NOT NULL,
+        data BLOB NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS audit_dict (
+        dict_id INTEGER PRIMARY KEY,
+        codec TEXT NOT NULL,
+        data BLOB NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """,
+]
+
+Path = Tuple[str, ...]
+
+
+def fragment_paths(trace: Dict[str, Any]) -> List[Path]:
+    paths: List[Path] = [("guardrails",), ("signals",), ("tool_result",), ("effective_tool",), ("llm",)]
+    for stage in (trace.get("stages") or {}):
+        paths.append(("stages", stage, "decision"))
+    return paths
+
+
+def _get(obj: Any, path: Path) -> Any:
+    for p in path:
+        if not isinstance(obj, dict) or p not in obj:
+            return None
+        obj = obj[p]
+    return obj
+
+
+def _set(obj: Dict[str, Any], path: Path, value: Any) -> None:
+    for p in path[:-1]:
+        obj = obj[p]
+    obj[path[-1]] = value
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+class _Codec:
+    def __init__(self, dict_id: int, codec: str, data: bytes):
+        self.dict_id = dict_id
+        self.codec = codec
+        self.data = data
+        if codec == "zstd":
+            zdict = zstandard.ZstdCompressionDict(data)
+            self._cctx = zstandard.ZstdCompressor(level=9, dict_data=zdict)
+            self._dctx = zstandard.ZstdDecompressor(dict_data=zdict)
+
+    def compress(self, raw: bytes) -> bytes:
+        if self.codec == "zstd":
+            return self._cctx.compress(raw)
+        c = zlib.compressobj(9, zdict=self.data) if self.data else zlib.compressobj(9)
+        return c.compress(raw) + c.flush()
+
+    def decompress(self, blob: bytes) -> bytes:
+        if self.codec == "zstd":
+            return self._dctx.decompress(blob)
+        d = zlib.decompressobj(zdict=self.data) if self.data else zlib.decompressobj()
+        return d.decompress(blob) + d.flush()
+
+
+_PLAIN = _Codec(0, "zlib", b"")
+
+
+class Pending:
+    """What one uncommitted transaction added: fragment hashes, and a dictionary it trained."""
+
+    def __init__(self):
+        self.hashes: Set[str] = set()
+        self.codec: Optional[_Codec] = None
+
+
+class TraceStore:
+    """Encodes traces into (skeleton, refs) + fragment blobs, and back. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codecs: Dict[int, _Codec] = {0: _PLAIN}
+        self._current = _PLAIN
+        self._loaded = False
+        self._samples: List[bytes] = []
+        self._training = False  # a trained dictionary awaits its transaction's commit
+        # hashes committed by this process; skips compress + INSERT for repeats
+        self._known: TTLLRUCache[bool] = TTLLRUCache(100_000, 0)
+
+    def _codec(self, conn: sqlite3.Connection, dict_id: int) -> _Codec:
+        codec = self._codecs.get(dict_id)
+        if codec is None:
+            row = conn.execute("SELECT codec, data FROM audit_dict WHERE dict_id = ?", (dict_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"audit dictionary {dict_id} missing")
+            codec = _Codec(dict_id, row[0], bytes(row[1]))
+            self._codecs[dict_id] = codec
+        return codec
+
+    def _load_current(self, conn: sqlite3.Connection) -> None:
+        if self._loaded:
+            return
+        row = conn.execute("SELECT MAX(dict_id) FROM audit_dict").fetchone()
+        if row and row[0]:
+            self._current = self._codec(conn, int(row[0]))
+        self._loaded = True
+
+    def _train(self, conn: sqlite3.Connection) -> _Codec:
+        samples, self._samples = self._samples, []
+        if zstandard is not None:
+            codec, data = "zstd", zstandard.train_dictionary(DICT_SIZE, samples).as_bytes()
+        else:
+            # zlib preset dictionary: most frequent fragments, most frequent last (closest to the data)
+            counts = Counter(samples)
+            picked: List[bytes] = []
+            size = 0
+            for frag, _ in counts.most_common():
+                if size + len(frag) > DICT_SIZE:
+                    continue
+                picked.append(frag)
+                size += len(frag)
+            codec, data = "zlib", b"".join(reversed(picked))
+        cur = conn.execute(
+            "INSERT INTO audit_dict (codec, data, created_at) VALUES (?, ?, ?)",
+            (codec, data, datetime.utcnow().isoformat()),
+        )
+        return _Codec(int(cur.lastrowid), codec, data)
+
+    def encode(self, conn: sqlite3.Connection, trace_json: str, pending: Pending) -> Tuple[bytes, int]:
+        """
+        Stores new fragments via `conn`; returns (skeleton_blob, dict_id) for the audit row.
+        The caller commits, then publish(pending), or rolls back, then discard(pending).
+        """
+        trace = json.loads(trace_json)
+        refs: List[Tuple[Path, str]] = []
+        fragments: List[Tuple[str, bytes]] = []
+        if isinstance(trace, dict):
+            for path in fragment_paths(trace):
+                value = _get(trace, path)
+                if value is None:
+                    continue
+                raw = _dumps(value).encode("utf-8")
+                if len(raw) < MIN_FRAGMENT_BYTES:
+                    continue
+                h = hashlib.sha256(raw).hexdigest()[:24]
+                refs.append((path, h))
+                fragments.append((h, raw))
+                _set(trace, path, None)
+
+        with self._lock:
+            self._load_current(conn)
+            if pending.codec is None and self._current.dict_id == 0 and not self._training:
+                self._samples.extend(raw for _, raw in fragments)
+                if len(self._samples) >= DICT_TRAIN_SAMPLES:
+                    pending.codec = self._train(conn)
+                    self._training = True
+            codec = pending.codec or self._current
+            # compressor contexts are not thread-safe; writer and direct writers share them
+            new_blobs = []
+            for h, raw in fragments:
+                if h in pending.hashes or self._known.get(h):
+                    continue
+                new_blobs.append((h, codec.dict_id, codec.compress(raw)))
+                pending.hashes.add(h)
+            envelope = {"r": [[list(p), h] for p, h in refs], "t": trace}
+            skeleton = codec.compress(_dumps(envelope).encode("utf-8"))
+        if new_blobs:
+            conn.executemany("INSERT OR IGNORE INTO audit_blob (hash, dict_id, data) VALUES (?, ?, ?)", new_blobs)
+
+        AUDIT_TRACE_BYTES_TOTAL.labels(form="raw").inc(len(trace_json.encode("utf-8")))
+        AUDIT_TRACE_BYTES_TOTAL.labels(form="stored").inc(len(skeleton) + sum(len(b[2]) for b in new_blobs))
+        AUDIT_TRACE_FRAGMENTS_TOTAL.labels(result="stored").inc(len(new_blobs))
+        AUDIT_TRACE_FRAGMENTS_TOTAL.labels(result="deduped").inc(len(fragments) - len(new_blobs))
+        return skeleton, codec.dict_id
+
+    def publish(self, pending: Pending) -> None:
+        """After COMMIT: the blobs and dictionary exist for every connection."""
+        with self._lock:
+            for h in pending.hashes:
+                self._known.put(h, True)
+            if pending.codec is not None:
+                self._codecs[pending.codec.dict_id] = pending.codec
+                self._current = pending.codec
+                self._training = False
+
+    def discard(self, pending: Pending) -> None:
+        """After ROLLBACK: nothing was stored; a rolled-back dictionary is trained again later."""
+        if pending.codec is not None:
+            with self._lock:
+                self._training = False
+
+    def decode(self, conn: sqlite3.Connection, skeleton: bytes, dict_id: int) -> str:
+        with self._lock:
+            envelope = json.loads(self._codec(conn, dict_id).decompress(bytes(skeleton)))
+        refs: Sequence[Tuple[List[str], str]] = envelope["r"]
+        trace = envelope["t"]
+        if refs:
+            hashes = [h for _, h in refs]
+            rows = conn.execute(
+                f"SELECT hash, dict_id, data FROM audit_blob WHERE hash IN ({','.join('?' * len(hashes))})",
+                hashes,
+            ).fetchall()
+            with self._lock:
+                values = {h: json.loads(self._codec(conn, d).decompress(bytes(data))) for h, d, data in rows}
+            for path, h in refs:
+                _set(trace, tuple(path), values[h])
+        return _dumps(trace)
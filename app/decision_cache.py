@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional, Sequence, Tuple
+
+from lru import TTLLRUCache
+from metrics import DECISION_CACHE_HITS_TOTAL, DECISION_CACHE_INVALIDATIONS_TOTAL, DECISION_CACHE_MISSES_TOTAL
+
+_MISSING = "__missing__"
+
+
+def _get_path(obj: Any, path: Sequence[str]) -> Any:
+    for part in path:
+        if not isinstance(obj, dict) or part not in obj:
+            return _MISSING
+        obj = obj[part]
+    return obj
+
+
+def canonical_hash(obj: Any) -> str:
+    b = json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(b).hexdigest()
+
+
+class DecisionCache:
+    """
+    In-process LRU+TTL cache for stage decisions.
+
+    DECISION_CACHE_ENABLED=true
+    DECISION_CACHE_STAGES=pre,tool,post
+    DECISION_CACHE_MAX_ENTRIES=10000
+    DECISION_CACHE_TTL_S=60
+
+    Keys hash the policy epoch (bundle revision / policy version), the effective
+    POLICY_MODE and the input paths the policy reads. Those are `key_paths`, or, with
+    `stage_key_paths`, whatever the analysed live policy reads at the stage: it returns
+    (policy source revision, paths), or None when it cannot bound the reads, and then
+    the decision is not cached. A change of epoch, source revision or mode clears the cache.
+    """
+
+    def __init__(
+        self,
+        key_paths: Iterable[Sequence[str]] = (),
+        stages: Optional[Iterable[str]] = None,
+        max_entries: Optional[int] = None,
+        ttl_s: Optional[float] = None,
+        stage_key_paths: Optional[Callable[[str], Optional[Tuple[str, FrozenSet[Tuple[str, ...]]]]]] = None,
+    ):
+        self.key_paths = tuple(tuple(p) for p in key_paths)
+        self.stage_key_paths = stage_key_paths
+        if stages is None:
+            stages = [s.strip() for s in os.getenv("DECISION_CACHE_STAGES", "pre,tool,post").split(",") if s.strip()]
+        self.stages = frozenset(s.lower() for s in stages)
+        self._cache: TTLLRUCache[Dict[str, Any]] = TTLLRUCache(
+            max_entries if max_entries is not None else int(os.getenv("DECISION_CACHE_MAX_ENTRIES", "10000")),
+            ttl_s if ttl_s is not None else float(os.getenv("DECISION_CACHE_TTL_S", "60")),
+        )
+        self.epoch = ""
+        self.source_revision = ""
+        self._mode: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def set_epoch(self, epoch: str, reason: str = "bundle_revision") -> None:
+        with self._lock:
+            if epoch == self.epoch:
+                return
+            self.epoch = epoch
+        self.invalidate(reason)
+
+    def invalidate(self, reason: str = "manual") -> None:
+        self._cache.clear()
+        DECISION_CACHE_INVALIDATIONS_TOTAL.labels(reason=reason).inc()
+
+    def key(self, stage: str, opa_input: Dict[str, Any], mode: str) -> Optional[str]:
+        if stage not in self.stages:
+            return None
+        if mode != self._mode:
+            with self._lock:
+                changed = self._mode is not None and mode != self._mode
+                self._mode = mode
+            if changed:
+                self.invalidate("policy_mode")
+        paths: Iterable[Tuple[str, ...]] = self.key_paths
+        if self.stage_key_paths is not None:
+            analysed = self.stage_key_paths(stage)
+            if analysed is None:
+                return None  # the policy could read anything: a key could merge distinct inputs
+            revision, stage_paths = analysed
+            if revision != self.source_revision:
+                with self._lock:
+                    changed = revision != self.source_revision
+                    self.source_revision = revision
+                if changed:
+                    self.invalidate("policy_source")
+            paths = sorted(stage_paths)
+        projected = [_get_path(opa_input, p) for p in paths]
+        return canonical_hash([self.epoch, self.source_revision, mode, projected])
+
+    def get(self, stage: str, key: str) -> Optional[Dict[str, Any]]:
+        hit = self._cache.get(key)
+        if hit is None:
+            DECISION_CACHE_MISSES_TOTAL.labels(stage=stage).inc()
+            return None
+        DECISION_CACHE_HITS_TOTAL.labels(stage=stage).inc()
+        # callers may annotate the decision; never hand out the cached object
+        return copy.deepcopy(hit)
+
+    def put(self, key: str, decision: Dict[str, Any]) -> None:
+        self._cache.put(key, copy.deepcopy(decision))
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+class RevisionWatcher:
+    """
+    Daemon thread that polls a revision source and reports changes.
+
+    Used to invalidate the decision cache when OPA activates a new bundle revision.
+    """
+
+    def __init__(self, fetch: Callable[[], str], on_change: Callable[[str], None], interval_s: float):
+        self.fetch = fetch
+        self.on_change = on_change
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="policy-revision-watcher", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.on_change(self.fetch())
+            except Exception:
+                # OPA down or restarting: keep the current epoch, TTL still bounds staleness
+                pass
+            self._stop.wait(self.interval_s)
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,251 @@
+"""
+Precomputed tool-stage decisions.
+
+genai.rego's tool stage reads a handful of discrete inputs: tool_name, the three
+sql_* flags, tool_domain, whether inj_score >= 0.20 with at least one hit, and the
+policy mode it echoes back. ToolDecisionTable enumerates that finite space against the
+live backend (OPA or the Wasm module) and answers tool-stage evaluations with a dict
+lookup. Inputs outside the enumerated space are evaluated live. That covers tool names
+or domains not listed, unusual modes, and non-numeric scores. Domains outside
+allowed_domains are among them, because the deny reason quotes the domain.
+
+TOOL_DECISION_TABLE_ENABLED=true
+TOOL_DECISION_TABLE_TOOLS=sql_query,http_get
+TOOL_DECISION_TABLE_DOMAINS=                (extra domains; allowed_domains comes from OPA_REGO_PATH)
+TOOL_DECISION_TABLE_MODES=,enforce,monitor  ("" is what the policy echoes when no mode signal is set)
+TOOL_DECISION_TABLE_CHECK_S=5               (policy revision poll; a new revision rebuilds the table)
+TOOL_DECISION_TABLE_VERIFY_S=60             (re-checks served lookups and a slice of rows against live)
+TOOL_DECISION_TABLE_VERIFY_ROWS=64
+
+The table is built in a background thread. Until the first build succeeds, every
+lookup misses. Any mismatch found by the verifier drops the table and rebuilds it.
+"""
+from __future__ import annotations
+
+import collections
+import copy
+import itertools
+import os
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from metrics import DECISION_TABLE_LOOKUPS_TOTAL, DECISION_TABLE_MISMATCHES_TOTAL, DECISION_TABLE_ROWS
+from rego_analysis import RegoPolicy, Unsupported
+
+# (tool_name, sql_is_destructive, sql_is_select, sql_has_limit, tool_domain, injection, mode)
+Key = Tuple[str, bool, bool, bool, str, bool, str]
+
+# Marker on decisions served from the table (recorded in the stage trace)
+FROM_DECISION_TABLE = "decision table"
+
+INJ_TOOL_THRESHOLD = 0.20
+
+
+def _csv(name: str, default: str) -> List[str]:
+    return [x.strip().lower() for x in os.getenv(name, default).split(",")]
+
+
+def _lower_str(v: Any, fallback: Any) -> Any:
+    return v.lower() if isinstance(v, str) else fallback
+
+
+def _flag(signals: Dict[str, Any], name: str) -> bool:
+    v = signals.get(name, False)
+    return v if isinstance(v, bool) else False
+
+
+def tool_stage_key(opa_input: Dict[str, Any]) -> Optional[Key]:
+    """
+    The tool-stage helpers of genai.rego (tool_name, sql_*, tool_domain, inj_score,
+    inj_hits, mode), computed the way the policy computes them. Returns None for inputs
+    that the table cannot represent.
+    """
+    signals = opa_input.get("signals", {})
+    if not isinstance(signals, dict):
+        return None
+
+    tool = opa_input.get("tool", {})
+    name: Any = None
+    if isinstance(tool, dict):
+        name = _lower_str(tool.get("name", ""), None)
+    if name is None:
+        name = _lower_str(opa_input.get("tool_name", ""), "")
+
+    score = signals.get("injection_score", 0.0)
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        return None  # strings go through to_number in the policy; leave those to it
+    hits = signals.get("injection_hits", [])
+    injection = score >= INJ_TOOL_THRESHOLD and isinstance(hits, list) and len(hits) > 0
+
+    mode = _lower_str(signals.get("policy_mode", ""), None)
+    if mode is None:
+        mode = _lower_str(signals.get("mode", ""), "enforce")
+
+    return (
+        name,
+        _flag(signals, "sql_is_destructive"),
+        _flag(signals, "sql_is_select"),
+        _flag(signals, "sql_has_limit"),
+        _lower_str(signals.get("tool_domain", ""), ""),
+        injection,
+        mode,
+    )
+
+
+def representative_input(key: Key) -> Dict[str, Any]:
+    """An input whose tool_stage_key is `key`."""
+    name, destructive, select, has_limit, domain, injection, mode = key
+    return {
+        "stage": "tool",
+        "request": {"message": "", "user_role": None},
+        "signals": {
+            "sql_is_destructive": destructive,
+            "sql_is_select": select,
+            "sql_has_limit": has_limit,
+            "tool_domain": domain,
+            "injection_score": INJ_TOOL_THRESHOLD if injection else 0.0,
+            "injection_hits": ["decision_table"] if injection else [],
+            "policy_mode": mode,
+        },
+        "tool": {"name": name, "args": {}},
+        "tool_result": None,
+        "llm_out": None,
+    }
+
+
+def _policy_domains() -> List[str]:
+    try:
+        domains = RegoPolicy.from_file().evaluate(None, "allowed_domains")
+    except (OSError, Unsupported, RecursionError):
+        return []
+    return sorted(d for d in domains if isinstance(d, str)) if isinstance(domains, frozenset) else []
+
+
+class ToolDecisionTable:
+    def __init__(
+        self,
+        evaluate: Callable[[Dict[str, Any]], Dict[str, Any]],
+        revision: Callable[[], str],
+        tools: List[str],
+        domains: List[str],
+        modes: List[str],
+        check_s: float = 5.0,
+        verify_s: float = 60.0,
+        verify_rows: int = 64,
+    ):
+        self.evaluate = evaluate
+        self.revision = revision
+        self.keys: List[Key] = [
+            (name, destructive, select, has_limit, domain, injection, mode)
+            for name, domain, mode in itertools.product(tools, domains, modes)
+            for destructive, select, has_limit, injection in itertools.product((False, True), repeat=4)
+        ]
+        self.check_s = check_s
+        self.verify_s = verify_s
+        self.verify_rows = verify_rows
+        self.built_revision: Optional[str] = None
+        self._table: Dict[Key, Dict[str, Any]] = {}
+        self._served: Deque[Tuple[Key, Dict[str, Any]]] = collections.deque(maxlen=32)
+        self._verify_offset = 0
+        self._next_verify = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(
+        cls, evaluate: Callable[[Dict[str, Any]], Dict[str, Any]], revision: Callable[[], str]
+    ) -> Optional["ToolDecisionTable"]:
+        if os.getenv("TOOL_DECISION_TABLE_ENABLED", "true").lower() != "true":
+            return None
+        extra = [d for d in _csv("TOOL_DECISION_TABLE_DOMAINS", "") if d]
+        return cls(
+            evaluate,
+            revision,
+            tools=[t for t in _csv("TOOL_DECISION_TABLE_TOOLS", "sql_query,http_get") if t],
+            domains=sorted(set([""] + _policy_domains() + extra)),
+            modes=sorted(set(_csv("TOOL_DECISION_TABLE_MODES", ",enforce,monitor"))),
+            check_s=float(os.getenv("TOOL_DECISION_TABLE_CHECK_S", "5")),
+            verify_s=float(os.getenv("TOOL_DECISION_TABLE_VERIFY_S", "60")),
+            verify_rows=int(os.getenv("TOOL_DECISION_TABLE_VERIFY_ROWS", "64")),
+        )
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def lookup(self, opa_input: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Tool-stage decision for `opa_input`, or None when it must be evaluated live."""
+        key = tool_stage_key(opa_input)
+        decision = self._table.get(key) if key is not None else None
+        if decision is None:
+            DECISION_TABLE_LOOKUPS_TOTAL.labels(result="miss").inc()
+            return None
+        DECISION_TABLE_LOOKUPS_TOTAL.labels(result="hit").inc()
+        self._served.append((key, opa_input))
+        return {**copy.deepcopy(decision), "evaluation": FROM_DECISION_TABLE}
+
+    def build(self) -> None:
+        """Evaluates every key live and swaps the table in; raises if the backend fails."""
+        revision = self.revision()
+        table = {key: self.evaluate(representative_input(key)) for key in self.keys}
+        if self.revision() != revision:
+            return  # the policy changed underneath; the next check rebuilds
+        self._table = table
+        self.built_revision = revision
+        DECISION_TABLE_ROWS.set(len(table))
+
+    def drop(self) -> None:
+        self._table = {}
+        self.built_revision = None
+        DECISION_TABLE_ROWS.set(0)
+
+    def verify(self) -> int:
+        """Compares served lookups and a rotating slice of rows with live decisions; returns mismatches."""
+        table = self._table
+        checks: List[Tuple[Key, Dict[str, Any]]] = []
+        while self._served:
+            checks.append(self._served.popleft())
+        if table and self.keys:
+            n = min(self.verify_rows, len(self.keys))
+            for i in range(n):
+                key = self.keys[(self._verify_offset + i) % len(self.keys)]
+                checks.append((key, representative_input(key)))
+            self._verify_offset = (self._verify_offset + n) % len(self.keys)
+
+        mismatches = 0
+        for key, opa_input in checks:
+            expected = table.get(key)
+            if expected is not None and self.evaluate(opa_input) != expected:
+                mismatches += 1
+        if mismatches:
+            DECISION_TABLE_MISMATCHES_TOTAL.inc(mismatches)
+        return mismatches
+
+    def _tick(self) -> None:
+        if self.revision() != self.built_revision:
+            self.build()
+            self._next_verify = time.monotonic() + self.verify_s
+            return
+        if self.verify_s > 0 and time.monotonic() >= self._next_verify:
+            self._next_verify = time.monotonic() + self.verify_s
+            if self.verify():
+                self.drop()
+                self.build()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._tick()
+            except Exception:
+                # backend down: keep the current table (or none) and retry next round
+                pass
+            self._stop.wait(self.check_s)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="tool-decision-table", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
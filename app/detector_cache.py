@@ -0,0 +1,138 @@
+"""
+Cache of detector outputs (PII, injection cascade) keyed by message fingerprint.
+
+Keys hash the detector name, its version/config string and the message after the
+detector's own normalization. The injection cascade ignores surrounding whitespace.
+PII detectors key on the raw text, because their spans carry offsets into it. Only
+clean results are stored: timeouts, exceptions and outputs with an "error" are
+recomputed next time.
+
+DETECTOR_CACHE_ENABLED=true
+DETECTOR_CACHE_MAX_ENTRIES=10000     (per process, LRU)
+DETECTOR_CACHE_TTL_S=86400
+DETECTOR_CACHE_BACKEND=none|file|redis   (shared tier, read after a memory miss)
+DETECTOR_CACHE_FILE_PATH=/tmp/detector_cache.db
+DETECTOR_CACHE_FILE_MAX_ENTRIES=100000
+DETECTOR_CACHE_REDIS_URL=redis://localhost:6379/0
+DETECTOR_CACHE_VERSION=1             (bump to drop every cached output)
+
+The file backend is a SQLite file that workers on one host share. It bounds itself by
+age and row count, and it stands in for redis in tests. With redis, entries expire by
+TTL and the server's maxmemory policy bounds the size.
+"""
+from __future__ import annotations
+
+import copy
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from decision_cache import canonical_hash
+from lru import SQLiteTTLStore, TTLLRUCache
+from metrics import DETECTOR_CACHE_HIT_RATIO, DETECTOR_CACHE_HITS_TOTAL, DETECTOR_CACHE_MISSES_TOTAL
+
+try:  # optional; only needed for DETECTOR_CACHE_BACKEND=redis
+    import redis  # type: ignore
+except ImportError:  # pragma: no cover - depends on environment
+    redis = None
+
+# per-run fields that are re-measured, not replayed
+_VOLATILE_FIELDS = ("status", "latency_ms", "cache")
+
+
+class _RedisTier:
+    def __init__(self, url: str, ttl_s: float, prefix: str = "detector_cache:"):
+        self.ttl_s = ttl_s
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self._client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        self._client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=max(1, int(self.ttl_s)))
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class DetectorCache:
+    def __init__(self):
+        self.enabled = os.getenv("DETECTOR_CACHE_ENABLED", "true").lower() == "true"
+        self.version = os.getenv("DETECTOR_CACHE_VERSION", "1")
+        ttl = float(os.getenv("DETECTOR_CACHE_TTL_S", "86400"))
+        self._memory: TTLLRUCache[Dict[str, Any]] = TTLLRUCache(
+            int(os.getenv("DETECTOR_CACHE_MAX_ENTRIES", "10000")), ttl
+        )
+        self._shared: Any = None
+        self._lookups: Dict[str, List[int]] = {}  # detector -> [hits, lookups] in this process
+        self._lookups_lock = threading.Lock()
+        backend = os.getenv("DETECTOR_CACHE_BACKEND", "none").lower()
+        if self.enabled and backend == "file":
+            self._shared = SQLiteTTLStore(
+                os.getenv("DETECTOR_CACHE_FILE_PATH", "/tmp/detector_cache.db"),
+                "detector_cache",
+                ttl,
+                max_entries=int(os.getenv("DETECTOR_CACHE_FILE_MAX_ENTRIES", "100000")),
+            )
+        elif self.enabled and backend == "redis" and redis is not None:
+            self._shared = _RedisTier(os.getenv("DETECTOR_CACHE_REDIS_URL", "redis://localhost:6379/0"), ttl)
+
+    @property
+    def shared(self) -> bool:
+        return self._shared is not None
+
+    def _record(self, detector: str, hit: bool) -> None:
+        with self._lookups_lock:
+            counts = self._lookups.setdefault(detector, [0, 0])
+            counts[0] += hit
+            counts[1] += 1
+            ratio = counts[0] / counts[1]
+        DETECTOR_CACHE_HIT_RATIO.labels(detector=detector).set(ratio)
+
+    def key(self, detector: str, version: str, text: str) -> str:
+        return canonical_hash([self.version, detector, version, text])
+
+    def get_local(self, detector: str, key: str) -> Optional[Dict[str, Any]]:
+        """Memory tier only (no I/O); safe to call on the event loop. Misses are not counted."""
+        value = self._memory.get(key)
+        if value is None:
+            return None
+        DETECTOR_CACHE_HITS_TOTAL.labels(detector=detector, tier="memory").inc()
+        self._record(detector, True)
+        return {**copy.deepcopy(value), "cache": "memory"}
+
+    def get_shared(self, detector: str, key: str) -> Optional[Dict[str, Any]]:
+        """Shared tier (blocking I/O); a hit is promoted to memory. Counts the miss."""
+        value = None
+        if self._shared is not None:
+            try:
+                value = self._shared.get(key)
+            except Exception:
+                value = None  # shared backend down: behave as a miss
+        if value is None:
+            DETECTOR_CACHE_MISSES_TOTAL.labels(detector=detector).inc()
+            self._record(detector, False)
+            return None
+        self._memory.put(key, value)
+        DETECTOR_CACHE_HITS_TOTAL.labels(detector=detector, tier="shared").inc()
+        self._record(detector, True)
+        return {**copy.deepcopy(value), "cache": "shared"}
+
+    def put(self, key: str, out: Dict[str, Any]) -> None:
+        """Stores a detector output unless it reported an error (blocking when a shared tier is set)."""
+        if out.get("error"):
+            return
+        value = {k: copy.deepcopy(v) for k, v in out.items() if k not in _VOLATILE_FIELDS}
+        self._memory.put(key, value)
+        if self._shared is not None:
+            try:
+                self._shared.put(key, value)
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        if self._shared is not None:
+            self._shared.close()
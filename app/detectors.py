@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import importlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from detector_cache import DetectorCache
+from metrics import DETECTOR_LATENCY_MS
+
+
+def _env_timeout(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(f"DETECTOR_TIMEOUT_S_{name.upper()}", os.getenv("DETECTOR_TIMEOUT_S", str(default))))
+    except ValueError:
+        return default
+
+
+def _elapsed_ms(detector: str, status: str, start: float) -> int:
+    """Records the detector run in DETECTOR_LATENCY_MS; returns whole ms for the signal dict."""
+    ms = (time.perf_counter() - start) * 1000
+    DETECTOR_LATENCY_MS.labels(detector=detector, status=status).observe(ms)
+    return int(ms)
+
+
+class Detector:
+    """
+    A named, blocking detector (text -> signal dict).
+
+    `fallback` is the signal dict reported when the detector times out or raises,
+    so downstream policy always sees a stable shape.
+
+    `batch_fn` (texts -> one signal dict per text) is the detector's batched form, used
+    by DetectorFanout.run_many. Without it a batch calls `fn` once per text.
+
+    `cache_version` opts the detector into the fanout's DetectorCache; it should change
+    whenever the detector's model or config does. `normalize` maps the text to the
+    cache key's text (default: the raw text).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[str], Dict[str, Any]],
+        fallback: Dict[str, Any],
+        timeout_s: Optional[float] = None,
+        batch_fn: Optional[Callable[[List[str]], List[Dict[str, Any]]]] = None,
+        cache_version: Optional[str] = None,
+        normalize: Optional[Callable[[str], str]] = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.batch_fn = batch_fn
+        self.cache_version = cache_version
+        self.normalize = normalize
+        self.fallback = fallback
+        self.timeout_s = timeout_s if timeout_s is not None else _env_timeout(name, 10.0)
+
+    def unknown(self, status: str, error: str, latency_ms: int) -> Dict[str, Any]:
+        return {**self.fallback, "status": status, "error": error, "latency_ms": latency_ms}
+
+
+class DetectorFanout:
+    """
+    Runs independent detectors concurrently on a dedicated worker pool.
+
+    DETECTOR_WORKERS=8
+    DETECTOR_TIMEOUT_S=10              (default per-detector timeout)
+    DETECTOR_TIMEOUT_S_<NAME>=...      (per-detector override, e.g. DETECTOR_TIMEOUT_S_INJECTION)
+    DETECTOR_BATCH_SIZE=64             (texts per batch_fn call in run_many)
+
+    A detector that times out yields its fallback with status="unknown" instead of
+    holding the request; the worker thread finishes in the background.
+
+    With a `cache`, detectors that set cache_version are looked up first. Hits are
+    returned with "cache": "memory" | "shared", and their latency is the lookup's.
+    """
+
+    def __init__(
+        self,
+        detectors: List[Detector],
+        max_workers: Optional[int] = None,
+        cache: Optional[DetectorCache] = None,
+    ):
+        self.detectors = detectors
+        self.cache = cache if cache is not None and cache.enabled else None
+        workers = max_workers or int(os.getenv("DETECTOR_WORKERS", "8"))
+        self.batch_size = max(1, int(os.getenv("DETECTOR_BATCH_SIZE", "64")))
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="detector")
+
+    def _cache_key(self, detector: Detector, text: str) -> Optional[str]:
+        if self.cache is None or detector.cache_version is None:
+            return None
+        keyed = detector.normalize(text) if detector.normalize is not None else text
+        return self.cache.key(detector.name, detector.cache_version, keyed)
+
+    def _cached_call(self, detector: Detector, key: str, text: str) -> Dict[str, Any]:
+        """Runs on the pool: shared-tier lookup, else the detector, whose output is stored."""
+        assert self.cache is not None
+        hit = self.cache.get_shared(detector.name, key)
+        if hit is not None:
+            return hit
+        out = detector.fn(text)
+        self.cache.put(key, out)
+        return out
+
+    def _cached_batch(self, detector: Detector, keys: List[str], texts: List[str]) -> List[Dict[str, Any]]:
+        assert self.cache is not None and detector.batch_fn is not None
+        outs: List[Optional[Dict[str, Any]]] = [self.cache.get_shared(detector.name, k) for k in keys]
+        misses = [i for i, o in enumerate(outs) if o is None]
+        if misses:
+            computed = detector.batch_fn([texts[i] for i in misses])
+            if len(computed) != len(misses):
+                raise ValueError(f"batch_fn returned {len(computed)} results for {len(misses)} texts")
+            for i, out in zip(misses, computed):
+                self.cache.put(keys[i], out)
+                outs[i] = out
+        return outs  # type: ignore[return-value]
+
+    async def _run_one(self, detector: Detector, text: str) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        fn: Callable[[str], Dict[str, Any]] = detector.fn
+        key = self._cache_key(detector, text)
+        if key is not None:
+            hit = self.cache.get_local(detector.name, key)  # type: ignore[union-attr]
+            if hit is not None:
+                return {**hit, "status": "ok", "latency_ms": _elapsed_ms(detector.name, "cached", start)}
+            fn = functools.partial(self._cached_call, detector, key)
+        try:
+            out = await asyncio.wait_for(
+                loop.run_in_executor(self._pool, fn, text),
+                timeout=detector.timeout_s,
+            )
+        except asyncio.TimeoutError:
+            latency_ms = _elapsed_ms(detector.name, "unknown", start)
+            return detector.unknown("unknown", f"timeout after {detector.timeout_s}s", latency_ms)
+        except Exception as e:
+            latency_ms = _elapsed_ms(detector.name, "error", start)
+            return detector.unknown("error", f"{type(e).__name__}: {e}", latency_ms)
+
+        latency_ms = _elapsed_ms(detector.name, "ok", start)
+        return {**out, "status": "ok", "latency_ms": latency_ms}
+
+    async def run(self, text: str) -> Dict[str, Dict[str, Any]]:
+        results = await asyncio.gather(*(self._run_one(d, text) for d in self.detectors))
+        return {d.name: r for d, r in zip(self.detectors, results)}
+
+    async def _run_chunk(self, detector: Detector, texts: List[str]) -> List[Dict[str, Any]]:
+        """One batch_fn call over `texts`, bounded by the detector's timeout as a whole."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        keys = [self._cache_key(detector, t) for t in texts]
+        if keys[0] is not None:
+            call = functools.partial(self._cached_batch, detector, keys, texts)
+        else:
+            call = functools.partial(detector.batch_fn, texts)
+        try:
+            outs = await asyncio.wait_for(
+                loop.run_in_executor(self._pool, call),
+                timeout=detector.timeout_s,
+            )
+            if len(outs) != len(texts):
+                raise ValueError(f"batch_fn returned {len(outs)} results for {len(texts)} texts")
+        except asyncio.TimeoutError:
+            latency_ms = _elapsed_ms(detector.name, "unknown", start)
+            return [detector.unknown("unknown", f"timeout after {detector.timeout_s}s", latency_ms) for _ in texts]
+        except Exception as e:
+            latency_ms = _elapsed_ms(detector.name, "error", start)
+            return [detector.unknown("error", f"{type(e).__name__}: {e}", latency_ms) for _ in texts]
+
+        # latency is the chunk's, shared by every text in it
+        latency_ms = _elapsed_ms(detector.name, "ok", start)
+        return [{**out, "status": "ok", "latency_ms": latency_ms} for out in outs]
+
+    async def _run_batch(self, detector: Detector, texts: List[str]) -> List[Dict[str, Any]]:
+        if detector.batch_fn is None:
+            return list(await asyncio.gather(*(self._run_one(detector, t) for t in texts)))
+        out: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        if self.cache is not None and detector.cache_version is not None:
+            for i, t in enumerate(texts):
+                start = time.perf_counter()
+                hit = self.cache.get_local(detector.name, self._cache_key(detector, t))  # type: ignore[arg-type]
+                if hit is not None:
+                    out[i] = {**hit, "status": "ok", "latency_ms": _elapsed_ms(detector.name, "cached", start)}
+        todo = [i for i, o in enumerate(out) if o is None]
+        chunks = [todo[i:i + self.batch_size] for i in range(0, len(todo), self.batch_size)]
+        results = await asyncio.gather(*(self._run_chunk(detector, [texts[i] for i in c]) for c in chunks))
+        for c, chunk_results in zip(chunks, results):
+            for i, r in zip(c, chunk_results):
+                out[i] = r
+        return out  # type: ignore[return-value]
+
+    async def run_many(self, texts: List[str]) -> List[Dict[str, Dict[str, Any]]]:
+        """`run` for many texts; detectors with a batch_fn see DETECTOR_BATCH_SIZE texts per call."""
+        per_detector = await asyncio.gather(*(self._run_batch(d, texts) for d in self.detectors))
+        return [
+            {d.name: results[i] for d, results in zip(self.detectors, per_detector)}
+            for i in range(len(texts))
+        ]
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.close()
+
+
+def detector_status(results: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """Compact per-detector status map for the guardrails/signals dict."""
+    return {name: r.get("status", "ok") for name, r in results.items()}
+
+
+class DetectorRegistry:
+    """
+    Detector backends by name, imported the first time they are called.
+
+    Backends such as NeMo (LLMRails) and Guardrails/Presidio (spaCy, torch) build
+    heavy objects at import time. Registering them as "module:function" keeps that
+    cost off startup and off endpoints that never use them.
+
+    DETECTOR_WARM=                     (comma-separated names, or "all", loaded in the background at startup)
+
+    A first call that has to load the backend runs inside the detector's timeout.
+    If the load takes longer, that request reports status="unknown" and the load
+    finishes in the background.
+    """
+
+    def __init__(self):
+        self._targets: Dict[str, str] = {}
+        self._loaded: Dict[str, Callable[[str], Dict[str, Any]]] = {}
+        self._load_ms: Dict[str, int] = {}
+        self._errors: Dict[str, str] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._warm_requested: List[str] = []
+
+    def register(self, name: str, target: str) -> None:
+        self._targets[name] = target
+        self._locks[name] = threading.Lock()
+
+    def get(self, name: str) -> Callable[[str], Dict[str, Any]]:
+        fn = self._loaded.get(name)
+        if fn is not None:
+            return fn
+        with self._locks[name]:
+            fn = self._loaded.get(name)
+            if fn is None:
+                module_name, attr = self._targets[name].split(":", 1)
+                start = time.perf_counter()
+                try:
+                    fn = getattr(importlib.import_module(module_name), attr)
+                except Exception as e:
+                    self._errors[name] = f"{type(e).__name__}: {e}"
+                    raise
+                self._load_ms[name] = int((time.perf_counter() - start) * 1000)
+                self._errors.pop(name, None)
+                self._loaded[name] = fn
+        return fn
+
+    def lazy(self, name: str) -> Callable[[Any], Any]:
+        """A detector fn (or batch_fn) that resolves the backend on first call (from the worker thread)."""
+        def call(text: Any) -> Any:
+            return self.get(name)(text)
+        call.__name__ = f"lazy_{name}"
+        return call
+
+    def warm(self, names: Optional[Iterable[str]] = None) -> Optional[threading.Thread]:
+        """Loads `names` (default: DETECTOR_WARM) on a background thread."""
+        if names is None:
+            raw = os.getenv("DETECTOR_WARM", "").strip()
+            names = list(self._targets) if raw == "all" else [n.strip() for n in raw.split(",") if n.strip()]
+        names = [n for n in names if n in self._targets]
+        self._warm_requested = names
+        if not names:
+            return None
+
+        def run() -> None:
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception:
+                    pass  # recorded in status(); a later call retries
+
+        t = threading.Thread(target=run, name="detector-warm", daemon=True)
+        t.start()
+        return t
+
+    def ready(self) -> bool:
+        """True once every detector requested for warm-up has loaded."""
+        return all(name in self._loaded for name in self._warm_requested)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "loaded": name in self._loaded,
+                "load_ms": self._load_ms.get(name),
+                "error": self._errors.get(name),
+                "warm": name in self._warm_requested,
+            }
+            for name in self._targets
+        }
@@ -28,10 +28,12 @@
 #         return str(e)
 
 from typing import Any, Dict, List, Optional, Union
-from presidio_analyzer import AnalyzerEngine
+from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine
 from guardrails import Guard
-from guardrails.hub import DetectPII, DetectJailbreak
-import regex as re
+from guardrails.hub import DetectJailbreak
+
+from logging_utils import log_event
+from scanner import scan_text
 
 PII_ENTITIES = [
     "EMAIL_ADDRESS",
@@ -41,20 +43,12 @@ PII_ENTITIES = [
     "PERSON",
     "LOCATION",
 ]
-PATTERNS = [
-    (re.compile(r"ignore (all|previous) instructions", re.I), 0.35),
-    (re.compile(r"reveal (the )?system prompt", re.I), 0.45),
-    (re.compile(r"you are (now )?(developer|system)", re.I), 0.25),
-    (re.compile(r"bypass|jailbreak|do anything now", re.I), 0.35),
-    (re.compile(r"call (the )?tool|use (the )?tool", re.I), 0.15),
-    (re.compile(r"exfiltrate|leak|dump|print secrets", re.I), 0.45),
-]
 
 
-_pii_guard = Guard().use_many(
-    DetectPII(pii_entities=PII_ENTITIES, on_fail="noop"),
-)
+# one Presidio pass per message; DetectPII would run the same analysis a second time
 analyzer = AnalyzerEngine()
+# batches run the spaCy pipeline over many texts at once (nlp.pipe) on the same engine
+batch_analyzer = BatchAnalyzerEngine(analyzer_engine=analyzer)
 
 _jb_guard = Guard().use(
     DetectJailbreak(on_fail="noop"),
@@ -90,45 +84,67 @@ def pii_passed(outcome: Any) -> Optional[bool]:
     return None if vp is None else bool(vp)
 
 
+def _pii_signals(results: Any) -> Dict[str, Any]:
+    spans = sorted(
+        ([r.start, r.end, r.entity_type, round(float(r.score), 3)] for r in results),
+        key=lambda s: (s[0], s[1]),
+    )
+    pii_any = bool(spans)
+
+    return {
+        "provider": "presidio",
+        "validationpii_passed": not pii_any,
+        "pii_any": pii_any,
+        "pii_entities": {s[2]: True for s in spans},
+        "pii_spans": spans,
+        "pii_hits": [],
+        "error": None,
+    }
+
+
+def _pii_error(e: Exception) -> Dict[str, Any]:
+    # Fail safe: if the detector errors, do NOT block; but expose telemetry
+    return {
+        "provider": "presidio",
+        "validation_passed": None,
+        "pii_any": False,
+        "pii_entities": [],
+        "pii_spans": [],
+        "pii_hits": [],
+        "error": f"{type(e).__name__}: {e}",
+    }
+
+
 def detect_pii_guardrails(input_text: str) -> Dict[str, Any]:
     """
-    Signal-only PII detection using Guardrails Hub DetectPII.
-    Returns a stable dict for your OPA input.
+    Signal-only PII detection from a single Presidio analysis.
+    Returns a stable dict for your OPA input; `pii_spans` ([start, end, entity, score])
+    are the same results, kept for span-based redaction.
     """
     try:
-        out = _pii_guard.parse(llm_output=input_text)
-        print("***82",out)
-        passed = pii_passed(out)
-        err = pii_error(out)
         results = analyzer.analyze(
                 text=input_text,
                 language="en",
                 entities=PII_ENTITIES
             )
+        log_event("DEBUG", "presidio_results", {"results": results})
+        return _pii_signals(results)
+    except Exception as e:
+        return _pii_error(e)
 
-        # If validationpii_passed == False => PII detected (most common behavior)
-        pii_any = (passed is False)
 
-        # Keep it simple + stable for OPA: include raw error text as "hits"
-        print(results[0])
-        return {
-            "provider": "guardrails",
-            "validationpii_passed": passed,
-            "pii_any": pii_any,
-            "pii_entities": {} if passed else {results[i].entity_type:True for i in range(len(results))},
-            "pii_hits": [],
-            "error": err or None,
-        }
+def detect_pii_guardrails_many(texts: List[str]) -> List[Dict[str, Any]]:
+    """detect_pii_guardrails for a batch of texts, with one spaCy pipe over all of them."""
+    try:
+        results = batch_analyzer.analyze_iterator(
+            texts,
+            language="en",
+            batch_size=max(1, len(texts)),
+            entities=PII_ENTITIES,
+        )
+        return [_pii_signals(r) for r in results]
     except Exception as e:
-        # Fail safe: if the detector errors, do NOT block; but expose telemetry
-        return {
-            "provider": "guardrails",
-            "validation_passed": None,
-            "pii_any": False,
-            "pii_entities": [],
-            "pii_hits": [],
-            "error": f"{type(e).__name__}: {e}",
-        }
+        return [_pii_error(e) for _ in texts]
 
 
 def injection_score_guardrails(input_text: str) -> Dict[str, Any]:
@@ -141,7 +157,7 @@ def injection_score_guardrails(input_text: str) -> Dict[str, Any]:
     """
     try:
         out = _jb_guard.parse(llm_output=input_text)
-        print("***126",out)
+        log_event("DEBUG", "jailbreak_validation", {"outcome": out})
         passed = pii_passed(out)
         err = pii_error(out)
 
@@ -199,17 +215,10 @@ def normalize_guardrails_signals(
     }
 
 def _heuristic_injection(text: str) -> Dict[str, Any]:
-    hits: List[str] = []
-    score = 0.0
-
-    for rx, weight in PATTERNS:
-        if rx.search(text):
-            hits.append(rx.pattern)
-            score += weight
-
+    scan = scan_text(text)
     return {
-        "score": min(1.0, score),
-        "hits": hits,
+        "score": scan.injection_score,
+        "hits": scan.injection_hits,
     }
 
 
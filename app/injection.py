@@ -1,28 +1,18 @@
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-# Heuristic patterns (simple + demoable)
-PATTERNS = [
-    (re.compile(r"ignore (all|previous) instructions", re.I), 0.35),
-    (re.compile(r"reveal (the )?system prompt", re.I), 0.45),
-    (re.compile(r"you are (now )?(developer|system)", re.I), 0.25),
-    (re.compile(r"bypass|jailbreak|do anything now", re.I), 0.35),
-    (re.compile(r"call (the )?tool|use (the )?tool", re.I), 0.15),
-    (re.compile(r"exfiltrate|leak|dump|print secrets", re.I), 0.45),
-]
+from logging_utils import log_event
+from scanner import INJECTION_RULES, ScanResult, scan_text
 
-def injection_score(text: str) -> Dict[str, Any]:
-    hits = []
-    score = 0.0
+# Heuristic patterns (simple + demoable); the rules themselves live in scanner.py
+PATTERNS = [(re.compile(r.pattern, r.flags), r.weight) for r in INJECTION_RULES]
 
-    for rx, w in PATTERNS:
-        if rx.search(text):
-            hits.append(rx.pattern)
-            score += w
-
-    # clamp 0..1
-    score = min(1.0, score)
-    print( ""f"[injection] score={score} hits={hits}" )
+def injection_score(text: str, scan: Optional[ScanResult] = None) -> Dict[str, Any]:
+    if scan is None or scan.text != text:
+        scan = scan_text(text)
+    hits = scan.injection_hits
+    score = scan.injection_score
+    log_event("DEBUG", "injection_score", {"score": score, "hits": hits})
     return {
         "injection_score": score,
         "injection_hits": hits
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from metrics import INJECTION_CASCADE_EXITS_TOTAL, INJECTION_TIER_LATENCY_MS
+from scanner import scan_text
+
+TierFn = Callable[[str], Dict[str, Any]]
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def heuristic_injection(text: str) -> Dict[str, Any]:
+    """Regex heuristics from the shared scanner; the cheapest tier."""
+    scan = scan_text(text)
+    return {
+        "provider": "heuristics",
+        "injection_score": scan.injection_score,
+        "injection_hits": scan.injection_hits,
+    }
+
+
+class Tier:
+    """
+    One detector in the cascade. `fn` returns {"injection_score", "injection_hits",
+    optional "validation_passed" / "error"}.
+
+    After the tier runs, a running score >= `block_at` ends the cascade (the pre stage
+    denies at 0.85 whatever the later tiers say). A running score < `clear_below` also
+    ends it, but only when the tier gave a verdict: no error, and validation_passed
+    not None for classifiers that report one.
+    """
+
+    def __init__(self, name: str, fn: TierFn, block_at: float, clear_below: float):
+        self.name = name
+        self.fn = fn
+        self.block_at = block_at
+        self.clear_below = clear_below
+
+    def cleared(self, out: Dict[str, Any], score: float) -> bool:
+        if out.get("error") or ("validation_passed" in out and out["validation_passed"] is None):
+            return False
+        return score < self.clear_below
+
+
+# (block_at, clear_below) per tier unless overridden by env. The regex tier never
+# clears on its own: no hit there is not evidence of a clean prompt.
+TIER_DEFAULTS: Dict[str, Tuple[float, float]] = {
+    "heuristics": (0.85, 0.0),
+    "classifier": (0.85, 0.35),
+    "nemo": (0.85, 0.0),
+}
+
+
+class InjectionCascade:
+    """
+    Prompt-injection detection in cost order: regex heuristics, then the local
+    classifier (Guardrails DetectJailbreak), then the NeMo rails (an LLM round-trip).
+    Each tier can end the cascade early (see Tier), so obvious attacks and clean
+    prompts never reach the expensive tier.
+
+    INJECTION_CASCADE_TIERS=heuristics,classifier,nemo
+    INJECTION_TIER_<NAME>_BLOCK_AT=0.85
+    INJECTION_TIER_<NAME>_CLEAR_BELOW=...      (heuristics 0, classifier 0.35, nemo 0)
+
+    The score is the maximum over the tiers that ran, and the hits are their union.
+    A tier that raises is recorded with status="error" and the cascade moves on.
+    The result carries `tiers` (name, score, status, ms per tier that ran) and
+    `exit` ({"tier", "reason": "block" | "clear" | "exhausted"}) for the audit trace.
+    """
+
+    def __init__(self, tiers: List[Tier]):
+        self.tiers = tiers
+
+    @classmethod
+    def from_env(cls, available: Mapping[str, TierFn]) -> "InjectionCascade":
+        raw = os.getenv("INJECTION_CASCADE_TIERS", "heuristics,classifier,nemo")
+        tiers: List[Tier] = []
+        for name in (n.strip() for n in raw.split(",") if n.strip()):
+            if name not in available:
+                continue
+            block_at, clear_below = TIER_DEFAULTS.get(name, (0.85, 0.0))
+            key = name.upper()
+            tiers.append(Tier(
+                name,
+                available[name],
+                block_at=_env_float(f"INJECTION_TIER_{key}_BLOCK_AT", block_at),
+                clear_below=_env_float(f"INJECTION_TIER_{key}_CLEAR_BELOW", clear_below),
+            ))
+        return cls(tiers)
+
+    @property
+    def config(self) -> str:
+        """Tier order and thresholds; part of the detector cache key."""
+        return ",".join(f"{t.name}:{t.block_at}:{t.clear_below}" for t in self.tiers)
+
+    def run(self, text: str) -> Dict[str, Any]:
+        score = 0.0
+        hits: List[str] = []
+        passed: Optional[bool] = None
+        trace: List[Dict[str, Any]] = []
+        exit_reason = "exhausted"
+        exit_tier = self.tiers[-1].name if self.tiers else None
+
+        for tier in self.tiers:
+            start = time.perf_counter()
+            try:
+                out = tier.fn(text)
+                status = "ok"
+            except Exception as e:
+                out = {"error": f"{type(e).__name__}: {e}"}
+                status = "error"
+            ms = (time.perf_counter() - start) * 1000
+            INJECTION_TIER_LATENCY_MS.labels(tier=tier.name).observe(ms)
+
+            tier_score = float(out.get("injection_score") or 0.0)
+            score = max(score, tier_score)
+            for h in out.get("injection_hits") or []:
+                if h not in hits:
+                    hits.append(h)
+            if out.get("validation_passed") is not None:
+                passed = out["validation_passed"] if passed is not False else False
+            entry: Dict[str, Any] = {"tier": tier.name, "score": tier_score, "status": status, "ms": round(ms, 3)}
+            if out.get("error"):
+                entry["error"] = str(out["error"])
+            trace.append(entry)
+
+            if score >= tier.block_at:
+                exit_reason, exit_tier = "block", tier.name
+                break
+            if tier.cleared(out, score):
+                exit_reason, exit_tier = "clear", tier.name
+                break
+
+        INJECTION_CASCADE_EXITS_TOTAL.labels(tier=exit_tier or "none", reason=exit_reason).inc()
+        errors = [f"{t['tier']}: {t['error']}" for t in trace if t["status"] == "error"]
+        return {
+            "provider": "cascade:" + "+".join(t["tier"] for t in trace),
+            "error": "; ".join(errors) or None,
+            "validation_passed": passed,
+            "injection_score": min(1.0, score),
+            "injection_hits": hits,
+            "tiers": trace,
+            "exit": {"tier": exit_tier, "reason": exit_reason},
+        }
@@ -0,0 +1,110 @@
+"""
+Exact-match cache for LLM completions, in front of acall_llm.
+
+Keys hash the prompt, model, max_tokens and system prompt, plus the policy revision
+and the action the pre-LLM stages settled on. A policy change or a different
+action therefore never reuses an old completion. A hit is only a replacement for
+the upstream call: the response stage still evaluates the cached text.
+
+LLM_CACHE_ENABLED=true
+LLM_CACHE_MAX_ENTRIES=1000        (memory tier, LRU)
+LLM_CACHE_TTL_S=3600
+LLM_CACHE_DISK_PATH=              (optional SQLite tier shared by workers; empty = off)
+LLM_CACHE_OPT_OUT_ROLES=          (comma-separated user roles that never read or write the cache)
+"""
+from __future__ import annotations
+
+import copy
+import os
+import time
+from typing import Any, Dict, Optional
+
+from decision_cache import canonical_hash
+from lru import SQLiteTTLStore, TTLLRUCache
+from metrics import LLM_CACHE_BYPASS_TOTAL, LLM_CACHE_HITS_TOTAL, LLM_CACHE_MISSES_TOTAL
+
+# llm_out fields worth caching; latency is re-measured on a hit
+_CACHED_FIELDS = ("provider", "model", "output_text", "tokens_estimate")
+
+
+class LLMCache:
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_s: Optional[float] = None,
+        disk_path: Optional[str] = None,
+    ):
+        self.enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        ttl = ttl_s if ttl_s is not None else float(os.getenv("LLM_CACHE_TTL_S", "3600"))
+        self._memory: TTLLRUCache[Dict[str, Any]] = TTLLRUCache(
+            max_entries if max_entries is not None else int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+            ttl,
+        )
+        path = disk_path if disk_path is not None else os.getenv("LLM_CACHE_DISK_PATH", "")
+        self._disk: Optional[SQLiteTTLStore] = SQLiteTTLStore(path, "llm_cache", ttl) if (self.enabled and path) else None
+        self.opt_out_roles = {
+            r.strip() for r in os.getenv("LLM_CACHE_OPT_OUT_ROLES", "").split(",") if r.strip()
+        }
+
+    def applies_to(self, user_role: str) -> bool:
+        if not self.enabled:
+            return False
+        if user_role in self.opt_out_roles:
+            LLM_CACHE_BYPASS_TOTAL.labels(reason="role_opt_out").inc()
+            return False
+        return True
+
+    @staticmethod
+    def key(
+        *,
+        message: str,
+        model: str,
+        max_tokens: int,
+        system_prompt: str,
+        policy_revision: str,
+        policy_version: Optional[str],
+        action: str,
+    ) -> str:
+        return canonical_hash([message, model, max_tokens, system_prompt, policy_revision, policy_version, action])
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns a fresh llm_out dict marked with "cache", or None on a miss."""
+        start = time.time()
+        tier = "memory"
+        value = self._memory.get(key)
+        if value is None and self._disk is not None:
+            value = self._disk.get(key)
+            if value is not None:
+                tier = "disk"
+                self._memory.put(key, value)
+        if value is None:
+            LLM_CACHE_MISSES_TOTAL.inc()
+            return None
+        LLM_CACHE_HITS_TOTAL.labels(tier=tier).inc()
+        out = copy.deepcopy(value)
+        out["latency_ms"] = int((time.time() - start) * 1000)
+        out["cache"] = {"hit": True, "tier": tier, "key": key[:16]}
+        return out
+
+    def put(self, key: str, llm_out: Dict[str, Any]) -> None:
+        value = {k: copy.deepcopy(llm_out.get(k)) for k in _CACHED_FIELDS}
+        self._memory.put(key, value)
+        if self._disk is not None:
+            self._disk.put(key, value)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        if self._disk is None:
+            return self.get(key)
+        from fastapi.concurrency import run_in_threadpool
+        return await run_in_threadpool(self.get, key)
+
+    async def aput(self, key: str, llm_out: Dict[str, Any]) -> None:
+        if self._disk is None:
+            self.put(key, llm_out)
+            return
+        from fastapi.concurrency import run_in_threadpool
+        await run_in_threadpool(self.put, key, llm_out)
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
@@ -1,12 +1,196 @@
+"""
+Structured, non-blocking logging.
+
+log_event() checks the level and the event's sample rate. A record that passes is
+appended to an in-memory ring buffer, and that is all the caller pays. A daemon thread
+drains the buffer every LOG_FLUSH_INTERVAL_MS. It redacts each record, encodes it as
+one JSON line (orjson when installed) and writes the batch to stdout. When the buffer
+is full, the oldest records are dropped and counted in logs_dropped_total; the request
+path never waits on stdout.
+
+LOG_LEVEL=INFO                  (DEBUG | INFO | WARNING | ERROR)
+LOG_SAMPLE=                     (per-event keep rates, e.g. "policy_decision=0.1,debug.signals=1")
+LOG_BUFFER_SIZE=10000
+LOG_FLUSH_INTERVAL_MS=200
+LOG_REDACT=true                 (replace message bodies and detector payloads, see LOG_REDACT_FIELDS)
+LOG_REDACT_FIELDS=message,prompt,text,output_text,content,query,sql_query,pii,pii_entities,pii_spans,response,outcome
+
+Redacted values keep their length and a short hash, so identical prompts can still be
+correlated across records. Debug traces are DEBUG events, off unless LOG_LEVEL=DEBUG.
+"""
+from __future__ import annotations
+
+import atexit
+import collections
+import hashlib
 import json
-from datetime import datetime
-from typing import Any, Dict
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+from metrics import LOGS_DROPPED_TOTAL
+
+try:  # faster encoder; stdlib json is the fallback
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:  # pragma: no cover - depends on environment
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+_DEFAULT_REDACT_FIELDS = (
+    "message,prompt,text,output_text,content,query,sql_query,pii,pii_entities,pii_spans,response,outcome"
+)
+
+
+def _parse_rates(raw: str) -> Dict[str, float]:
+    rates: Dict[str, float] = {}
+    for part in raw.split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            try:
+                rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+            except ValueError:
+                continue
+    return rates
+
+
+def _redacted(value: Any) -> Dict[str, Any]:
+    if isinstance(value, str):
+        digest = hashlib.sha256(value.encode("utf-8", "replace")).hexdigest()[:12]
+        return {"redacted": True, "len": len(value), "sha256": digest}
+    return {"redacted": True, "type": type(value).__name__}
+
+
+def redact(obj: Any, fields: frozenset) -> Any:
+    """Copy of `obj` with the values of `fields` (at any depth) replaced by _redacted()."""
+    if isinstance(obj, dict):
+        return {k: _redacted(v) if k in fields and v is not None else redact(v, fields) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [redact(v, fields) for v in obj]
+    return obj
+
+
+class StructuredLogger:
+    def __init__(
+        self,
+        level: str = "INFO",
+        sample: Dict[str, float] | None = None,
+        buffer_size: int = 10000,
+        flush_interval_s: float = 0.2,
+        redact_fields: frozenset = frozenset(),
+        write: Callable[[bytes], None] | None = None,
+    ):
+        self.threshold = LEVELS.get(level.upper(), 20)
+        self.sample = sample or {}
+        self.flush_interval_s = flush_interval_s
+        self.redact_fields = redact_fields
+        self._write = write or self._write_stdout
+        self._buffer: Deque[Tuple[float, str, str, Dict[str, Any]]] = collections.deque(maxlen=max(1, buffer_size))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_env(cls) -> "StructuredLogger":
+        redact_on = os.getenv("LOG_REDACT", "true").lower() == "true"
+        fields = os.getenv("LOG_REDACT_FIELDS", _DEFAULT_REDACT_FIELDS)
+        return cls(
+            level=os.getenv("LOG_LEVEL", "INFO"),
+            sample=_parse_rates(os.getenv("LOG_SAMPLE", "")),
+            buffer_size=int(os.getenv("LOG_BUFFER_SIZE", "10000")),
+            flush_interval_s=float(os.getenv("LOG_FLUSH_INTERVAL_MS", "200")) / 1000.0,
+            redact_fields=frozenset(f.strip() for f in fields.split(",") if f.strip()) if redact_on else frozenset(),
+        )
+
+    def enabled(self, level: str) -> bool:
+        """Level check only; use it to skip building an expensive payload."""
+        return LEVELS.get(level, 20) >= self.threshold
+
+    def log(self, level: str, event: str, payload: Dict[str, Any]) -> None:
+        if LEVELS.get(level, 20) < self.threshold:
+            return
+        rate = self.sample.get(event, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            LOGS_DROPPED_TOTAL.inc()
+        self._buffer.append((time.time(), level, event, dict(payload)))
+        if LEVELS.get(level, 20) >= LEVELS["ERROR"]:
+            self._wake.set()
+
+    def _encode(self, item: Tuple[float, str, str, Dict[str, Any]]) -> bytes:
+        ts, level, event, payload = item
+        head = {
+            "ts": datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat(),
+            "level": level,
+            "event": event,
+        }
+        try:
+            return _dumps({**head, **(redact(payload, self.redact_fields) if self.redact_fields else payload)})
+        except Exception as e:  # payload mutated meanwhile or unencodable: keep the event, not the payload
+            return _dumps({**head, "log_error": f"{type(e).__name__}: {e}"})
+
+    @staticmethod
+    def _write_stdout(data: bytes) -> None:
+        out = getattr(sys.stdout, "buffer", None)
+        if out is not None:
+            out.write(data)
+        else:
+            sys.stdout.write(data.decode("utf-8", "replace"))
+        sys.stdout.flush()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            lines: List[bytes] = []
+            while self._buffer:
+                try:
+                    lines.append(self._encode(self._buffer.popleft()))
+                except IndexError:
+                    break
+            if lines:
+                try:
+                    self._write(b"\n".join(lines) + b"\n")
+                except Exception:
+                    pass  # stdout closed (shutdown): the records are lost, the caller is not
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self.flush()
+
+
+logger = StructuredLogger.from_env()
+logger.start()
+atexit.register(logger.close)
+
 
 def log_event(level: str, event: str, payload: Dict[str, Any]) -> None:
-    record = {
-        "ts": datetime.utcnow().isoformat(),
-        "level": level,
-        "event": event,
-        **payload,
-    }
-    print(json.dumps(record, ensure_ascii=False))
+    logger.log(level, event, payload)
+
+
+def log_enabled(level: str) -> bool:
+    return logger.enabled(level)
@@ -1,45 +1,63 @@
 # app/main.py
 from __future__ import annotations
 
+import asyncio
+import json
+import os
 import re
-from typing import Any, Dict, Optional, Tuple
+import time
+from contextlib import aclosing, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
-from test import injection_nemo
-from fastapi import FastAPI
-from fastapi.responses import Response
-from prometheus_client import generate_latest
+try:  # .env is loaded before any module reads its settings
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 
 from policy_engine import PolicyEngine
-from audit import init_db, write_audit
+from audit import awrite_audit, get_audit, init_db, query_audit, shutdown_audit
+from decision_cache import canonical_hash
+from detector_cache import DetectorCache
+from detectors import Detector, DetectorFanout, DetectorRegistry, detector_status
 from metrics import (
     REQUESTS_TOTAL,
+    REQUESTS_COALESCED_TOTAL,
+    REQUESTS_IN_FLIGHT,
+    REQUEST_LATENCY_MS,
+    PIPELINE_STAGE_LATENCY_MS,
     POLICY_DENIES_TOTAL,
     TOOL_CALLS_TOTAL,
     LLM_CALLS_TOTAL,
-    LLM_LATENCY_MS,
+    LLM_FIRST_TOKEN_MS,
+    mark_process_dead,
+    observe_ms,
+    render as render_metrics,
 )
 from models import ChatRequest, ChatResponse
 from pii import detect_pii, pii_any
-from guardrailspii import *
 from injection import injection_score
+from injection_cascade import InjectionCascade, heuristic_injection
+from scanner import ScanResult, external_pii_spans, redact_pii_spans, scan_text, scan_texts
+from singleflight import SingleFlight
 from logging_utils import log_event
 from tools import ToolProxy, analyze_sql, get_domain
-from llm import call_llm
-from test import *
-
-EMAIL_RE = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
-PHONE_RE = re.compile(r"(\+?91[\s-]?)?\b[6-9]\d{9}\b")
-AADHAAR_LIKE_RE = re.compile(r"\b\d{4}[\s-]?\d{4}[\s-]?\d{4}\b")
+from llm import SYSTEM_PROMPT, acall_llm, aclose_llm, astream_llm, streamed_llm_out
+from llm_cache import LLMCache
+from stream_guard import StreamLeakGuard, load_leak_markers
 
 SQL_LIMIT_RE = re.compile(r"(?is)\blimit\s+\d+\b")
 SQL_DESTRUCTIVE_RE = re.compile(r"(?is)\b(drop|delete|truncate|alter|update|insert|merge|replace|create|rename)\b")
 
 
-def redact_pii(text: str) -> str:
-    text = EMAIL_RE.sub("[REDACTED_EMAIL]", text)
-    text = PHONE_RE.sub("[REDACTED_PHONE]", text)
-    text = AADHAAR_LIKE_RE.sub("[REDACTED_ID]", text)
-    return text
+def redact_pii(text: str, scan: Optional[ScanResult] = None) -> str:
+    # span-based; reuses `scan` when it was computed for this exact text
+    return redact_pii_spans(text, scan)
 
 
 def redact_tool_output(obj: Any) -> Any:
@@ -54,10 +72,14 @@ def redact_tool_output(obj: Any) -> Any:
     return obj
 
 
+# guardrails keys kept for the audit trace only, not passed to policy
+TRACE_ONLY_GUARDRAILS = frozenset({"injection_cascade", "detector_cache"})
+
+
 def build_signals(req: ChatRequest, guardrails: Dict[str, Any]) -> Dict[str, Any]:
     signals: Dict[str, Any] = {
         "user_role": req.user_role,
-        **guardrails,
+        **{k: v for k, v in guardrails.items() if k not in TRACE_ONLY_GUARDRAILS},
     }
 
     if req.tool is not None:
@@ -104,7 +126,12 @@ def normalize_decision(decision: Dict[str, Any]) -> Tuple[Dict[str, Any], str, s
     return decision, action, mode, would_deny
 
 
-def apply_action(action: str, message: str, tool: Optional[Any]) -> Tuple[str, Optional[Any]]:
+def apply_action(
+    action: str,
+    message: str,
+    tool: Optional[Any],
+    scan: Optional[ScanResult] = None,
+) -> Tuple[str, Optional[Any]]:
     """
     Applies actions in a single place so behavior is consistent across stages.
     """
@@ -112,7 +139,7 @@ def apply_action(action: str, message: str, tool: Optional[Any]) -> Tuple[str, O
     effective_tool = tool
 
     if action == "redact_and_allow":
-        effective_message = redact_pii(effective_message)
+        effective_message = redact_pii(effective_message, scan)
 
     if action == "allow_no_tools":
         effective_tool = None
@@ -128,7 +155,18 @@ def apply_action(action: str, message: str, tool: Optional[Any]) -> Tuple[str, O
     return effective_message, effective_tool
 
 
-def make_deny_response(
+def with_audit_context(resp: ChatResponse, audit_payload: Dict[str, Any]) -> ChatResponse:
+    """Keeps the promoted at_stage / tool_name of `resp`'s audit row for coalesced followers."""
+    signals = audit_payload.get("signals") or {}
+    effective_tool = audit_payload.get("effective_tool") or {}
+    resp._audit_context = {
+        "at_stage": (audit_payload.get("final") or {}).get("at_stage"),
+        "tool_name": signals.get("tool_name") or effective_tool.get("name"),
+    }
+    return resp
+
+
+async def make_deny_response(
     *,
     req: ChatRequest,
     decision: Dict[str, Any],
@@ -150,7 +188,7 @@ def make_deny_response(
         "final": {"decision": "deny", "at_stage": at_stage},
         "tool_result": tool_result,
     }
-    audit_id = write_audit(req.user_role, decision, audit_payload)
+    audit_id = await awrite_audit(req.user_role, decision, audit_payload)
 
     log_event(
         "INFO",
@@ -164,7 +202,7 @@ def make_deny_response(
         },
     )
 
-    return ChatResponse(
+    return with_audit_context(ChatResponse(
         audit_id=audit_id,
         decision="deny",
         rule_id=decision.get("rule_id"),
@@ -173,53 +211,108 @@ def make_deny_response(
         guardrails={**guardrails, "mode": mode, "action": action, "would_deny": False},
         tool_result=tool_result,
         llm=None,
-    )
+    ), audit_payload)
 
 
 app = FastAPI(title="GenAI Policy Gateway")
 
 policy_engine = PolicyEngine()
 tool_proxy = ToolProxy()
+LEAK_MARKERS = load_leak_markers()
+llm_cache = LLMCache()
+inflight: SingleFlight[ChatResponse] = SingleFlight()
+
+LLM_MODEL = "gpt-4o-mini"
+LLM_MAX_TOKENS = 300
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_CONCURRENCY = max(1, int(os.getenv("BATCH_CONCURRENCY", "16")))
+
+# heavy backends (Guardrails/Presidio, NeMo) are imported on first use, not at startup
+detector_registry = DetectorRegistry()
+detector_registry.register("guardrails_pii", "guardrailspii:detect_pii_guardrails")
+detector_registry.register("guardrails_pii_batch", "guardrailspii:detect_pii_guardrails_many")
+detector_registry.register("guardrails_jailbreak", "guardrailspii:injection_score_guardrails")
+detector_registry.register("nemo_jailbreak", "test:nemo_jailbreak")
+
+# cheapest first; a confident tier ends the cascade before the NeMo (LLM) tier runs
+injection_cascade = InjectionCascade.from_env({
+    "heuristics": heuristic_injection,
+    "classifier": detector_registry.lazy("guardrails_jailbreak"),
+    "nemo": detector_registry.lazy("nemo_jailbreak"),
+})
+
+guardrails_detectors = DetectorFanout([
+    Detector(
+        "pii",
+        detector_registry.lazy("guardrails_pii"),
+        batch_fn=detector_registry.lazy("guardrails_pii_batch"),
+        fallback={"provider": "presidio", "pii_any": False, "pii_entities": {}, "pii_spans": [], "pii_hits": []},
+        cache_version="presidio:v1",
+    ),
+    Detector(
+        "injection",
+        injection_cascade.run,
+        fallback={"provider": "cascade", "injection_score": 0.0, "injection_hits": []},
+        cache_version=injection_cascade.config,
+        normalize=str.strip,
+    ),
+], cache=DetectorCache())
 
 
 @app.on_event("startup")
 def startup():
     init_db()
+    detector_registry.warm()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await policy_engine.aclose()
+    await tool_proxy.aclose()
+    await aclose_llm()
+    guardrails_detectors.shutdown()
+    llm_cache.close()
+    shutdown_audit()
+    mark_process_dead()
+
+
+def timed_stage(stage: str):
+    """Context manager recording one pipeline stage in PIPELINE_STAGE_LATENCY_MS."""
+    return observe_ms(PIPELINE_STAGE_LATENCY_MS.labels(stage=stage))
 
-@app.post("/getAns/guardRailsAI", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    REQUESTS_TOTAL.inc()
-    print(req.message)
-    
-    pii = detect_pii_guardrails(req.message)
-    inj = injection_nemo(req.message)
-    print(pii)
-    guardrails: Dict[str, Any] = {
-        "pii": pii.get('pii_entities'),
-        "pii_any": bool(pii.get("pii_any", False)),
-        "injection_score": float(inj.get("injection_score", 0.0)),
-        "injection_hits": inj.get("injection_hits", []),
-    }
-    # signals = normalize_guardrails_signals(
-    #     user_role=req.user_role,
-    #     pii_out=pii,
-    #     inj_out=inj,
-    #     tool_name=req.tool.name if req.tool else "string",
-    # )
-    print("**193",guardrails)
-    signals = build_signals(req, guardrails)
 
-    print("***202",signals)
-    # return ChatResponse(
-    #     audit_id="debug-audit-id",
-    #     decision="allow",
-    #     rule_id=None,
-    #     reason="Guardrails signal-only stub",
-    #     policy_version="debug-v1",
-    #     guardrails={},
-    #     tool_result=None,
-    #     llm=None,
-    # )
+@contextmanager
+def tracked(endpoint: str) -> Iterator[None]:
+    """In-flight gauge and end-to-end latency for one request to `endpoint`."""
+    with REQUESTS_IN_FLIGHT.labels(endpoint=endpoint).track_inprogress():
+        with observe_ms(REQUEST_LATENCY_MS.labels(endpoint=endpoint)):
+            yield
+
+
+async def tracked_stream(endpoint: str, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """`tracked` for a streamed response: the request lasts until its last chunk is sent."""
+    with tracked(endpoint):
+        async with aclosing(body) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+
+async def run_pre_llm_stages(
+    req: ChatRequest,
+    guardrails: Dict[str, Any],
+    scan: Optional[ScanResult] = None,
+    pre: Optional[Dict[str, Any]] = None,
+) -> Union[ChatResponse, Dict[str, Any]]:
+    """
+    Runs pre -> tool -> (tool execution) -> post. Returns the deny ChatResponse if a
+    stage blocked, otherwise the pipeline state the LLM call and response stage continue
+    from. `scan` is the scanner pass over req.message, reused for redaction while the
+    message is unchanged. `pre` is the pre-stage decision when it was already evaluated
+    (in bulk, for a batch).
+    """
+    signals = build_signals(req, guardrails)
+    log_event("DEBUG", "signals", {"signals": signals})
     stage_trace: Dict[str, Any] = {
         "guardrails": guardrails,
         "signals": signals,
@@ -229,22 +322,22 @@ def chat(req: ChatRequest):
     effective_message = req.message
     effective_tool = req.tool
     tool_result: Optional[Any] = None
-    llm_out: Optional[Dict[str, Any]] = None
 
     final_mode = "enforce"
     final_action = "allow"
     final_would_deny = False
     final_decision_obj: Optional[Dict[str, Any]] = None
 
-
-    pre = policy_engine.evaluate_stage(
-        stage="pre",
-        message=effective_message,
-        signals=signals,
-        tool=effective_tool,
-        tool_result=None,
-        llm_out=None,
-    )
+    if pre is None:
+        with timed_stage("policy_pre"):
+            pre = await policy_engine.aevaluate_stage(
+                stage="pre",
+                message=effective_message,
+                signals=signals,
+                tool=effective_tool,
+                tool_result=None,
+                llm_out=None,
+            )
     pre, pre_action, mode, would_deny = normalize_decision(pre)
     stage_trace["stages"]["pre"] = {"decision": pre, "action": pre_action, "mode": mode, "would_deny": would_deny}
 
@@ -254,7 +347,7 @@ def chat(req: ChatRequest):
     final_decision_obj = pre
 
     if pre_action == "deny" and not would_deny:
-        return make_deny_response(
+        return await make_deny_response(
             req=req,
             decision=pre,
             guardrails=guardrails,
@@ -264,17 +357,18 @@ def chat(req: ChatRequest):
             stage_trace=stage_trace,
         )
 
-    effective_message, effective_tool = apply_action(pre_action, effective_message, effective_tool)
+    effective_message, effective_tool = apply_action(pre_action, effective_message, effective_tool, scan)
 
     if effective_tool is not None:
-        tool_dec = policy_engine.evaluate_stage(
-            stage="tool",
-            message=effective_message,
-            signals=signals,
-            tool=effective_tool,
-            tool_result=None,
-            llm_out=None,
-        )
+        with timed_stage("policy_tool"):
+            tool_dec = await policy_engine.aevaluate_stage(
+                stage="tool",
+                message=effective_message,
+                signals=signals,
+                tool=effective_tool,
+                tool_result=None,
+                llm_out=None,
+            )
         tool_dec, tool_action, mode2, would_deny2 = normalize_decision(tool_dec)
         stage_trace["stages"]["tool"] = {
             "decision": tool_dec,
@@ -289,7 +383,7 @@ def chat(req: ChatRequest):
         final_decision_obj = tool_dec
 
         if tool_action == "deny" and not would_deny2:
-            return make_deny_response(
+            return await make_deny_response(
                 req=req,
                 decision=tool_dec,
                 guardrails=guardrails,
@@ -299,23 +393,25 @@ def chat(req: ChatRequest):
                 stage_trace=stage_trace,
             )
 
-        effective_message, effective_tool = apply_action(tool_action, effective_message, effective_tool)
+        effective_message, effective_tool = apply_action(tool_action, effective_message, effective_tool, scan)
 
     # Execute tool (only if still present)
     if effective_tool is not None:
         TOOL_CALLS_TOTAL.labels(tool=effective_tool.name).inc()
-        raw_tool_result = tool_proxy.execute(effective_tool.name, effective_tool.args)
+        with timed_stage("tool_call"):
+            raw_tool_result = await tool_proxy.aexecute(effective_tool.name, effective_tool.args)
         tool_result = redact_tool_output(raw_tool_result)
 
 
-    post = policy_engine.evaluate_stage(
-        stage="post",
-        message=effective_message,
-        signals=signals,
-        tool=effective_tool,
-        tool_result=tool_result,
-        llm_out=None,
-    )
+    with timed_stage("policy_post"):
+        post = await policy_engine.aevaluate_stage(
+            stage="post",
+            message=effective_message,
+            signals=signals,
+            tool=effective_tool,
+            tool_result=tool_result,
+            llm_out=None,
+        )
     post, post_action, mode3, would_deny3 = normalize_decision(post)
     stage_trace["stages"]["post"] = {"decision": post, "action": post_action, "mode": mode3, "would_deny": would_deny3}
 
@@ -325,7 +421,7 @@ def chat(req: ChatRequest):
     final_decision_obj = post
 
     if post_action == "deny" and not would_deny3:
-        return make_deny_response(
+        return await make_deny_response(
             req=req,
             decision=post,
             guardrails=guardrails,
@@ -336,32 +432,59 @@ def chat(req: ChatRequest):
             tool_result=tool_result,
         )
 
-    effective_message, _ = apply_action(post_action, effective_message, None)
+    effective_message, _ = apply_action(post_action, effective_message, None, scan)
 
+    return {
+        "signals": signals,
+        "stage_trace": stage_trace,
+        "message": effective_message,
+        "tool": effective_tool,
+        "tool_result": tool_result,
+        "final": {
+            "mode": final_mode,
+            "action": final_action,
+            "would_deny": final_would_deny,
+            "decision_obj": final_decision_obj,
+        },
+    }
 
-    with LLM_LATENCY_MS.time():
-        LLM_CALLS_TOTAL.inc()
-        llm_out = call_llm(effective_message, model="gpt-4o-mini", max_tokens=300)
 
-    resp = policy_engine.evaluate_stage(
-        stage="response",
-        message=effective_message,
-        signals=signals,
-        tool=effective_tool,
-        tool_result=tool_result,
-        llm_out=llm_out,
-    )
+async def evaluate_response_stage(state: Dict[str, Any], llm_out: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], str, str, bool]:
+    with timed_stage("policy_response"):
+        resp = await policy_engine.aevaluate_stage(
+            stage="response",
+            message=state["message"],
+            signals=state["signals"],
+            tool=state["tool"],
+            tool_result=state["tool_result"],
+            llm_out=llm_out,
+        )
     resp, resp_action, mode4, would_deny4 = normalize_decision(resp)
-    stage_trace["stages"]["response"] = {"decision": resp, "action": resp_action, "mode": mode4, "would_deny": would_deny4}
+    state["stage_trace"]["stages"]["response"] = {"decision": resp, "action": resp_action, "mode": mode4, "would_deny": would_deny4}
+    return resp, resp_action, mode4, would_deny4
+
+
+async def finish_pipeline(
+    req: ChatRequest,
+    guardrails: Dict[str, Any],
+    state: Dict[str, Any],
+    llm_out: Optional[Dict[str, Any]],
+    response_decision: Tuple[Dict[str, Any], str, str, bool],
+) -> ChatResponse:
+    """Applies the response-stage decision, writes the audit row and builds the ChatResponse."""
+    resp, resp_action, mode4, would_deny4 = response_decision
+    stage_trace = state["stage_trace"]
+    effective_tool = state["tool"]
+    tool_result = state["tool_result"]
 
     final_mode = mode4
     final_action = resp_action
-    final_would_deny = final_would_deny or would_deny4
+    final_would_deny = state["final"]["would_deny"] or would_deny4
     final_decision_obj = resp
 
     if resp_action == "deny" and not would_deny4:
         # IMPORTANT: deny => llm must be None
-        return make_deny_response(
+        return await make_deny_response(
             req=req,
             decision=resp,
             guardrails=guardrails,
@@ -385,11 +508,11 @@ def chat(req: ChatRequest):
         },
         "effective_tool": None if effective_tool is None else {"name": effective_tool.name, "args": effective_tool.args},
         "tool_result": tool_result,
-        "llm": {k: llm_out.get(k) for k in ["provider", "model", "latency_ms", "tokens_estimate"]} if llm_out else None,
+        "llm": {k: llm_out.get(k) for k in ["provider", "model", "latency_ms", "tokens_estimate", "cache"]} if llm_out else None,
     }
-    audit_id = write_audit(req.user_role, final_decision_obj or {}, audit_payload)
+    audit_id = await awrite_audit(req.user_role, final_decision_obj or {}, audit_payload)
 
-    return ChatResponse(
+    return with_audit_context(ChatResponse(
         audit_id=audit_id,
         decision=final_decision_obj.get("decision", "allow") if final_decision_obj else "allow",
         rule_id=final_decision_obj.get("rule_id") if final_decision_obj else None,
@@ -398,205 +521,405 @@ def chat(req: ChatRequest):
         guardrails={**guardrails, "mode": final_mode, "action": final_action, "would_deny": final_would_deny},
         tool_result=tool_result,
         llm=llm_out,
+    ), audit_payload)
+
+
+def llm_cache_key(req: ChatRequest, state: Dict[str, Any]) -> Optional[str]:
+    """Response-cache key for this request's LLM call, or None when the cache does not apply."""
+    if not llm_cache.applies_to(req.user_role):
+        return None
+    decision = state["final"].get("decision_obj") or {}
+    return LLMCache.key(
+        message=state["message"],
+        model=LLM_MODEL,
+        max_tokens=LLM_MAX_TOKENS,
+        system_prompt=SYSTEM_PROMPT,
+        policy_revision=policy_engine.policy_revision(),
+        policy_version=decision.get("policy_version"),
+        action=state["final"]["action"],
     )
 
-@app.post("/getAns", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    REQUESTS_TOTAL.inc()
 
-    pii = detect_pii(req.message)
-    inj = injection_score(req.message)
-    print(pii)
-    guardrails: Dict[str, Any] = {
-        "pii": pii,
-        "pii_any": pii_any(pii),
-        "injection_score": inj.get("injection_score", 0.0),
-        "injection_hits": inj.get("injection_hits", []),
+async def run_pipeline(
+    req: ChatRequest,
+    guardrails: Dict[str, Any],
+    scan: Optional[ScanResult] = None,
+    pre: Optional[Dict[str, Any]] = None,
+) -> ChatResponse:
+    """
+    Runs the staged policy pipeline (pre -> tool -> post -> response) for a request
+    whose guardrail signals have already been computed.
+    """
+    state = await run_pre_llm_stages(req, guardrails, scan, pre)
+    if isinstance(state, ChatResponse):
+        return state
+
+    # a cached completion replaces only the upstream call; the response stage still runs on it
+    cache_key = llm_cache_key(req, state)
+    with timed_stage("llm"):
+        llm_out = await llm_cache.aget(cache_key) if cache_key else None
+        if llm_out is None:
+            # upstream latency and slot wait are recorded by the provider layer (llm.py)
+            LLM_CALLS_TOTAL.inc()
+            llm_out = await acall_llm(state["message"], model=LLM_MODEL, max_tokens=LLM_MAX_TOKENS)
+            if cache_key:
+                await llm_cache.aput(cache_key, llm_out)
+                llm_out["cache"] = {"hit": False, "key": cache_key[:16]}
+
+    decision = await evaluate_response_stage(state, llm_out)
+    return await finish_pipeline(req, guardrails, state, llm_out, decision)
+
+
+async def coalesced(endpoint: str, req: ChatRequest, run: Callable[[], Awaitable[ChatResponse]]) -> ChatResponse:
+    """
+    Concurrent identical requests (same endpoint, message, user_role and tool) share
+    one pipeline run. Each follower still gets its own audit row, carrying the
+    leader's decision and pointing to the leader's audit_id for the full trace.
+    """
+    if not inflight.enabled:
+        return await run()
+    resp, leader = await inflight.do(request_key(endpoint, req), run)
+    if leader:
+        return resp
+    return await follower_response(endpoint, req, resp)
+
+
+def request_key(endpoint: str, req: ChatRequest) -> str:
+    """Requests with the same key get the same pipeline result."""
+    tool = None if req.tool is None else {"name": req.tool.name, "args": req.tool.args}
+    return canonical_hash([endpoint, req.message, req.user_role, tool])
+
+
+async def follower_response(endpoint: str, req: ChatRequest, resp: ChatResponse) -> ChatResponse:
+    """`resp` (the leader's result) for a coalesced request, with the follower's own audit row."""
+    REQUESTS_COALESCED_TOTAL.labels(endpoint=endpoint).inc()
+    decision_obj = {
+        "decision": resp.decision,
+        "rule_id": resp.rule_id,
+        "reason": resp.reason,
+        "policy_version": resp.policy_version,
+        "mode": resp.guardrails.get("mode"),
+        "action": resp.guardrails.get("action"),
     }
+    leader = resp._audit_context
+    audit_id = await awrite_audit(req.user_role, decision_obj, {
+        "coalesced": {"leader_audit_id": resp.audit_id, "endpoint": endpoint},
+        "final": {
+            "decision": resp.decision,
+            "at_stage": leader.get("at_stage"),
+            "mode": resp.guardrails.get("mode"),
+            "action": resp.guardrails.get("action"),
+            "would_deny": resp.guardrails.get("would_deny"),
+        },
+        # the leader's promoted tool name (same request key => same requested tool)
+        "signals": {"tool_name": leader.get("tool_name")},
+    })
+    return ChatResponse(**{**jsonable_encoder(resp), "audit_id": audit_id})
 
-    print("***408",guardrails)
-    signals = build_signals(req, guardrails)
-    print("***415",signals)
-    stage_trace: Dict[str, Any] = {
-        "guardrails": guardrails,
-        "signals": signals,
-        "stages": {},
-    }
 
-    effective_message = req.message
-    effective_tool = req.tool
-    tool_result: Optional[Any] = None
-    llm_out: Optional[Dict[str, Any]] = None
+@app.post("/getAns/guardRailsAI", response_model=ChatResponse)
+async def chat_guardrails(req: ChatRequest):
+    REQUESTS_TOTAL.inc()
+    with tracked("/getAns/guardRailsAI"):
+        return await coalesced("/getAns/guardRailsAI", req, lambda: _chat_guardrails(req))
 
-    final_mode = "enforce"
-    final_action = "allow"
-    final_would_deny = False
-    final_decision_obj: Optional[Dict[str, Any]] = None
 
+async def _chat_guardrails(req: ChatRequest) -> ChatResponse:
+    log_event("DEBUG", "request_received", {"message": req.message, "user_role": req.user_role})
 
-    pre = policy_engine.evaluate_stage(
-        stage="pre",
-        message=effective_message,
-        signals=signals,
-        tool=effective_tool,
-        tool_result=None,
-        llm_out=None,
-    )
-    pre, pre_action, mode, would_deny = normalize_decision(pre)
-    stage_trace["stages"]["pre"] = {"decision": pre, "action": pre_action, "mode": mode, "would_deny": would_deny}
+    # Guardrails/NeMo detectors are independent: fan them out and bound each by its timeout.
+    with timed_stage("detectors"):
+        detected = await guardrails_detectors.run(req.message)
+    guardrails, scan = detected_guardrails(req, detected)
+    return await run_pipeline(req, guardrails, scan)
 
-    final_mode = mode
-    final_action = pre_action
-    final_would_deny = would_deny
-    final_decision_obj = pre
 
-    if pre_action == "deny" and not would_deny:
-        return make_deny_response(
-            req=req,
-            decision=pre,
-            guardrails=guardrails,
-            mode=mode,
-            action=pre_action,
-            at_stage="pre",
-            stage_trace=stage_trace,
-        )
+def detected_guardrails(
+    req: ChatRequest,
+    detected: Dict[str, Dict[str, Any]],
+    scan: Optional[ScanResult] = None,
+) -> Tuple[Dict[str, Any], ScanResult]:
+    """Guardrails dict and redaction scan from the Guardrails/NeMo detector results."""
+    pii = detected["pii"]
+    inj = detected["injection"]
+    guardrails: Dict[str, Any] = {
+        "pii": pii.get('pii_entities'),
+        "pii_any": bool(pii.get("pii_any", False)),
+        "injection_score": float(inj.get("injection_score", 0.0)),
+        "injection_hits": inj.get("injection_hits", []),
+        # "ok" | "unknown" (timed out) | "error" per detector, visible to policy
+        "detectors": detector_status(detected),
+    }
+    if "tiers" in inj:
+        guardrails["injection_cascade"] = {"exit": inj.get("exit"), "tiers": inj["tiers"]}
+    cached = {name: r["cache"] for name, r in detected.items() if r.get("cache")}
+    if cached:
+        guardrails["detector_cache"] = cached
+    log_event("DEBUG", "guardrails", {"source": "detectors", "guardrails": guardrails})
+    # redaction reuses the Presidio spans (plus the scanner's regex spans) instead of re-analysing
+    if scan is None:
+        scan = scan_text(req.message)
+    scan = scan.with_pii_spans(external_pii_spans(pii.get("pii_spans") or [], "presidio"))
+    return guardrails, scan
+
+
+def scan_guardrails(req: ChatRequest, scan: Optional[ScanResult] = None) -> Tuple[Dict[str, Any], ScanResult]:
+    # one scanner pass feeds PII flags, injection scoring and later redaction
+    if scan is None:
+        scan = scan_text(req.message)
+    pii = detect_pii(req.message, scan)
+    inj = injection_score(req.message, scan)
+    guardrails: Dict[str, Any] = {
+        "pii": pii,
+        "pii_any": pii_any(pii),
+        "injection_score": inj.get("injection_score", 0.0),
+        "injection_hits": inj.get("injection_hits", []),
+    }
+    log_event("DEBUG", "guardrails", {"source": "scanner", "guardrails": guardrails})
+    return guardrails, scan
 
-    effective_message, effective_tool = apply_action(pre_action, effective_message, effective_tool)
 
-    if effective_tool is not None:
-        tool_dec = policy_engine.evaluate_stage(
-            stage="tool",
-            message=effective_message,
-            signals=signals,
-            tool=effective_tool,
-            tool_result=None,
-            llm_out=None,
-        )
-        tool_dec, tool_action, mode2, would_deny2 = normalize_decision(tool_dec)
-        stage_trace["stages"]["tool"] = {
-            "decision": tool_dec,
-            "action": tool_action,
-            "mode": mode2,
-            "would_deny": would_deny2,
-        }
+@app.post("/getAns", response_model=ChatResponse)
+async def chat(req: ChatRequest):
+    REQUESTS_TOTAL.inc()
+    with tracked("/getAns"):
+        return await coalesced("/getAns", req, lambda: _chat(req))
 
-        final_mode = mode2
-        final_action = tool_action
-        final_would_deny = final_would_deny or would_deny2
-        final_decision_obj = tool_dec
 
-        if tool_action == "deny" and not would_deny2:
-            return make_deny_response(
-                req=req,
-                decision=tool_dec,
-                guardrails=guardrails,
-                mode=mode2,
-                action=tool_action,
-                at_stage="tool",
-                stage_trace=stage_trace,
-            )
+async def _chat(req: ChatRequest) -> ChatResponse:
+    with timed_stage("scan"):
+        guardrails, scan = scan_guardrails(req)
+    return await run_pipeline(req, guardrails, scan)
 
-        effective_message, effective_tool = apply_action(tool_action, effective_message, effective_tool)
 
-    # Execute tool (only if still present)
-    if effective_tool is not None:
-        TOOL_CALLS_TOTAL.labels(tool=effective_tool.name).inc()
-        raw_tool_result = tool_proxy.execute(effective_tool.name, effective_tool.args)
-        tool_result = redact_tool_output(raw_tool_result)
+def _sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
 
 
-    post = policy_engine.evaluate_stage(
-        stage="post",
-        message=effective_message,
-        signals=signals,
-        tool=effective_tool,
-        tool_result=tool_result,
-        llm_out=None,
-    )
-    post, post_action, mode3, would_deny3 = normalize_decision(post)
-    stage_trace["stages"]["post"] = {"decision": post, "action": post_action, "mode": mode3, "would_deny": would_deny3}
+async def _replay(text: str) -> AsyncIterator[str]:
+    yield text
 
-    final_mode = mode3
-    final_action = post_action
-    final_would_deny = final_would_deny or would_deny3
-    final_decision_obj = post
 
-    if post_action == "deny" and not would_deny3:
-        return make_deny_response(
-            req=req,
-            decision=post,
-            guardrails=guardrails,
-            mode=mode3,
-            action=post_action,
-            at_stage="post",
-            stage_trace=stage_trace,
-            tool_result=tool_result,
-        )
+async def stream_pipeline(req: ChatRequest, guardrails: Dict[str, Any], scan: ScanResult) -> AsyncIterator[bytes]:
+    """
+    SSE events: `token` {"text"} while the model generates, then exactly one of
+    `done` (the ChatResponse) or `deny` (the deny ChatResponse).
+
+    Leak markers from genai.rego are matched incrementally. When one completes, the
+    response stage is evaluated on the text so far. If it denies, the upstream
+    generation is aborted, the marker is never forwarded, and the request is audited
+    as a response-stage deny. At the end of the stream the full response stage runs on
+    the complete text. Rules the marker guard cannot see can therefore only deny after
+    the tokens have been sent; clients must discard the text when they get `deny`.
+    """
+    state = await run_pre_llm_stages(req, guardrails, scan)
+    if isinstance(state, ChatResponse):
+        yield _sse("deny", jsonable_encoder(state))
+        return
+
+    guard = StreamLeakGuard(LEAK_MARKERS)
+    chunks: List[str] = []
+    start = time.time()
+
+    cache_key = llm_cache_key(req, state)
+    cached = await llm_cache.aget(cache_key) if cache_key else None
+    if cached is not None:
+        source = _replay(cached["output_text"] or "")
+    else:
+        LLM_CALLS_TOTAL.inc()
+        source = astream_llm(state["message"], model=LLM_MODEL, max_tokens=LLM_MAX_TOKENS)
+
+    def llm_out_for(text: str) -> Dict[str, Any]:
+        if cached is not None:
+            return {**cached, "output_text": text}
+        return streamed_llm_out(state["message"], LLM_MODEL, text, start)
+
+    async with aclosing(source) as deltas:
+        async for delta in deltas:
+            if not chunks and cached is None:
+                LLM_FIRST_TOKEN_MS.observe((time.time() - start) * 1000)
+            chunks.append(delta)
+            safe, hits = guard.feed(delta)
+            if hits:
+                partial = llm_out_for("".join(chunks))
+                decision = await evaluate_response_stage(state, partial)
+                if decision[1] == "deny" and not decision[3]:
+                    denied = await finish_pipeline(req, guardrails, state, partial, decision)
+                    yield _sse("deny", jsonable_encoder(denied))
+                    return
+                safe, _ = guard.feed("")  # policy allowed it (or monitor mode): release and go on
+            if safe:
+                yield _sse("token", {"text": safe})
+    rest = guard.flush()
+    if rest:
+        yield _sse("token", {"text": rest})
+
+    llm_out = llm_out_for("".join(chunks))
+    if cached is None and cache_key:
+        await llm_cache.aput(cache_key, llm_out)
+        llm_out["cache"] = {"hit": False, "key": cache_key[:16]}
+    decision = await evaluate_response_stage(state, llm_out)
+    result = await finish_pipeline(req, guardrails, state, llm_out, decision)
+    yield _sse("deny" if result.decision == "deny" else "done", jsonable_encoder(result))
+
+
+@app.post("/getAns/stream")
+async def chat_stream(req: ChatRequest):
+    REQUESTS_TOTAL.inc()
+    with timed_stage("scan"):
+        guardrails, scan = scan_guardrails(req)
+    return StreamingResponse(
+        tracked_stream("/getAns/stream", stream_pipeline(req, guardrails, scan)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    effective_message, _ = apply_action(post_action, effective_message, None)
+async def batch_signals(reqs: List[ChatRequest], detectors: bool) -> List[Tuple[Dict[str, Any], ScanResult]]:
+    """Guardrails and scan per request: one scanner pass and one detector batch for all of them."""
+    messages = [r.message for r in reqs]
+    scans = scan_texts(messages)
+    if not detectors:
+        return [scan_guardrails(r, s) for r, s in zip(reqs, scans)]
+    detected = await guardrails_detectors.run_many(messages)
+    return [detected_guardrails(r, d, s) for r, d, s in zip(reqs, detected, scans)]
 
 
-    with LLM_LATENCY_MS.time():
-        LLM_CALLS_TOTAL.inc()
-        llm_out = call_llm(effective_message, model="gpt-4o-mini", max_tokens=300)
+async def evaluate_batch(
+    reqs: List[ChatRequest],
+    detectors: bool = False,
+) -> AsyncIterator[Union[ChatResponse, Exception]]:
+    """
+    Runs the pipeline for every request and yields the results in input order: the
+    ChatResponse, or the exception that request raised.
 
-    resp = policy_engine.evaluate_stage(
-        stage="response",
-        message=effective_message,
-        signals=signals,
-        tool=effective_tool,
-        tool_result=tool_result,
-        llm_out=llm_out,
-    )
-    resp, resp_action, mode4, would_deny4 = normalize_decision(resp)
-    stage_trace["stages"]["response"] = {"decision": resp, "action": resp_action, "mode": mode4, "would_deny": would_deny4}
+    Signals are computed in batched form (scan_texts, DetectorFanout.run_many) and the
+    pre stage is evaluated in bulk, once per distinct policy input. Identical requests
+    run once; the duplicates get the result with their own audit row, as coalesced
+    requests do. `detectors` selects the Guardrails/NeMo detectors (/getAns/guardRailsAI)
+    instead of the scanner (/getAns).
 
-    final_mode = mode4
-    final_action = resp_action
-    final_would_deny = final_would_deny or would_deny4
-    final_decision_obj = resp
+    BATCH_CONCURRENCY=16   (pipelines in flight per batch)
+    """
+    endpoint = "/getAns/batch"
+    keys = [request_key(endpoint, r) for r in reqs]
+    leaders: Dict[str, int] = {}
+    for i, k in enumerate(keys):
+        leaders.setdefault(k, i)
+    unique = [reqs[i] for i in leaders.values()]
+
+    signals = await batch_signals(unique, detectors)
+    pres = await policy_engine.aevaluate_stage_many("pre", [
+        {"message": r.message, "signals": build_signals(r, g), "tool": r.tool}
+        for r, (g, _) in zip(unique, signals)
+    ])
+
+    sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run_one(j: int) -> ChatResponse:
+        req, (guardrails, scan), pre = unique[j], signals[j], pres[j]
+        async with sem:
+            return await coalesced(endpoint, req, lambda: run_pipeline(req, guardrails, scan, pre))
+
+    tasks = {k: asyncio.ensure_future(run_one(j)) for j, k in enumerate(leaders)}
+    try:
+        for i, (req, k) in enumerate(zip(reqs, keys)):
+            try:
+                resp = await tasks[k]
+                if leaders[k] != i:
+                    resp = await follower_response(endpoint, req, resp)
+            except Exception as e:
+                yield e
+                continue
+            yield resp
+    finally:
+        for t in tasks.values():
+            t.cancel()
+
+
+@app.post("/getAns/batch")
+async def chat_batch(reqs: List[ChatRequest], detectors: bool = False):
+    """
+    NDJSON, one line per request in input order: {"index", "response"} or {"index", "error"}.
+    `detectors=true` evaluates like /getAns/guardRailsAI, otherwise like /getAns.
 
-    if resp_action == "deny" and not would_deny4:
-        # IMPORTANT: deny => llm must be None
-        return make_deny_response(
-            req=req,
-            decision=resp,
-            guardrails=guardrails,
-            mode=mode4,
-            action=resp_action,
-            at_stage="response",
-            stage_trace=stage_trace,
-            tool_result=tool_result,
+    BATCH_MAX_ITEMS=1000   (larger batches are rejected with 413)
+    """
+    if len(reqs) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"batch larger than {BATCH_MAX_ITEMS} requests")
+    REQUESTS_TOTAL.inc(len(reqs))
+
+    async def lines() -> AsyncIterator[bytes]:
+        index = 0
+        async with aclosing(evaluate_batch(reqs, detectors)) as results:
+            async for result in results:
+                if isinstance(result, Exception):
+                    line: Dict[str, Any] = {"index": index, "error": f"{type(result).__name__}: {result}"}
+                else:
+                    line = {"index": index, "response": jsonable_encoder(result)}
+                yield (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+                index += 1
+
+    return StreamingResponse(tracked_stream("/getAns/batch", lines()), media_type="application/x-ndjson")
+
+
+@app.get("/audit")
+async def audit_query(
+    rule_id: Optional[str] = None,
+    decision: Optional[str] = None,
+    user_role: Optional[str] = None,
+    at_stage: Optional[str] = None,
+    action: Optional[str] = None,
+    mode: Optional[str] = None,
+    tool_name: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    would_deny: Optional[bool] = None,
+    min_injection_score: Optional[float] = None,
+    include_trace: bool = False,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+):
+    """Newest-first audit rows; pass the returned `next_cursor` back as `cursor` for the next page."""
+    try:
+        return await run_in_threadpool(
+            lambda: query_audit(
+                limit=limit,
+                cursor=cursor,
+                since=since,
+                until=until,
+                would_deny=would_deny,
+                min_injection_score=min_injection_score,
+                include_trace=include_trace,
+                rule_id=rule_id,
+                decision=decision,
+                user_role=user_role,
+                at_stage=at_stage,
+                action=action,
+                mode=mode,
+                tool_name=tool_name,
+            )
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    if resp_action == "redact_and_allow" and llm_out and isinstance(llm_out.get("output_text"), str):
-        llm_out["output_text"] = redact_pii(llm_out["output_text"])
 
-    audit_payload = {
-        **stage_trace,
-        "final": {
-            "decision": final_decision_obj.get("decision") if final_decision_obj else "allow",
-            "mode": final_mode,
-            "action": final_action,
-            "would_deny": final_would_deny,
-        },
-        "effective_tool": None if effective_tool is None else {"name": effective_tool.name, "args": effective_tool.args},
-        "tool_result": tool_result,
-        "llm": {k: llm_out.get(k) for k in ["provider", "model", "latency_ms", "tokens_estimate"]} if llm_out else None,
-    }
-    audit_id = write_audit(req.user_role, final_decision_obj or {}, audit_payload)
+@app.get("/audit/{audit_id}")
+async def audit_get(audit_id: str):
+    record = await run_in_threadpool(get_audit, audit_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="audit record not found")
+    return record
 
-    return ChatResponse(
-        audit_id=audit_id,
-        decision=final_decision_obj.get("decision", "allow") if final_decision_obj else "allow",
-        rule_id=final_decision_obj.get("rule_id") if final_decision_obj else None,
-        reason=final_decision_obj.get("reason", "Allowed") if final_decision_obj else "Allowed",
-        policy_version=final_decision_obj.get("policy_version") if final_decision_obj else None,
-        guardrails={**guardrails, "mode": final_mode, "action": final_action, "would_deny": final_would_deny},
-        tool_result=tool_result,
-        llm=llm_out,
-    )
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(), media_type="text/plain")
+    return Response(render_metrics(), media_type="text/plain")
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: 503 until the detectors named in DETECTOR_WARM have loaded."""
+    body = {"ready": detector_registry.ready(), "detectors": detector_registry.status()}
+    if not body["ready"]:
+        return Response(json.dumps(body), status_code=503, media_type="application/json")
+    return body
@@ -1,6 +1,92 @@
-from prometheus_client import Counter,Histogram
+"""
+Prometheus metrics for the gateway.
+
+Durations are histograms in milliseconds with LATENCY_BUCKETS_MS unless a metric needs
+a narrower range. Per-request timings: request_latency_ms{endpoint} and
+pipeline_stage_latency_ms{stage}, with these stages:
+- scan: scanner signals;
+- detectors: Guardrails / NeMo fan-out;
+- policy_pre, policy_tool, policy_post, policy_response;
+- tool_call;
+- llm: includes the response-cache lookup;
+- audit: as seen by the request.
+Under those: detector_latency_ms{detector, status}, opa_request_latency_ms{stage, outcome}
+and audit_write_latency_ms / audit_queue_wait_ms.
+
+Several workers: set PROMETHEUS_MULTIPROC_DIR to an empty directory (wiped at deploy)
+before the workers start. Each worker then writes its samples there, and /metrics
+(render()) aggregates every worker. Gauges declare how they aggregate (multiprocess_mode).
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
+
+# sub-millisecond (cache hits, in-process policy) to multi-second (NeMo, LLM)
+LATENCY_BUCKETS_MS = (
+    0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000
+)
+
+
+@contextmanager
+def observe_ms(histogram: Any) -> Iterator[None]:
+    """Observes the block's wall time in ms (Histogram.time() observes seconds)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe((time.perf_counter() - start) * 1000)
+
+
+def render() -> bytes:
+    """/metrics exposition; aggregates all workers in multiprocess mode."""
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return generate_latest()
+    from prometheus_client import CollectorRegistry, multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def mark_process_dead() -> None:
+    """Drops this worker's live gauges from the multiprocess directory (call on shutdown)."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(os.getpid())
+
 
 REQUESTS_TOTAL = Counter("requests_total", "Total number of requests")
+REQUESTS_IN_FLIGHT = Gauge(
+    "requests_in_flight",
+    "Requests currently being handled",
+    ["endpoint"],
+    multiprocess_mode="livesum"
+)
+REQUEST_LATENCY_MS = Histogram(
+    "request_latency_ms",
+    "End-to-end request handling time in ms",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS_MS
+)
+PIPELINE_STAGE_LATENCY_MS = Histogram(
+    "pipeline_stage_latency_ms",
+    "Time spent in one gateway pipeline stage, in ms",
+    ["stage"],
+    buckets=LATENCY_BUCKETS_MS
+)
+LOGS_DROPPED_TOTAL = Counter(
+    "logs_dropped_total",
+    "Log records dropped because the logging ring buffer was full"
+)
+REQUESTS_COALESCED_TOTAL = Counter(
+    "requests_coalesced_total",
+    "Requests answered by an identical in-flight request's pipeline run",
+    ["endpoint"]
+)
 
 POLICY_DENIES_TOTAL = Counter(
     "policy_denies_total",
@@ -14,5 +100,184 @@ TOOL_CALLS_TOTAL = Counter(
     ["tool"]
 )
 
+INJECTION_TIER_LATENCY_MS = Histogram(
+    "injection_tier_latency_ms",
+    "Latency of one injection cascade tier, in ms",
+    ["tier"],
+    buckets=LATENCY_BUCKETS_MS
+)
+INJECTION_CASCADE_EXITS_TOTAL = Counter(
+    "injection_cascade_exits_total",
+    "Tier at which the injection cascade stopped, and why (block | clear | exhausted)",
+    ["tier", "reason"]
+)
+
+DETECTOR_CACHE_HITS_TOTAL = Counter(
+    "detector_cache_hits_total",
+    "Detector outputs served from the detector cache",
+    ["detector", "tier"]
+)
+DETECTOR_CACHE_MISSES_TOTAL = Counter(
+    "detector_cache_misses_total",
+    "Detector cache lookups that had to run the detector",
+    ["detector"]
+)
+DETECTOR_CACHE_HIT_RATIO = Gauge(
+    "detector_cache_hit_ratio",
+    "Fraction of this worker's detector cache lookups served from the cache",
+    ["detector"],
+    multiprocess_mode="liveall"
+)
+DETECTOR_LATENCY_MS = Histogram(
+    "detector_latency_ms",
+    "Detector run time in ms (a batch chunk counts once); status ok | cached | unknown | error",
+    ["detector", "status"],
+    buckets=LATENCY_BUCKETS_MS
+)
+
 LLM_CALLS_TOTAL = Counter("llm_calls_total", "Total LLM calls")
-LLM_LATENCY_MS = Histogram("llm_latency_ms", "LLM call latency in ms")
+LLM_LATENCY_MS = Histogram("llm_latency_ms", "LLM call latency in ms", buckets=LATENCY_BUCKETS_MS)
+LLM_QUEUE_WAIT_MS = Histogram(
+    "llm_queue_wait_ms",
+    "Time an LLM call waited for an in-flight slot (LLM_MAX_IN_FLIGHT), in ms",
+    buckets=(0.1, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "Upstream LLM calls currently holding a slot", multiprocess_mode="livesum")
+LLM_RETRIES_TOTAL = Counter(
+    "llm_retries_total",
+    "LLM retry decisions: retried, or refused because the retry budget was empty",
+    ["outcome"]
+)
+LLM_FIRST_TOKEN_MS = Histogram(
+    "llm_first_token_ms",
+    "Time from the streamed LLM request to its first output token, in ms",
+    buckets=(25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+)
+LLM_CACHE_HITS_TOTAL = Counter("llm_cache_hits_total", "LLM response cache hits", ["tier"])
+LLM_CACHE_MISSES_TOTAL = Counter("llm_cache_misses_total", "LLM response cache misses")
+LLM_CACHE_BYPASS_TOTAL = Counter("llm_cache_bypass_total", "LLM calls that skipped the response cache", ["reason"])
+
+# OPA transport (connection pool) metrics; label client=sync|async
+OPA_POOL_CONNECTIONS = Gauge(
+    "opa_pool_connections",
+    "OPA connections currently held by the pool",
+    ["client"],
+    multiprocess_mode="livesum"
+)
+OPA_POOL_REQUESTS_TOTAL = Counter(
+    "opa_pool_requests_total",
+    "OPA requests sent through the pool",
+    ["client"]
+)
+OPA_POOL_NEW_CONNECTIONS_TOTAL = Counter(
+    "opa_pool_new_connections_total",
+    "OPA requests that had to open a new connection",
+    ["client"]
+)
+OPA_POOL_REUSE_RATIO = Gauge(
+    "opa_pool_reuse_ratio",
+    "Fraction of OPA requests served on a reused connection",
+    ["client"],
+    multiprocess_mode="liveall"
+)
+OPA_POOL_WAIT_MS = Histogram(
+    "opa_pool_wait_ms",
+    "Time spent waiting for a pooled OPA connection in ms",
+    ["client"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+)
+OPA_REQUEST_LATENCY_MS = Histogram(
+    "opa_request_latency_ms",
+    "OPA decision request time in ms by stage; outcome ok | error",
+    ["stage", "outcome"],
+    buckets=LATENCY_BUCKETS_MS
+)
+
+DECISION_CACHE_HITS_TOTAL = Counter(
+    "decision_cache_hits_total",
+    "Stage decisions served from the in-process decision cache",
+    ["stage"]
+)
+DECISION_CACHE_MISSES_TOTAL = Counter(
+    "decision_cache_misses_total",
+    "Stage decisions that missed the decision cache",
+    ["stage"]
+)
+DECISION_CACHE_INVALIDATIONS_TOTAL = Counter(
+    "decision_cache_invalidations_total",
+    "Decision cache invalidations",
+    ["reason"]
+)
+POLICY_STAGES_SKIPPED_TOTAL = Counter(
+    "policy_stages_skipped_total",
+    "Stage evaluations skipped because genai.rego provably returns its default",
+    ["stage"]
+)
+DECISION_TABLE_LOOKUPS_TOTAL = Counter(
+    "decision_table_lookups_total",
+    "Tool-stage decision table lookups",
+    ["result"]
+)
+DECISION_TABLE_MISMATCHES_TOTAL = Counter(
+    "decision_table_mismatches_total",
+    "Decision table rows that disagreed with live evaluation"
+)
+DECISION_TABLE_ROWS = Gauge(
+    "decision_table_rows", "Rows in the tool-stage decision table", multiprocess_mode="livemax"
+)
+OPA_INPUT_BYTES = Histogram(
+    "opa_input_bytes",
+    "Size of the serialized input sent to OPA per stage",
+    ["stage"],
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536, 262144, 1048576)
+)
+
+AUDIT_QUEUE_DEPTH = Gauge(
+    "audit_queue_depth", "Audit rows waiting for the writer thread", multiprocess_mode="livesum"
+)
+AUDIT_QUEUE_WAIT_MS = Histogram(
+    "audit_queue_wait_ms",
+    "Time an audit row waited in the queue before its group commit started, in ms",
+    buckets=LATENCY_BUCKETS_MS
+)
+AUDIT_WRITE_LATENCY_MS = Histogram(
+    "audit_write_latency_ms",
+    "Audit insert + commit time in ms; path batch (writer thread) | direct (caller thread)",
+    ["path"],
+    buckets=LATENCY_BUCKETS_MS
+)
+AUDIT_BATCH_SIZE = Histogram(
+    "audit_batch_size",
+    "Rows per audit group commit",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+AUDIT_BACKPRESSURE_TOTAL = Counter(
+    "audit_backpressure_total",
+    "Audit rows written on the caller thread because the queue was full"
+)
+AUDIT_ROWS_FAILED_TOTAL = Counter(
+    "audit_rows_failed_total",
+    "Audit rows that could not be written, even after the row-by-row fallback"
+)
+AUDIT_GROUP_WAIT_TIMEOUTS_TOTAL = Counter(
+    "audit_group_wait_timeouts_total",
+    "AUDIT_DURABILITY=group waits that timed out; the caller writes the row unless the writer has it"
+)
+AUDIT_TRACE_BYTES_TOTAL = Counter(
+    "audit_trace_bytes_total",
+    "Audit trace bytes before (raw) and after (stored) fragment dedupe + compression",
+    ["form"]
+)
+AUDIT_TRACE_FRAGMENTS_TOTAL = Counter(
+    "audit_trace_fragments_total",
+    "Audit trace fragments written as new blobs vs. deduplicated against existing ones",
+    ["result"]
+)
+AUDIT_PARTITIONS = Gauge(
+    "audit_partitions", "Audit partition files currently retained", multiprocess_mode="livemax"
+)
+AUDIT_PARTITION_MAINTENANCE_TOTAL = Counter(
+    "audit_partition_maintenance_total",
+    "Whole-partition maintenance operations",
+    ["action"]
+)
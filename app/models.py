@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from typing import Optional, Dict, Any
 
 class ToolRequest(BaseModel):
@@ -19,3 +19,6 @@ class ChatResponse(BaseModel):
     guardrails: Dict[str, Any]
     tool_result: Optional[Dict[str, Any]] = None
     llm: Optional[Dict[str, Any]] = None
+    # at_stage / tool_name this response was audited with; not serialized, copied into
+    # the audit rows of coalesced followers
+    _audit_context: Dict[str, Any] = PrivateAttr(default_factory=dict)
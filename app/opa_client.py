@@ -1,33 +1,267 @@
-# app/opa_client.py
 from __future__ import annotations
 
 import hashlib
+import json
 import os
-from typing import Any, Dict, Optional
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
 
-import requests
+import httpx
+
+from metrics import (
+    OPA_INPUT_BYTES,
+    OPA_REQUEST_LATENCY_MS,
+    OPA_POOL_CONNECTIONS,
+    OPA_POOL_NEW_CONNECTIONS_TOTAL,
+    OPA_POOL_REQUESTS_TOTAL,
+    OPA_POOL_REUSE_RATIO,
+    OPA_POOL_WAIT_MS,
+)
+
+try:  # faster encoder; stdlib json is the fallback
+    import orjson
+
+    # same leniency as the fallback: anything not JSON-native is sent as str(value),
+    # including the datetimes and dataclasses orjson would otherwise format itself
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str, option=_OPTIONS)
+
+    _loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:  # pragma: no cover - depends on environment
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+    _loads = json.loads
+
+
+def _input_body(opa_input: Dict[str, Any]) -> bytes:
+    body = _dumps({"input": opa_input})
+    OPA_INPUT_BYTES.labels(stage=str(opa_input.get("stage"))).observe(len(body))
+    return body
+
+
+def _observe_request(opa_input: Dict[str, Any], outcome: str, start: float) -> None:
+    OPA_REQUEST_LATENCY_MS.labels(stage=str(opa_input.get("stage")), outcome=outcome).observe(
+        (time.perf_counter() - start) * 1000
+    )
+
+
+_JSON_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _PoolStats:
+    """
+    Pool-level metrics collected via httpcore trace hooks.
+
+    - a request whose connection emits connect_tcp is a new connection, anything else is a reuse
+    - wait time = request start -> first trace event (i.e. time spent acquiring a pooled connection)
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.requests = 0
+        self.new_connections = 0
+        self._lock = threading.Lock()
+
+    def _record(self, new_connection: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            if new_connection:
+                self.new_connections += 1
+            ratio = 1.0 - (self.new_connections / self.requests)
+        OPA_POOL_REQUESTS_TOTAL.labels(client=self.label).inc()
+        if new_connection:
+            OPA_POOL_NEW_CONNECTIONS_TOTAL.labels(client=self.label).inc()
+        OPA_POOL_REUSE_RATIO.labels(client=self.label).set(ratio)
+
+    def _on_event(self, state: Dict[str, Any], name: str) -> None:
+        if state["first_event"] is None:
+            state["first_event"] = time.perf_counter()
+            OPA_POOL_WAIT_MS.labels(client=self.label).observe((state["first_event"] - state["start"]) * 1000)
+        if name == "connection.connect_tcp.started":
+            state["new_connection"] = True
+
+    def sync_tracer(self) -> Tuple[Dict[str, Any], Callable[[str, Dict[str, Any]], None]]:
+        state: Dict[str, Any] = {"start": time.perf_counter(), "first_event": None, "new_connection": False}
+
+        def trace(name: str, info: Dict[str, Any]) -> None:
+            self._on_event(state, name)
+
+        return state, trace
+
+    def async_tracer(self) -> Tuple[Dict[str, Any], Callable[[str, Dict[str, Any]], Any]]:
+        state: Dict[str, Any] = {"start": time.perf_counter(), "first_event": None, "new_connection": False}
+
+        async def trace(name: str, info: Dict[str, Any]) -> None:
+            self._on_event(state, name)
+
+        return state, trace
+
+    def finish(self, state: Dict[str, Any], client: Any) -> None:
+        self._record(state["new_connection"])
+        # best-effort: httpx does not expose pool size publicly
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            OPA_POOL_CONNECTIONS.labels(client=self.label).set(len(connections))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            requests, new = self.requests, self.new_connections
+        return {
+            "requests": requests,
+            "new_connections": new,
+            "reuse_ratio": (1.0 - new / requests) if requests else None,
+        }
 
 
 class OPAClient:
+    """
+    Pooled keep-alive OPA transport, shared by all requests in a worker.
+
+    OPA_POOL_MAX_CONNECTIONS=32
+    OPA_POOL_MAX_KEEPALIVE=16
+    OPA_KEEPALIVE_EXPIRY_S=30
+    OPA_HTTP2=false              (needs the `h2` package; silently falls back to HTTP/1.1)
+
+    The sync client is thread-safe (threadpool callers, scripts); the async client is
+    created lazily inside the running event loop.
+    """
+
     def __init__(self):
         self.base_url = os.getenv("OPA_URL", "http://localhost:8181").rstrip("/")
         # This must match your rego package+rule => /v1/data/genai/decision
         self.decision_path = os.getenv("OPA_DECISION_PATH", "/v1/data/genai/decision")
         self.timeout_s = float(os.getenv("OPA_TIMEOUT_S", "2.0"))
 
+        self.limits = httpx.Limits(
+            max_connections=int(os.getenv("OPA_POOL_MAX_CONNECTIONS", "32")),
+            max_keepalive_connections=int(os.getenv("OPA_POOL_MAX_KEEPALIVE", "16")),
+            keepalive_expiry=float(os.getenv("OPA_KEEPALIVE_EXPIRY_S", "30")),
+        )
+        self.http2 = os.getenv("OPA_HTTP2", "false").lower() == "true" and _http2_available()
+
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._client_lock = threading.Lock()
+        self._sync_stats = _PoolStats("sync")
+        self._async_stats = _PoolStats("async")
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "timeout": self.timeout_s,
+            "limits": self.limits,
+            "http2": self.http2,
+            "headers": _JSON_HEADERS,
+        }
+
+    def _get_client(self) -> httpx.Client:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = httpx.Client(**self._client_kwargs())
+        return self._client
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(**self._client_kwargs())
+        return self._async_client
+
     def decide(self, opa_input: Dict[str, Any]) -> Dict[str, Any]:
-        url = f"{self.base_url}{self.decision_path}"
-        r = requests.post(url, json={"input": opa_input}, timeout=self.timeout_s)
-        r.raise_for_status()
-        payload = r.json()
+        client = self._get_client()
+        body = _input_body(opa_input)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            state, trace = self._sync_stats.sync_tracer()
+            r = client.post(self.decision_path, content=body, extensions={"trace": trace})
+            self._sync_stats.finish(state, client)
+            r.raise_for_status()
+            payload = _loads(r.content)
+            outcome = "ok"
+        finally:
+            _observe_request(opa_input, outcome, start)
         # OPA returns {"result": ...}
         return payload.get("result") or {}
 
+    async def adecide(self, opa_input: Dict[str, Any]) -> Dict[str, Any]:
+        client = self._get_async_client()
+        body = _input_body(opa_input)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            state, trace = self._async_stats.async_tracer()
+            r = await client.post(self.decision_path, content=body, extensions={"trace": trace})
+            self._async_stats.finish(state, client)
+            r.raise_for_status()
+            payload = _loads(r.content)
+            outcome = "ok"
+        finally:
+            _observe_request(opa_input, outcome, start)
+        return payload.get("result") or {}
+
     def bundle_status(self) -> Dict[str, Any]:
-        url = f"{self.base_url}/v1/status"
-        r = requests.get(url, timeout=self.timeout_s)
+        r = self._get_client().get("/v1/status")
+        r.raise_for_status()
+        return _loads(r.content)
+
+    async def abundle_status(self) -> Dict[str, Any]:
+        r = await self._get_async_client().get("/v1/status")
+        r.raise_for_status()
+        return _loads(r.content)
+
+    def bundle_revision(self) -> str:
+        """
+        Active bundle revision(s) as a stable string, from OPA's decision provenance.
+        Returns "" when policies are loaded from plain files (no bundles).
+        """
+        r = self._get_client().get(self.decision_path, params={"provenance": "true"})
+        r.raise_for_status()
+        bundles = (_loads(r.content).get("provenance") or {}).get("bundles") or {}
+        return ",".join(f"{name}@{(b or {}).get('revision', '')}" for name, b in sorted(bundles.items()))
+
+    def policy_source(self) -> str:
+        """
+        Rego source of the decision package as loaded in OPA (GET /v1/policies): the raw
+        text of every module in that package, ordered by module id. Returns "" when OPA
+        has none.
+        """
+        # /v1/data/genai/decision -> package ["genai"], rule "decision"
+        package = [p for p in self.decision_path.split("/")[3:] if p][:-1]
+        r = self._get_client().get("/v1/policies")
         r.raise_for_status()
-        return r.json()
+        modules = []
+        for m in _loads(r.content).get("result") or []:
+            path = ((m.get("ast") or {}).get("package") or {}).get("path") or []
+            if [t.get("value") for t in path[1:]] == package:
+                modules.append((m.get("id") or "", m.get("raw") or ""))
+        return "\n".join(raw for _, raw in sorted(modules))
+
+    def pool_stats(self) -> Dict[str, Any]:
+        return {"sync": self._sync_stats.snapshot(), "async": self._async_stats.snapshot(), "http2": self.http2}
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        self.close()
 
     @staticmethod
     def stable_hash(obj: Any) -> str:
@@ -1,10 +1,19 @@
 # app/policy_engine.py
 from __future__ import annotations
 
+import asyncio
+import copy
 import os
-from typing import Any, Dict, Optional, List
+from typing import Any, Dict, FrozenSet, Optional, List, Tuple
 
+from decision_cache import DecisionCache, RevisionWatcher, canonical_hash
+from decision_table import ToolDecisionTable
+from logging_utils import log_event
+from metrics import POLICY_STAGES_SKIPPED_TOTAL
 from opa_client import OPAClient
+from rego_analysis import InputProjector, PolicySource, SourceFn, StageSkipper
+from rule_engine import RuleEngine
+from wasm_policy import WasmPolicy
 
 
 def _env_mode_default() -> str:
@@ -38,20 +47,47 @@ def _sql_query_from_tool(tool: Optional[Any]) -> str:
     return ""
 
 
+# Marker on decisions that were not evaluated because the policy provably returns its default
+SKIPPED_PROVABLY_DEFAULT = "skipped (provably default)"
+
+# Input paths the python fallback (PolicyEngine.evaluate) reads; used as its decision-cache key.
+PYTHON_BACKEND_INPUT_PATHS = (
+    ("stage",),
+    ("signals", "injection_score"),
+    ("signals", "injection_hits"),
+    ("signals", "pii_any"),
+    ("signals", "tool_name"),
+    ("tool", "args", "query"),
+)
+
+
 class PolicyEngine:
     """
-    POLICY_BACKEND=python|opa
+    POLICY_BACKEND=python|opa|opa-wasm|rules
+        opa-wasm = genai.rego compiled to Wasm, evaluated in-process (see wasm_policy.py)
+        rules    = compiled policy.yaml, in-process (see rule_engine.py)
     POLICY_MODE=enforce|monitor
 
     OPA_FAIL_MODE=closed|open (healthcare recommend: closed)
+
+    DECISION_CACHE_ENABLED=true|false   (see decision_cache.DecisionCache)
+    DECISION_CACHE_REVISION_POLL_S=5    (OPA bundle revision check interval)
+
+    POLICY_SKIP_DEFAULT_STAGES=true     (opa / opa-wasm: see rego_analysis.StageSkipper)
+    TOOL_DECISION_TABLE_ENABLED=true    (opa / opa-wasm: see decision_table.ToolDecisionTable)
+    OPA_INPUT_PROJECTION=true           (opa / opa-wasm: see rego_analysis.InputProjector)
+    OPA_POLICY_SOURCE_POLL_S=2          (opa: how often the policy source is fetched for the two above
+                                         and the decision-cache key)
     """
 
     def __init__(self):
         self.backend = os.getenv("POLICY_BACKEND", "opa").lower()
-        if self.backend not in ("python", "opa"):
+        if self.backend not in ("python", "opa", "opa-wasm", "rules"):
             self.backend = "python"
 
         self._opa: Optional[OPAClient] = None
+        self._rules: Optional[RuleEngine] = RuleEngine.from_file() if self.backend == "rules" else None
+        self._wasm: Optional[WasmPolicy] = None
 
         # Python backend thresholds (kept as a fallback if you want)
         self.inj_block_threshold = _float(os.getenv("INJECTION_BLOCK_THRESHOLD", "0.85"), 0.85)
@@ -61,6 +97,68 @@ class PolicyEngine:
         self.opa_attach_bundle_status = os.getenv("OPA_ATTACH_BUNDLE_STATUS", "false").lower() == "true"
         self.opa_fail_mode = os.getenv("OPA_FAIL_MODE", "closed").lower()  # closed|open
 
+        self.decision_cache: Optional[DecisionCache] = None
+        self._revision_watcher: Optional[RevisionWatcher] = None
+        if os.getenv("DECISION_CACHE_ENABLED", "true").lower() == "true":
+            if self.backend in ("opa", "opa-wasm"):
+                # keyed on what the live policy reads at each stage (see _key_analysis below)
+                self.decision_cache = DecisionCache(stage_key_paths=self._stage_key_paths)
+            else:
+                key_paths = self._rules.input_paths() if self._rules is not None else PYTHON_BACKEND_INPUT_PATHS
+                self.decision_cache = DecisionCache(key_paths=key_paths)
+            if self.backend == "opa":
+                self._revision_watcher = RevisionWatcher(
+                    fetch=lambda: self._get_opa().bundle_revision(),
+                    on_change=self.decision_cache.set_epoch,
+                    interval_s=_float(os.getenv("DECISION_CACHE_REVISION_POLL_S", "5"), 5.0),
+                )
+                self._revision_watcher.start()
+            elif self.backend != "opa-wasm":  # wasm: the epoch follows the loaded module
+                version = self._rules.version if self._rules is not None else self.policy_version
+                self.decision_cache.set_epoch(f"{self.backend}:{version}", reason="startup")
+
+        if self.backend == "opa-wasm":
+            # a hot-swapped module is a new policy revision for the decision cache
+            on_reload = self.decision_cache.set_epoch if self.decision_cache is not None else None
+            self._wasm = WasmPolicy.from_env(on_reload=on_reload)
+
+        # both analyse the policy the backend runs: the modules OPA reports, or the Wasm module's source
+        self._skipper: Optional[StageSkipper] = None
+        self._projector: Optional[InputProjector] = None
+        self._key_analysis: Optional[InputProjector] = None
+        self._opa_source: Optional[PolicySource] = None
+        self._source_watcher: Optional[RevisionWatcher] = None
+        if self.backend in ("opa", "opa-wasm"):
+            source: SourceFn
+            if self._wasm is not None:
+                source = self._wasm.policy_source
+            else:
+                self._opa_source = PolicySource()
+                source = self._opa_source.get
+            # stages whose input provably gets the policy's default skip the evaluation
+            self._skipper = StageSkipper.from_env(source)
+            # only the input paths the policy reads at a stage are sent to it
+            self._projector = InputProjector.from_env(source)
+            # the decision cache keys on the same paths
+            if self.decision_cache is not None:
+                self._key_analysis = self._projector or InputProjector(source)
+            if self._opa_source is not None and (
+                self._skipper is not None or self._projector is not None or self._key_analysis is not None
+            ):
+                self._source_watcher = RevisionWatcher(
+                    fetch=self._fetch_policy_source,
+                    on_change=self._opa_source.set,
+                    interval_s=_float(os.getenv("OPA_POLICY_SOURCE_POLL_S", "2"), 2.0),
+                )
+                self._source_watcher.start()
+
+        # tool-stage decisions from a table enumerated against the live backend
+        self._tool_table: Optional[ToolDecisionTable] = None
+        if self.backend in ("opa", "opa-wasm"):
+            self._tool_table = ToolDecisionTable.from_env(self._evaluate_live, self._live_revision)
+            if self._tool_table is not None:
+                self._tool_table.start()
+
     def _get_opa(self) -> OPAClient:
         if self._opa is None:
             self._opa = OPAClient()
@@ -139,7 +237,7 @@ class PolicyEngine:
     # -------------------------
     # Stage-aware wrapper
     # -------------------------
-    def evaluate_stage(
+    def _opa_input(
         self,
         stage: str,
         message: str,
@@ -148,7 +246,7 @@ class PolicyEngine:
         tool_result: Optional[Any],
         llm_out: Optional[Dict[str, Any]],
     ) -> Dict[str, Any]:
-        opa_input: Dict[str, Any] = {
+        return {
             "stage": stage,
             "request": {
                 "message": message,
@@ -163,11 +261,148 @@ class PolicyEngine:
             "tool_result": tool_result,
             "llm_out": llm_out,
         }
-        print("**169",self.backend)
+
+    def _cache_lookup(self, stage: str, opa_input: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        if self.decision_cache is None:
+            return None, None
+        key = self.decision_cache.key(stage, opa_input, _env_mode_default())
+        if key is None:
+            return None, None
+        return key, self.decision_cache.get(stage, key)
+
+    def _cache_store(self, key: Optional[str], decision: Dict[str, Any]) -> Dict[str, Any]:
+        if key is not None and self.decision_cache is not None:
+            self.decision_cache.put(key, decision)
+        return decision
+
+    def _from_opa_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "decision": result.get("decision", "deny"),
+            "action": result.get("action") or ("deny" if result.get("decision") == "deny" else "allow"),
+            "reason": result.get("reason", "Denied by OPA policy"),
+            "rule_id": result.get("rule_id"),
+            "policy_version": result.get("policy_version", "opa-v1"),
+            "mode": result.get("mode", _env_mode_default()),
+            "obligations": result.get("obligations", []),
+        }
+
+    def _evaluate_live(self, opa_input: Dict[str, Any]) -> Dict[str, Any]:
+        """One uncached evaluation on the opa / opa-wasm backend; raises on failure."""
+        if self._wasm is not None:
+            return self._evaluate_wasm_stage(opa_input)
+        return self._from_opa_result(self._get_opa().decide(self._project(opa_input)))
+
+    def _live_revision(self) -> str:
+        if self._wasm is not None:
+            return self._wasm.revision
+        return self._get_opa().bundle_revision()
+
+    def _stage_key_paths(self, stage: str) -> Optional[Tuple[str, FrozenSet[Tuple[str, ...]]]]:
+        return None if self._key_analysis is None else self._key_analysis.revision_paths(stage)
+
+    def _fetch_policy_source(self) -> Optional[str]:
+        # OPA unreachable: no known source, so skipping, projection and caching stay off until it answers
+        try:
+            return self._get_opa().policy_source()
+        except Exception:
+            return None
+
+    def _precomputed(self, stage: str, opa_input: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """A decision that needs no policy evaluation: decision table row or provable default."""
+        if stage == "tool" and self._tool_table is not None:
+            decision = self._tool_table.lookup(opa_input)
+            if decision is not None:
+                return decision
+        if self._skipper is None:
+            return None
+        default = self._skipper.default_for(opa_input)
+        if default is None:
+            return None
+        POLICY_STAGES_SKIPPED_TOTAL.labels(stage=stage).inc()
+        return {**self._from_opa_result(default), "evaluation": SKIPPED_PROVABLY_DEFAULT}
+
+    def _backend_failure(self, e: Exception, source: str = "OPA") -> Dict[str, Any]:
+        # Healthcare-safe default: fail CLOSED (OPA_FAIL_MODE applies to every policy backend)
+        if self.opa_fail_mode == "open":
+            return self._decision(
+                decision="allow",
+                action="allow",
+                reason=f"{source} unavailable (fail-open): {type(e).__name__}",
+                rule_id=f"{source.upper()}_FAIL_OPEN",
+                policy_version=f"{source.lower()}-unavailable",
+            )
+        return self._decision(
+            decision="deny",
+            action="deny",
+            reason=f"{source} unavailable (fail-closed): {type(e).__name__}",
+            rule_id=f"{source.upper()}_FAIL_CLOSED",
+            policy_version=f"{source.lower()}-unavailable",
+        )
+
+    def _evaluate_python_stage(
+        self,
+        stage: str,
+        message: str,
+        signals: Dict[str, Any],
+        tool: Optional[Any],
+        llm_out: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        stage_signals = dict(signals)
+        stage_signals["stage"] = stage
+        stage_signals["tool"] = None if tool is None else {"name": getattr(tool, "name", None), "args": getattr(tool, "args", None)}
+        if llm_out and isinstance(llm_out, dict):
+            stage_signals["llm_text"] = llm_out.get("output_text") or llm_out.get("text") or ""
+        return self.evaluate(message, signals=stage_signals)
+
+    def _evaluate_rules_stage(
+        self,
+        stage: str,
+        message: str,
+        signals: Dict[str, Any],
+        tool: Optional[Any],
+        llm_out: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        assert self._rules is not None
+        return self._rules.evaluate(stage, RuleEngine.context(stage, message, signals, tool, llm_out))
+
+    def _project(self, opa_input: Dict[str, Any]) -> Dict[str, Any]:
+        return opa_input if self._projector is None else self._projector.project(opa_input)
+
+    def _evaluate_wasm_stage(self, opa_input: Dict[str, Any]) -> Dict[str, Any]:
+        assert self._wasm is not None
+        return self._from_opa_result(self._wasm.evaluate(self._project(opa_input)))
+
+    def evaluate_stage(
+        self,
+        stage: str,
+        message: str,
+        signals: Dict[str, Any],
+        tool: Optional[Any],
+        tool_result: Optional[Any],
+        llm_out: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Blocking variant; kept for scripts and sync callers."""
+        opa_input = self._opa_input(stage, message, signals, tool, tool_result, llm_out)
+        precomputed = self._precomputed(stage, opa_input)
+        if precomputed is not None:
+            return precomputed
+        cache_key, cached = self._cache_lookup(stage, opa_input)
+        if cached is not None:
+            return cached
+        if self.backend == "rules":
+            try:
+                return self._cache_store(cache_key, self._evaluate_rules_stage(stage, message, signals, tool, llm_out))
+            except Exception as e:
+                return self._backend_failure(e, "Rules")
+        if self.backend == "opa-wasm":
+            try:
+                return self._cache_store(cache_key, self._evaluate_wasm_stage(opa_input))
+            except Exception as e:
+                return self._backend_failure(e)
+        log_event("DEBUG", "policy_evaluate", {"stage": stage, "backend": self.backend})
         if self.backend == "opa":
             try:
-                result = self._get_opa().decide(opa_input)
-                print("**174")
+                result = self._get_opa().decide(self._project(opa_input))
                 if self.opa_attach_bundle_status:
                     try:
                         status = self._get_opa().bundle_status()
@@ -175,38 +410,121 @@ class PolicyEngine:
                     except Exception:
                         result = {**result, "opa": {"status_error": True}}
 
-                return {
-                    "decision": result.get("decision", "deny"),
-                    "action": result.get("action") or ("deny" if result.get("decision") == "deny" else "allow"),
-                    "reason": result.get("reason", "Denied by OPA policy"),
-                    "rule_id": result.get("rule_id"),
-                    "policy_version": result.get("policy_version", "opa-v1"),
-                    "mode": result.get("mode", _env_mode_default()),
-                    "obligations": result.get("obligations", []),
-                }
+                return self._cache_store(cache_key, self._from_opa_result(result))
 
             except Exception as e:
-                # Healthcare-safe default: fail CLOSED
-                if self.opa_fail_mode == "open":
-                    return self._decision(
-                        decision="allow",
-                        action="allow",
-                        reason=f"OPA unavailable (fail-open): {type(e).__name__}",
-                        rule_id="OPA_FAIL_OPEN",
-                        policy_version="opa-unavailable",
-                    )
-                return self._decision(
-                    decision="deny",
-                    action="deny",
-                    reason=f"OPA unavailable (fail-closed): {type(e).__name__}",
-                    rule_id="OPA_FAIL_CLOSED",
-                    policy_version="opa-unavailable",
-                )
+                return self._backend_failure(e)
 
         # Python fallback
-        stage_signals = dict(signals)
-        stage_signals["stage"] = stage
-        stage_signals["tool"] = None if tool is None else {"name": getattr(tool, "name", None), "args": getattr(tool, "args", None)}
-        if llm_out and isinstance(llm_out, dict):
-            stage_signals["llm_text"] = llm_out.get("output_text") or llm_out.get("text") or ""
-        return self.evaluate(message, signals=stage_signals)
+        return self._cache_store(cache_key, self._evaluate_python_stage(stage, message, signals, tool, llm_out))
+
+    async def aevaluate_stage(
+        self,
+        stage: str,
+        message: str,
+        signals: Dict[str, Any],
+        tool: Optional[Any],
+        tool_result: Optional[Any],
+        llm_out: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Non-blocking variant of evaluate_stage (shared async OPA client)."""
+        opa_input = self._opa_input(stage, message, signals, tool, tool_result, llm_out)
+        precomputed = self._precomputed(stage, opa_input)
+        if precomputed is not None:
+            return precomputed
+        cache_key, cached = self._cache_lookup(stage, opa_input)
+        if cached is not None:
+            return cached
+        if self.backend == "rules":
+            try:
+                return self._cache_store(cache_key, self._evaluate_rules_stage(stage, message, signals, tool, llm_out))
+            except Exception as e:
+                return self._backend_failure(e, "Rules")
+        if self.backend == "opa-wasm":
+            try:
+                return self._cache_store(cache_key, self._evaluate_wasm_stage(opa_input))
+            except Exception as e:
+                return self._backend_failure(e)
+        log_event("DEBUG", "policy_evaluate", {"stage": stage, "backend": self.backend})
+        if self.backend == "opa":
+            try:
+                result = await self._get_opa().adecide(self._project(opa_input))
+                if self.opa_attach_bundle_status:
+                    try:
+                        status = await self._get_opa().abundle_status()
+                        result = {**result, "opa": {"status_hash": OPAClient.stable_hash(status), "status": status}}
+                    except Exception:
+                        result = {**result, "opa": {"status_error": True}}
+
+                return self._cache_store(cache_key, self._from_opa_result(result))
+
+            except Exception as e:
+                return self._backend_failure(e)
+
+        # Python fallback (pure CPU, no I/O)
+        return self._cache_store(cache_key, self._evaluate_python_stage(stage, message, signals, tool, llm_out))
+
+    async def aevaluate_stage_many(self, stage: str, calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        aevaluate_stage for many inputs of one stage (keys: message, signals, tool,
+        tool_result, llm_out). Inputs the policy cannot tell apart (same decision-cache
+        key, or identical input when the stage is not cached) are evaluated once, and
+        the distinct ones concurrently.
+        """
+        mode = _env_mode_default()
+        order: List[str] = []
+        unique: Dict[str, Dict[str, Any]] = {}
+        for c in calls:
+            opa_input = self._opa_input(
+                stage, c["message"], c["signals"], c.get("tool"), c.get("tool_result"), c.get("llm_out")
+            )
+            key = self.decision_cache.key(stage, opa_input, mode) if self.decision_cache is not None else None
+            if key is None:
+                key = canonical_hash([stage, mode, opa_input])
+            order.append(key)
+            unique.setdefault(key, c)
+
+        keys = list(unique)
+        decisions = await asyncio.gather(*(
+            self.aevaluate_stage(
+                stage=stage,
+                message=unique[k]["message"],
+                signals=unique[k]["signals"],
+                tool=unique[k].get("tool"),
+                tool_result=unique[k].get("tool_result"),
+                llm_out=unique[k].get("llm_out"),
+            )
+            for k in keys
+        ))
+        by_key = dict(zip(keys, decisions))
+        # callers annotate decisions in place; duplicates get their own copy
+        seen = set()
+        out: List[Dict[str, Any]] = []
+        for k in order:
+            out.append(copy.deepcopy(by_key[k]) if k in seen else by_key[k])
+            seen.add(k)
+        return out
+
+    def policy_revision(self) -> str:
+        """Identifies the loaded policy (bundle revision, Wasm module, policy file); keys derived caches."""
+        epoch = self.decision_cache.epoch if self.decision_cache is not None else ""
+        if self._opa_source is not None:
+            # file-served policies have no bundle revision: their source still changes
+            epoch = "/".join(r for r in (epoch, self._opa_source.get()[0]) if r)
+        if epoch:
+            return epoch
+        if self._wasm is not None:
+            return self._wasm.revision
+        if self._rules is not None:
+            return f"rules:{self._rules.version}"
+        return f"{self.backend}:{self.policy_version}"
+
+    async def aclose(self) -> None:
+        if self._revision_watcher is not None:
+            self._revision_watcher.stop()
+        if self._source_watcher is not None:
+            self._source_watcher.stop()
+        if self._tool_table is not None:
+            self._tool_table.stop()
+        if self._opa is not None:
+            await self._opa.aclose()
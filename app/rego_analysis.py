@@ -0,0 +1,910 @@
+"""
+Static analysis and local evaluation of genai.rego, for the subset of Rego it uses.
+
+The policy is parsed into rules (defaults, constants, `if` chains with `else`,
+predicates). Two things are derived from it:
+
+- `provably_default(input)`: evaluates the policy's `decision` rule locally and
+  reports whether none of its definitions apply, so OPA would return the literal
+  `default decision`. Only then may a stage skip the OPA round-trip. Anything outside
+  the supported subset (unknown builtins, unusual syntax, conflicting values) raises
+  Unsupported, and the caller evaluates live. The analysis never guesses.
+- `stage_input_paths(stage)`: the input paths (e.g. ("signals", "pii_any")) that the
+  rules reachable for a stage read. Branches guarded by `stage == "<other stage>"`
+  are pruned. None means "could read anything".
+
+Supported: `package` lines, `import future.keywords...` / `import rego.v1`,
+`default x := term`, `x := term`,
+`x [:= term] if { body } [else [:= term] if { body }]* [else := term]`,
+`x if { body }`, and `some`, `not`, `:=`, comparisons, refs with iteration, and the
+builtins in _BUILTINS. Other rule heads (`x contains v`, functions, `x[k]`, dotted
+names), keywords such as `in`/`every`/`with`, and anything left over on a line are
+Unsupported rather than skipped. Policies that read `data` (other packages, data documents) or
+alias anything through imports are Unsupported: the analysis only sees this module.
+
+StageSkipper and InputProjector act on live decisions, so they analyse the policy the
+backend actually runs, never a local copy: the package's modules as OPA reports them
+(GET /v1/policies) or the source shipped with the loaded Wasm module. Without that
+source both stay off.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+_DEFAULT_REGO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opa", "policies", "genai.rego")
+
+Path = Tuple[str, ...]
+
+
+class Unsupported(Exception):
+    """The policy (or this input) uses Rego the analysis does not model."""
+
+
+class _Undefined:
+    def __repr__(self) -> str:
+        return "UNDEFINED"
+
+
+UNDEFINED = _Undefined()
+
+
+# ----------------------------------------------------------------------------
+# Lexer / parser
+# ----------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>[ \t\r]+)
+  | (?P<comment>\#[^\n]*)
+  | (?P<nl>\n)
+  | (?P<str>"(?:[^"\\]|\\.)*")
+  | (?P<num>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)
+  | (?P<op>:=|==|!=|>=|<=|[><=])
+  | (?P<punct>[()\[\]{},:;|])
+""", re.X)
+
+_CMP_OPS = ("==", "!=", ">=", "<=", ">", "<")
+
+# keywords the parser does not model; seen anywhere, they would be misread as variables
+_KEYWORDS = frozenset({"as", "contains", "every", "in", "with"})
+
+
+def _tokenize(src: str) -> List[Tuple[str, str]]:
+    out: List[Tuple[str, str]] = []
+    pos = 0
+    while pos < len(src):
+        m = _TOKEN_RE.match(src, pos)
+        if m is None:
+            raise Unsupported(f"unexpected character {src[pos]!r} at offset {pos}")
+        kind = m.lastgroup
+        pos = m.end()
+        if kind in ("ws", "comment"):
+            continue
+        out.append((kind, m.group(kind)))  # type: ignore[arg-type]
+    out.append(("eof", ""))
+    return out
+
+
+class _Parser:
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.toks = tokens
+        self.i = 0
+        self.depth = 0  # newlines are insignificant inside () and []
+
+    def peek(self, skip_nl: bool = True) -> Tuple[str, str]:
+        j = self.i
+        while skip_nl and self.toks[j][0] == "nl":
+            j += 1
+        return self.toks[j]
+
+    def next(self, skip_nl: bool = True) -> Tuple[str, str]:
+        while skip_nl and self.toks[self.i][0] == "nl":
+            self.i += 1
+        tok = self.toks[self.i]
+        if tok[0] != "eof":  # stay on eof, so truncated source ends in Unsupported
+            self.i += 1
+        return tok
+
+    def expect(self, value: str) -> None:
+        tok = self.next()
+        if tok[1] != value:
+            raise Unsupported(f"expected {value!r}, got {tok[1]!r}")
+
+    def at(self, value: str, skip_nl: bool = True) -> bool:
+        return self.peek(skip_nl)[1] == value and self.peek(skip_nl)[0] != "str"
+
+    def end_of(self, what: str, closers: Tuple[str, ...]) -> None:
+        """The construct must end here (newline, or one of `closers`), or it was not understood."""
+        kind, value = self.peek(skip_nl=False)
+        if kind not in ("nl", "eof") and not (kind == "punct" and value in closers):
+            raise Unsupported(f"unexpected {value!r} after {what}")
+
+    def name(self) -> str:
+        kind, value = self.next()
+        if kind != "ident" or "." in value or value in _KEYWORDS:
+            raise Unsupported(f"rule name {value!r}")
+        return value
+
+    # -- module ---------------------------------------------------------------
+
+    def module(self) -> List[Tuple[Any, ...]]:
+        rules: List[Tuple[Any, ...]] = []
+        while self.peek()[0] != "eof":
+            kind, value = self.next()
+            if kind != "ident":
+                raise Unsupported(f"unexpected {value!r} at top level")
+            if value in ("package", "import"):
+                words: List[str] = []
+                while self.peek(skip_nl=False)[0] not in ("nl", "eof"):
+                    words.append(self.next(skip_nl=False)[1])
+                # keyword imports change syntax only; any other import aliases data or input
+                if value == "import" and not (words and words[0].split(".")[0] in ("future", "rego")):
+                    raise Unsupported(f"import {' '.join(words)}")
+                continue
+            if value == "default":
+                name = self.name()
+                self.expect(":=")
+                rules.append(("default", name, self.term()))
+            else:
+                self.i -= 1
+                rules.append(self.rule(self.name()))
+            self.end_of("rule", ())
+        return rules
+
+    def rule(self, name: str) -> Tuple[Any, ...]:
+        branches: List[Tuple[Any, Optional[List[Any]]]] = []  # (head term, body or None)
+        head: Any = ("const", True)
+        if self.at(":=", skip_nl=False):
+            self.next()
+            head = self.term()
+        elif not self.at("if", skip_nl=False):
+            # `x contains v`, `f(x)`, `x[k]`, `x = v`: heads the analysis does not model
+            raise Unsupported(f"rule head {name} {self.peek(skip_nl=False)[1]!r}")
+        if not self.at("if"):
+            return ("chain", name, [(head, None)])
+        self.next()
+        branches.append((head, self.body()))
+        while self.at("else"):
+            self.next()
+            head = ("const", True)
+            if self.at(":="):
+                self.next()
+                head = self.term()
+            if self.at("if"):
+                self.next()
+                branches.append((head, self.body()))
+            else:
+                branches.append((head, None))
+                break
+        return ("chain", name, branches)
+
+    def body(self) -> List[Any]:
+        self.expect("{")
+        stmts: List[Any] = []
+        while True:
+            while self.peek(skip_nl=False)[0] == "nl" or self.peek(skip_nl=False)[1] == ";":
+                self.next(skip_nl=False)
+            if self.at("}"):
+                self.next()
+                return stmts
+            stmts.append(self.statement())
+            self.end_of("statement", (";", "}"))
+
+    def statement(self) -> Tuple[Any, ...]:
+        if self.at("some"):
+            self.next()
+            names = [self.next()[1]]
+            while self.at(",", skip_nl=False):
+                self.next()
+                names.append(self.next()[1])
+            return ("some", names)
+        if self.at("not"):
+            self.next()
+            return ("not", self.statement())
+        left = self.term()
+        op = self.peek(skip_nl=False)
+        if op[0] == "op" and op[1] == ":=":
+            self.next()
+            if left[0] != "var":
+                raise Unsupported("only simple variables can be declared")
+            return ("assign", left[1], self.term())
+        if op[0] == "op" and op[1] in _CMP_OPS:
+            self.next()
+            return ("cmp", op[1], left, self.term())
+        if op[0] == "op":
+            raise Unsupported(f"operator {op[1]!r}")
+        return ("expr", left)
+
+    def term(self) -> Tuple[Any, ...]:
+        t = self.primary()
+        while self.at("[", skip_nl=False):
+            self.next()
+            idx = self.term()
+            self.expect("]")
+            t = ("ref", t, idx)
+        return t
+
+    def primary(self) -> Tuple[Any, ...]:
+        kind, value = self.next()
+        if kind == "str":
+            return ("const", json.loads(value))
+        if kind == "num":
+            return ("const", float(value) if any(c in value for c in ".eE") else int(value))
+        if kind == "ident":
+            if value in ("true", "false"):
+                return ("const", value == "true")
+            if value == "null":
+                return ("const", None)
+            if self.at("(", skip_nl=False):
+                self.next()
+                args: List[Any] = []
+                while not self.at(")"):
+                    args.append(self.term())
+                    if self.at(","):
+                        self.next()
+                self.expect(")")
+                return ("call", value, args)
+            if value in _KEYWORDS:
+                raise Unsupported(f"keyword {value!r}")
+            return ("var", value)
+        if value == "(":
+            t = self.term()
+            self.expect(")")
+            return t
+        if value == "[":
+            items: List[Any] = []
+            while not self.at("]"):
+                items.append(self.term())
+                if self.at(","):
+                    self.next()
+            self.expect("]")
+            return ("array", items)
+        if value == "{":
+            if self.at("}"):
+                self.next()
+                return ("object", [])
+            first = self.term()
+            if self.at(":"):
+                self.next()
+                pairs = [(first, self.term())]
+                while self.at(","):
+                    self.next()
+                    if self.at("}"):
+                        break
+                    k = self.term()
+                    self.expect(":")
+                    pairs.append((k, self.term()))
+                self.expect("}")
+                return ("object", pairs)
+            items = [first]
+            while self.at(","):
+                self.next()
+                if self.at("}"):
+                    break
+                items.append(self.term())
+            self.expect("}")
+            return ("set", items)
+        raise Unsupported(f"unexpected {value!r}")
+
+
+# ----------------------------------------------------------------------------
+# Evaluation
+# ----------------------------------------------------------------------------
+
+def _type_rank(v: Any) -> int:
+    if v is None:
+        return 0
+    if isinstance(v, bool):
+        return 1
+    if isinstance(v, (int, float)):
+        return 2
+    if isinstance(v, str):
+        return 3
+    if isinstance(v, list):
+        return 4
+    if isinstance(v, dict):
+        return 5
+    if isinstance(v, frozenset):
+        return 6
+    raise Unsupported(f"value of type {type(v).__name__}")
+
+
+def _compare(op: str, a: Any, b: Any) -> bool:
+    ra, rb = _type_rank(a), _type_rank(b)
+    if op == "==":
+        return ra == rb and a == b
+    if op == "!=":
+        return not (ra == rb and a == b)
+    if ra != rb:
+        key_a, key_b = ra, rb
+    elif ra in (1, 2, 3):
+        key_a, key_b = a, b
+    else:
+        raise Unsupported(f"ordering of {type(a).__name__} values")
+    return {">=": key_a >= key_b, "<=": key_a <= key_b, ">": key_a > key_b, "<": key_a < key_b}[op]
+
+
+def _is_number(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _to_number(v: Any) -> Any:
+    if _is_number(v):
+        return v
+    if v is None:
+        return 0
+    if isinstance(v, bool):
+        return 1 if v else 0
+    if isinstance(v, str):
+        try:
+            f = float(v)
+        except ValueError:
+            return UNDEFINED
+        return int(f) if f.is_integer() and not any(c in v for c in ".eE") else f
+    return UNDEFINED
+
+
+def _object_get(obj: Any, key: Any, default: Any) -> Any:
+    if not isinstance(obj, dict):
+        return UNDEFINED
+    if isinstance(key, list):
+        raise Unsupported("object.get with a path")
+    return obj.get(key, default)
+
+
+def _count(v: Any) -> Any:
+    if isinstance(v, (str, list, dict, frozenset)):
+        return len(v)
+    return UNDEFINED
+
+
+def _sprintf(fmt: Any, args: Any) -> Any:
+    if not isinstance(fmt, str) or not isinstance(args, list) or "%v" in fmt:
+        raise Unsupported("sprintf format")
+    try:
+        return fmt % tuple(args)
+    except (TypeError, ValueError) as e:
+        raise Unsupported(f"sprintf: {e}")
+
+
+def _str_fn(fn: Callable[..., Any]) -> Callable[..., Any]:
+    def call(*args: Any) -> Any:
+        if not all(isinstance(a, str) for a in args):
+            return UNDEFINED
+        return fn(*args)
+    return call
+
+
+_BUILTINS: Dict[str, Callable[..., Any]] = {
+    "object.get": _object_get,
+    "is_object": lambda v: isinstance(v, dict),
+    "is_string": lambda v: isinstance(v, str),
+    "is_number": _is_number,
+    "is_boolean": lambda v: isinstance(v, bool),
+    "is_array": lambda v: isinstance(v, list),
+    "is_set": lambda v: isinstance(v, frozenset),
+    "is_null": lambda v: v is None,
+    "lower": _str_fn(str.lower),
+    "upper": _str_fn(str.upper),
+    "to_number": _to_number,
+    "count": _count,
+    "contains": _str_fn(lambda a, b: b in a),
+    "startswith": _str_fn(lambda a, b: a.startswith(b)),
+    "endswith": _str_fn(lambda a, b: a.endswith(b)),
+    "sprintf": _sprintf,
+}
+
+# builtins that only inspect a value's type: static analysis does not count them as reads
+_TYPE_ONLY = frozenset({"is_object"})
+
+
+def _freeze(v: Any) -> Any:
+    if isinstance(v, list):
+        return tuple(_freeze(x) for x in v)
+    if isinstance(v, dict):
+        return tuple(sorted((k, _freeze(x)) for k, x in v.items()))
+    return v
+
+
+class _Eval:
+    def __init__(self, policy: "RegoPolicy", input_: Any):
+        self.policy = policy
+        self.input = input_
+        self.memo: Dict[str, Any] = {}
+        self.active: Set[str] = set()
+
+    def rule(self, name: str) -> Any:
+        if name in self.memo:
+            return self.memo[name]
+        if name in self.active:
+            raise Unsupported(f"recursive rule {name}")
+        self.active.add(name)
+        try:
+            value = self._chains(name)
+            if value is UNDEFINED and name in self.policy.defaults:
+                value = self.value(self.policy.defaults[name], {})
+        finally:
+            self.active.discard(name)
+        self.memo[name] = value
+        return value
+
+    def _chains(self, name: str) -> Any:
+        """Value from the rule's definitions, ignoring its default; UNDEFINED if none applies."""
+        found: List[Any] = []
+        for branches in self.policy.chains.get(name, []):
+            for head, body in branches:
+                if body is None:
+                    found.append(self.value(head, {}))
+                    break
+                env = next(self.body(body, 0, {}), None)
+                if env is not None:
+                    found.append(self.value(head, env))
+                    break
+        found = [v for v in found if v is not UNDEFINED]
+        if not found:
+            return UNDEFINED
+        if len({_freeze(v) for v in found}) > 1:
+            raise Unsupported(f"conflicting values for {name}")
+        return found[0]
+
+    def value(self, term: Any, env: Dict[str, Any]) -> Any:
+        for v, _ in self.term(term, env):
+            return v
+        return UNDEFINED
+
+    def body(self, stmts: List[Any], i: int, env: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        if i == len(stmts):
+            yield env
+            return
+        for env2 in self.statement(stmts[i], env):
+            yield from self.body(stmts, i + 1, env2)
+
+    def statement(self, st: Tuple[Any, ...], env: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        kind = st[0]
+        if kind == "some":
+            yield {k: v for k, v in env.items() if k not in st[1]}
+        elif kind == "assign":
+            for v, env2 in self.term(st[2], env):
+                yield {**env2, st[1]: v}
+        elif kind == "cmp":
+            for a, env2 in self.term(st[2], env):
+                for b, env3 in self.term(st[3], env2):
+                    if _compare(st[1], a, b):
+                        yield env3
+        elif kind == "expr":
+            for v, env2 in self.term(st[1], env):
+                if v is not False:
+                    yield env2
+        elif kind == "not":
+            if next(self.statement(st[1], env), None) is None:
+                yield env
+        else:
+            raise Unsupported(f"statement {kind}")
+
+    def _bound(self, name: str, env: Dict[str, Any]) -> bool:
+        return name in env or name == "input" or name in self.policy.rule_names
+
+    def term(self, t: Tuple[Any, ...], env: Dict[str, Any]) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        kind = t[0]
+        if kind == "const":
+            yield t[1], env
+        elif kind == "var":
+            name = t[1]
+            if name in env:
+                yield env[name], env
+            elif name == "input":
+                yield self.input, env
+            elif name in self.policy.rule_names:
+                v = self.rule(name)
+                if v is not UNDEFINED:
+                    yield v, env
+            else:
+                raise Unsupported(f"unbound variable {name}")
+        elif kind == "ref":
+            for coll, env2 in self.term(t[1], env):
+                idx = t[2]
+                if idx[0] == "var" and not self._bound(idx[1], env2):
+                    yield from self._iterate(coll, idx[1], env2)
+                    continue
+                for key, env3 in self.term(idx, env2):
+                    v = self._index(coll, key)
+                    if v is not UNDEFINED:
+                        yield v, env3
+        elif kind == "call":
+            fn = _BUILTINS.get(t[1])
+            if fn is None:
+                raise Unsupported(f"builtin {t[1]}")
+            for args, env2 in self._args(t[2], 0, env, []):
+                v = fn(*args)
+                if v is not UNDEFINED:
+                    yield v, env2
+        elif kind == "array":
+            for items, env2 in self._args(t[1], 0, env, []):
+                yield items, env2
+        elif kind == "set":
+            for items, env2 in self._args(t[1], 0, env, []):
+                yield frozenset(_freeze(x) for x in items), env2
+        elif kind == "object":
+            flat = [x for pair in t[1] for x in pair]
+            for items, env2 in self._args(flat, 0, env, []):
+                yield {items[i]: items[i + 1] for i in range(0, len(items), 2)}, env2
+        else:
+            raise Unsupported(f"term {kind}")
+
+    def _args(
+        self, terms: List[Any], i: int, env: Dict[str, Any], acc: List[Any]
+    ) -> Iterator[Tuple[List[Any], Dict[str, Any]]]:
+        if i == len(terms):
+            yield list(acc), env
+            return
+        for v, env2 in self.term(terms[i], env):
+            yield from self._args(terms, i + 1, env2, acc + [v])
+
+    @staticmethod
+    def _index(coll: Any, key: Any) -> Any:
+        if isinstance(coll, frozenset):
+            return key if _freeze(key) in coll else UNDEFINED
+        if isinstance(coll, list):
+            if _is_number(key) and float(key).is_integer() and 0 <= int(key) < len(coll):
+                return coll[int(key)]
+            return UNDEFINED
+        if isinstance(coll, dict):
+            return coll.get(key, UNDEFINED) if isinstance(key, str) else UNDEFINED
+        return UNDEFINED
+
+    @staticmethod
+    def _iterate(coll: Any, var: str, env: Dict[str, Any]) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        if isinstance(coll, frozenset):
+            for x in sorted(coll, key=repr):
+                yield x, {**env, var: x}
+        elif isinstance(coll, list):
+            for i, x in enumerate(coll):
+                yield x, {**env, var: i}
+        elif isinstance(coll, dict):
+            for k, x in coll.items():
+                yield x, {**env, var: k}
+
+
+# ----------------------------------------------------------------------------
+# Static input-path analysis
+# ----------------------------------------------------------------------------
+
+class _Paths:
+    """Which input paths a rule's value derives from, and which paths its bodies read."""
+
+    def __init__(self, policy: "RegoPolicy", stage: Optional[str]):
+        self.policy = policy
+        self.stage = stage
+        self.reads: Set[Path] = set()
+        self.results: Dict[str, FrozenSet[Path]] = {}
+        self.active: Set[str] = set()
+
+    def rule(self, name: str) -> FrozenSet[Path]:
+        if name in self.results:
+            return self.results[name]
+        if name in self.active:
+            raise Unsupported(f"recursive rule {name}")
+        self.active.add(name)
+        out: Set[Path] = set()
+        defs = list(self.policy.chains.get(name, []))
+        if name in self.policy.defaults:
+            defs.append([(self.policy.defaults[name], None)])
+        for branches in defs:
+            for head, body in branches:
+                env: Dict[str, FrozenSet[Path]] = {}
+                if body is not None:
+                    if self._dead(body):
+                        continue
+                    for st in body:
+                        self.statement(st, env)
+                out |= self.term(head, env)
+        self.active.discard(name)
+        self.results[name] = frozenset(out)
+        return self.results[name]
+
+    def _dead(self, body: List[Any]) -> bool:
+        """True if the branch requires `stage == "<x>"` for some other stage x."""
+        if self.stage is None:
+            return False
+        for st in body:
+            if st[0] == "cmp" and st[1] == "==":
+                a, b = st[2], st[3]
+                for x, y in ((a, b), (b, a)):
+                    if x == ("var", "stage") and y[0] == "const" and y[1] != self.stage:
+                        return True
+        return False
+
+    def statement(self, st: Tuple[Any, ...], env: Dict[str, FrozenSet[Path]]) -> None:
+        kind = st[0]
+        if kind == "some":
+            for n in st[1]:
+                env[n] = frozenset()
+        elif kind == "assign":
+            env[st[1]] = self.term(st[2], env)
+        elif kind == "cmp":
+            self.reads |= self.term(st[2], env) | self.term(st[3], env)
+        elif kind == "expr":
+            self.reads |= self.term(st[1], env)
+        elif kind == "not":
+            self.statement(st[1], env)
+
+    def term(self, t: Tuple[Any, ...], env: Dict[str, FrozenSet[Path]]) -> FrozenSet[Path]:
+        kind = t[0]
+        if kind == "const":
+            return frozenset()
+        if kind == "var":
+            name = t[1]
+            if name in env:
+                return env[name]
+            if name == "input":
+                return frozenset({()})
+            if name in self.policy.rule_names:
+                return self.rule(name)
+            head, _, rest = name.partition(".")
+            if head == "data":
+                raise Unsupported("data reference")  # rules elsewhere may read any input
+            if rest:  # dotted ref, e.g. input.signals.pii_any
+                fields = tuple(rest.split("."))
+                return frozenset(p + fields for p in self.term(("var", head), env))
+            env[name] = frozenset()  # implicitly declared iteration variable
+            return frozenset()
+        if kind == "ref":
+            base = self.term(t[1], env)
+            self.reads |= base | self.term(t[2], env)
+            return base
+        if kind == "call":
+            if t[1] == "object.get" and len(t[2]) == 3 and t[2][1][0] == "const" and isinstance(t[2][1][1], str):
+                base = self.term(t[2][0], env)
+                return frozenset(p + (t[2][1][1],) for p in base) | self.term(t[2][2], env)
+            if t[1] not in _BUILTINS or t[1] == "object.get":
+                raise Unsupported(f"builtin {t[1]}")
+            args = [self.term(a, env) for a in t[2]]
+            if t[1] in _TYPE_ONLY:
+                return frozenset()
+            out = frozenset().union(*args) if args else frozenset()
+            self.reads |= out
+            return out
+        if kind in ("array", "set"):
+            return frozenset().union(*(self.term(x, env) for x in t[1])) if t[1] else frozenset()
+        if kind == "object":
+            return frozenset().union(*(self.term(x, env) for pair in t[1] for x in pair)) if t[1] else frozenset()
+        raise Unsupported(f"term {kind}")
+
+
+# ----------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------
+
+class RegoPolicy:
+    """
+    A parsed policy module. Source outside the supported subset raises Unsupported
+    rather than being read as something else, e.g. a multi-value rule:
+
+    >>> RegoPolicy('deny_reasons contains msg if { msg := "pii" }')
+    Traceback (most recent call last):
+    ...
+    rego_analysis.Unsupported: rule head deny_reasons 'contains'
+    """
+
+    def __init__(self, source: str, path: str = "<string>"):
+        self.path = path
+        self.revision = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        self.defaults: Dict[str, Any] = {}
+        self.chains: Dict[str, List[List[Tuple[Any, Optional[List[Any]]]]]] = {}
+        for r in _Parser(_tokenize(source)).module():
+            if r[0] == "default":
+                self.defaults[r[1]] = r[2]
+            else:
+                self.chains.setdefault(r[1], []).append(r[2])
+        self.rule_names = frozenset(self.defaults) | frozenset(self.chains)
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> "RegoPolicy":
+        path = path or os.getenv("OPA_REGO_PATH", _DEFAULT_REGO)
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(f.read(), path)
+
+    def evaluate(self, input_: Any, rule: str = "decision") -> Any:
+        """The rule's value for `input_` (UNDEFINED if it has none); raises Unsupported."""
+        return _Eval(self, input_).rule(rule)
+
+    def default_value(self, rule: str = "decision") -> Any:
+        if rule not in self.defaults:
+            return UNDEFINED
+        return _Eval(self, None).value(self.defaults[rule], {})
+
+    def provably_default(self, input_: Any, rule: str = "decision") -> bool:
+        """True only if no definition of `rule` applies to `input_`, so OPA returns its default."""
+        if rule not in self.defaults:
+            return False
+        try:
+            return _Eval(self, input_)._chains(rule) is UNDEFINED
+        except Exception:  # Unsupported, or an evaluation the model gets wrong: evaluate live
+            return False
+
+    def stage_input_paths(self, stage: Optional[str], rule: str = "decision") -> Optional[FrozenSet[Path]]:
+        """Input paths `rule` can read when input.stage == `stage`; None if it could read anything."""
+        analysis = _Paths(self, stage)
+        try:
+            analysis.reads |= analysis.rule(rule)
+            analysis.reads |= analysis.rule("stage") if "stage" in self.rule_names else frozenset({("stage",)})
+        except (Unsupported, RecursionError):
+            return None
+        if () in analysis.reads:
+            return None
+        return frozenset(analysis.reads)
+
+
+
+def project_input(obj: Any, paths: FrozenSet[Path]) -> Any:
+    """
+    Copy of `obj` with only the given paths. Where a path runs into a non-object
+    value (e.g. "tool": null), that value is kept as is so type checks see the same thing.
+    """
+    out: Dict[str, Any] = {}
+    for path in sorted(paths, key=len, reverse=True):  # a shorter path then replaces the partial copy
+        src, dst = obj, out
+        for i, part in enumerate(path):
+            if not isinstance(src, dict) or part not in src:
+                break
+            src = src[part]
+            if i == len(path) - 1 or not isinstance(src, dict):
+                dst[part] = src
+                break
+            dst = dst.setdefault(part, {})
+    return out
+
+
+# (revision, Rego source or None) of the policy a backend is running
+SourceFn = Callable[[], Tuple[str, Optional[str]]]
+
+
+class PolicySource:
+    """
+    Latest Rego source of a remote policy, published by a poller (for OPA, a
+    RevisionWatcher over OPAClient.policy_source). `get` is a SourceFn. None (never
+    fetched, fetch failed) means unknown.
+    """
+
+    def __init__(self):
+        self._current: Tuple[str, Optional[str]] = ("", None)
+
+    def set(self, source: Optional[str]) -> None:
+        revision = "" if source is None else hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        if revision != self._current[0]:
+            self._current = (revision, source)
+
+    def get(self) -> Tuple[str, Optional[str]]:
+        return self._current
+
+
+class _WatchedPolicy:
+    """
+    The backend's running policy, parsed once per revision reported by `source` (called
+    on the request path, so it must be cheap). No source, or one outside the supported
+    subset, turns the feature off until the revision changes. Each loaded revision
+    carries a memo dict for per-policy results. A polled source (PolicySource) trails a
+    policy push by up to one poll interval, like the decision cache epoch.
+    """
+
+    def __init__(self, source: SourceFn):
+        self.source = source
+        # (revision, policy, memo), replaced as a whole
+        self._loaded: Tuple[Optional[str], Optional[RegoPolicy], Dict[str, Any]] = (None, None, {})
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _from_env(cls, flag: str, source: SourceFn):
+        if os.getenv(flag, "true").lower() != "true":
+            return None
+        return cls(source)
+
+    @property
+    def policy(self) -> Optional[RegoPolicy]:
+        return self._loaded[1]
+
+    def _accept(self, policy: RegoPolicy) -> bool:
+        return True
+
+    def _load(self, revision: str, text: Optional[str]) -> None:
+        policy: Optional[RegoPolicy] = None
+        if text:
+            try:
+                policy = RegoPolicy(text, f"<policy {revision}>")
+                if not self._accept(policy):
+                    policy = None
+            except Exception:  # Unsupported, or source the parser trips over
+                policy = None
+        self._loaded = (revision, policy, {})
+
+    def _current(self) -> Tuple[Optional[RegoPolicy], Dict[str, Any]]:
+        revision, text = self.source()
+        if self._loaded[0] != revision and self._lock.acquire(blocking=False):
+            try:
+                if self._loaded[0] != revision:
+                    self._load(revision, text)
+            finally:
+                self._lock.release()
+        loaded_revision, policy, memo = self._loaded
+        # another thread still parsing the new revision: act as if there were no policy
+        return (policy, memo) if loaded_revision == revision else (None, {})
+
+
+class StageSkipper(_WatchedPolicy):
+    """
+    Decides whether a stage can skip policy evaluation because the running policy
+    provably returns its default decision for the input.
+
+    POLICY_SKIP_DEFAULT_STAGES=true
+    """
+
+    @classmethod
+    def from_env(cls, source: SourceFn) -> Optional["StageSkipper"]:
+        return cls._from_env("POLICY_SKIP_DEFAULT_STAGES", source)
+
+    def _accept(self, policy: RegoPolicy) -> bool:
+        return isinstance(policy.default_value(), dict)
+
+    def default_for(self, opa_input: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The policy's default decision if `opa_input` provably gets it, else None."""
+        policy, _ = self._current()
+        if policy is None or not policy.provably_default(opa_input):
+            return None
+        return policy.default_value()
+
+
+class InputProjector(_WatchedPolicy):
+    r"""
+    Trims the policy input to the paths the running policy can read at the input's stage
+    (RegoPolicy.stage_input_paths), so large prompts, tool arguments and tool results
+    are not serialized and shipped to OPA. Inputs the analysis cannot bound pass through
+    whole, and so does everything while the source is unknown or fails to parse. Every
+    path a reachable rule reads is kept:
+
+    >>> rego = (
+    ...     'default decision := {"decision": "allow"}\n'
+    ...     'text := lower(input.llm_out.output_text) if { input.stage == "response" }\n'
+    ...     'decision := {"decision": "deny"} if { contains(text, "password") }\n'
+    ... )
+    >>> projector = InputProjector(lambda: ("r1", rego))
+    >>> projector.project({"stage": "response", "llm_out": {"output_text": "x", "model": "m"}, "prompt": "p"})
+    {'llm_out': {'output_text': 'x'}, 'stage': 'response'}
+    >>> projector = InputProjector(lambda: ("r2", rego + 'reasons contains "pw" if { text }'))
+    >>> projector.paths("response") is None
+    True
+
+    OPA_INPUT_PROJECTION=true
+    """
+
+    @classmethod
+    def from_env(cls, source: SourceFn) -> Optional["InputProjector"]:
+        return cls._from_env("OPA_INPUT_PROJECTION", source)
+
+    def paths(self, stage: str) -> Optional[FrozenSet[Path]]:
+        keyed = self.revision_paths(stage)
+        return None if keyed is None else keyed[1]
+
+    def revision_paths(self, stage: str) -> Optional[Tuple[str, FrozenSet[Path]]]:
+        """(policy revision, paths) the policy reads at `stage`, e.g. to key caches; None if unbounded."""
+        policy, memo = self._current()
+        if policy is None:
+            return None
+        if stage not in memo:
+            try:
+                memo[stage] = policy.stage_input_paths(stage)
+            except Exception:  # an analysis bug must not cost fields the policy reads
+                memo[stage] = None
+        paths = memo[stage]
+        return None if paths is None else (policy.revision, paths)
+
+    def project(self, opa_input: Dict[str, Any]) -> Dict[str, Any]:
+        stage = opa_input.get("stage")
+        if not isinstance(stage, str):
+            return opa_input
+        paths = self.paths(stage.lower())  # the policy lower()s input.stage
+        return opa_input if paths is None else project_input(opa_input, paths)
@@ -0,0 +1,260 @@
+"""
+Compiled in-process evaluator for policy.yaml.
+
+Rule schema (conditions are AND-ed; the first matching rule in file order wins):
+
+    - id: SQL_DESTRUCTIVE_BLOCK
+      stage: tool                    # pre|tool|post|response, or a list; default: pre
+      condition:
+        field: sql_query             # target of contains_any (default: message)
+        contains_any: ["delete", "drop"]
+        tool_name: sql_query         # <name>: value            -> equality
+        injection_score_gte: 0.6     # <name>_gte|_gt|_lte|_lt  -> numeric comparison
+        user_role_in: [analyst]      # <name>_in|_not_in        -> membership
+      action: deny
+      message: "..."
+      obligations: [log_security_event]
+
+Names resolve against a flat context. It holds the signals plus stage, message,
+user_role, tool_name, sql_query, tool_domain and llm_text.
+"""
+from __future__ import annotations
+
+import os
+import re
+from typing import Any, Callable, Dict, FrozenSet, Hashable, List, Optional, Tuple
+
+import yaml
+
+DEFAULT_POLICY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "policy.yaml")
+
+STAGES = ("pre", "tool", "post", "response")
+
+# context name -> OPA input paths it is derived from (used for decision-cache keys)
+CONTEXT_INPUT_PATHS: Dict[str, Tuple[Tuple[str, ...], ...]] = {
+    "stage": (("stage",),),
+    "message": (("request", "message"),),
+    "user_role": (("request", "user_role"), ("signals", "user_role")),
+    "tool_name": (("tool", "name"), ("signals", "tool_name")),
+    "sql_query": (("tool", "args", "query"), ("signals", "sql_query")),
+    "llm_text": (("llm_out", "output_text"),),
+}
+
+_NUMERIC_OPS: Dict[str, Callable[[float, float], bool]] = {
+    "_gte": lambda a, b: a >= b,
+    "_gt": lambda a, b: a > b,
+    "_lte": lambda a, b: a <= b,
+    "_lt": lambda a, b: a < b,
+}
+
+Predicate = Callable[[Dict[str, Any]], bool]
+
+
+class PolicyFileError(ValueError):
+    pass
+
+
+def _to_float(v: Any) -> Optional[float]:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _norm(v: Any) -> Hashable:
+    if isinstance(v, str):
+        return v.lower()
+    if isinstance(v, (list, dict)):
+        return None
+    return v
+
+
+class _Condition:
+    # cheaper conditions are evaluated first (short-circuit)
+    def __init__(self, name: str, cost: int, fn: Predicate, guard: Optional[Tuple[str, Hashable]] = None):
+        self.name = name
+        self.cost = cost
+        self.fn = fn
+        self.guard = guard
+
+
+def _compile_condition(key: str, value: Any, cond: Dict[str, Any]) -> Optional[_Condition]:
+    if key == "field":
+        return None
+
+    if key == "contains_any":
+        field = str(cond.get("field", "message"))
+        if value is not None and not isinstance(value, list):
+            raise PolicyFileError(f"{key}: expected a list, got {value!r}")
+        needles = [str(n).lower() for n in (value or []) if str(n)]
+        if not needles:
+            return _Condition(field, 3, lambda ctx: False)
+        rx = re.compile("|".join(re.escape(n) for n in sorted(needles, key=len, reverse=True)))
+        return _Condition(field, 3, lambda ctx: bool(rx.search(str(ctx.get(field) or "").lower())))
+
+    for suffix, op in _NUMERIC_OPS.items():
+        if key.endswith(suffix):
+            name = key[: -len(suffix)]
+            bound = _to_float(value)
+            if bound is None:
+                raise PolicyFileError(f"{key}: expected a number, got {value!r}")
+
+            def numeric(ctx: Dict[str, Any], name=name, op=op, bound=bound) -> bool:
+                v = _to_float(ctx.get(name))
+                return v is not None and op(v, bound)
+
+            return _Condition(name, 1, numeric)
+
+    if key.endswith("_not_in") or key.endswith("_in"):
+        negate = key.endswith("_not_in")
+        name = key[: -len("_not_in")] if negate else key[: -len("_in")]
+        if value is not None and not isinstance(value, list):
+            raise PolicyFileError(f"{key}: expected a list, got {value!r}")
+        members: FrozenSet[Hashable] = frozenset(_norm(x) for x in (value or []))
+        return _Condition(name, 2, lambda ctx: (_norm(ctx.get(name)) in members) != negate)
+
+    if isinstance(value, bool):
+        return _Condition(key, 0, lambda ctx: bool(ctx.get(key)) is value, guard=(key, value))
+    if isinstance(value, (str, int, float)):
+        expected = _norm(value)
+        return _Condition(key, 0, lambda ctx: _norm(ctx.get(key)) == expected, guard=(key, expected))
+
+    raise PolicyFileError(f"unsupported condition {key!r}: {value!r}")
+
+
+class CompiledRule:
+    def __init__(self, order: int, raw: Dict[str, Any]):
+        if not raw.get("id"):
+            raise PolicyFileError(f"rule #{order} has no id")
+        self.order = order
+        self.rule_id = str(raw["id"])
+        stages = raw.get("stage", "pre")
+        self.stages = tuple(s.lower() for s in ([stages] if isinstance(stages, str) else stages))
+        unknown = [s for s in self.stages if s not in STAGES]
+        if unknown:
+            raise PolicyFileError(f"{self.rule_id}: unknown stage(s) {unknown}")
+        self.action = str(raw.get("action", "deny")).lower()
+        self.reason = str(raw.get("message") or raw.get("description") or self.rule_id)
+        self.obligations = list(raw.get("obligations") or [])
+
+        cond = raw.get("condition") or {}
+        if not isinstance(cond, dict):
+            raise PolicyFileError(f"{self.rule_id}: condition must be a mapping")
+        try:
+            compiled = [c for c in (_compile_condition(k, v, cond) for k, v in cond.items()) if c is not None]
+        except PolicyFileError as e:
+            raise PolicyFileError(f"{self.rule_id}: {e}") from None
+        self.conditions: List[_Condition] = sorted(compiled, key=lambda c: c.cost)
+        self.fields = frozenset(c.name for c in self.conditions)
+        # first equality condition doubles as the index key for this rule
+        self.guard = next((c.guard for c in self.conditions if c.guard is not None), None)
+
+    def matches(self, ctx: Dict[str, Any]) -> bool:
+        for c in self.conditions:
+            if not c.fn(ctx):
+                return False
+        return True
+
+
+class _StageIndex:
+    def __init__(self, rules: List[CompiledRule]):
+        self.unguarded: List[CompiledRule] = []
+        # bool guards match on truthiness, the rest on normalized equality
+        self.by_bool: Dict[str, Dict[bool, List[CompiledRule]]] = {}
+        self.by_eq: Dict[str, Dict[Hashable, List[CompiledRule]]] = {}
+        for r in rules:
+            if r.guard is None:
+                self.unguarded.append(r)
+                continue
+            name, value = r.guard
+            index = self.by_bool if isinstance(value, bool) else self.by_eq
+            index.setdefault(name, {}).setdefault(value, []).append(r)
+
+    def candidates(self, ctx: Dict[str, Any]) -> List[CompiledRule]:
+        out = list(self.unguarded)
+        for name, buckets in self.by_bool.items():
+            out.extend(buckets.get(bool(ctx.get(name)), ()))
+        for name, buckets in self.by_eq.items():
+            out.extend(buckets.get(_norm(ctx.get(name)), ()))
+        if len(out) > 1:
+            out.sort(key=lambda r: r.order)
+        return out
+
+
+class RuleEngine:
+    """
+    POLICY_FILE=<path to policy.yaml> (default: repo-root policy.yaml)
+
+    Rules are bucketed per stage and indexed on their first equality test, so a
+    stage evaluation only checks rules whose guard signal matches.
+    """
+
+    def __init__(self, doc: Dict[str, Any]):
+        self.version = str(doc.get("version") or "yaml-v1")
+        self.file_mode = str(doc.get("mode") or "enforce").lower()
+        self.rules = [CompiledRule(i, r) for i, r in enumerate(doc.get("rules") or [])]
+        self._stages = {s: _StageIndex([r for r in self.rules if s in r.stages]) for s in STAGES}
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> "RuleEngine":
+        path = path or os.getenv("POLICY_FILE") or DEFAULT_POLICY_FILE
+        with open(path, "r", encoding="utf-8") as f:
+            doc = yaml.safe_load(f) or {}
+        if not isinstance(doc, dict):
+            raise PolicyFileError(f"{path}: expected a mapping at the top level")
+        return cls(doc)
+
+    def mode(self) -> str:
+        mode = (os.getenv("POLICY_MODE") or self.file_mode).lower()
+        return mode if mode in ("enforce", "monitor") else "enforce"
+
+    def input_paths(self) -> Tuple[Tuple[str, ...], ...]:
+        """OPA-input paths the compiled rules can read (decision-cache key)."""
+        paths = [("stage",)]
+        for name in sorted({f for r in self.rules for f in r.fields}):
+            paths.extend(CONTEXT_INPUT_PATHS.get(name, (("signals", name),)))
+        return tuple(dict.fromkeys(paths))
+
+    @staticmethod
+    def context(
+        stage: str,
+        message: str,
+        signals: Dict[str, Any],
+        tool: Optional[Any],
+        llm_out: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        ctx = dict(signals)
+        ctx["stage"] = stage
+        ctx["message"] = message
+        if tool is not None:
+            ctx["tool_name"] = getattr(tool, "name", None) or ctx.get("tool_name")
+            args = getattr(tool, "args", None) or {}
+            if isinstance(args, dict) and "query" in args:
+                ctx["sql_query"] = str(args.get("query") or "")
+        if llm_out and isinstance(llm_out, dict):
+            ctx["llm_text"] = llm_out.get("output_text") or llm_out.get("text") or ""
+        return ctx
+
+    def evaluate(self, stage: str, ctx: Dict[str, Any]) -> Dict[str, Any]:
+        index = self._stages.get(stage)
+        if index is not None:
+            for rule in index.candidates(ctx):
+                if rule.matches(ctx):
+                    return {
+                        "decision": "deny" if rule.action == "deny" else "allow",
+                        "action": rule.action,
+                        "reason": rule.reason,
+                        "rule_id": rule.rule_id,
+                        "policy_version": self.version,
+                        "mode": self.mode(),
+                        "obligations": list(rule.obligations),
+                    }
+        return {
+            "decision": "allow",
+            "action": "allow",
+            "reason": "Allowed",
+            "rule_id": "DEFAULT_ALLOW",
+            "policy_version": self.version,
+            "mode": self.mode(),
+            "obligations": [],
+        }
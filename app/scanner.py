@@ -0,0 +1,416 @@
+"""
+Single-pass multi-pattern scanner shared by PII detection, injection scoring and redaction.
+
+Every rule lives here once. A scan works in three steps:
+
+1. A literal prefilter (Aho-Corasick when `pyahocorasick` is installed, otherwise a
+   lookahead literal regex) finds which rules *could* match. Each rule lists literals,
+   and at least one of them must appear in any match. Rules without literals are
+   always candidates. The prefilter sees the text folded the way the rules match it
+   (see `fold`), so non-ASCII look-alikes that `re.I` or `\d` accept still count.
+2. The candidate rules are combined into one named-group alternation. It is compiled
+   once per candidate set and cached, and a single `finditer` runs over the text.
+3. An alternation only reports leftmost, non-overlapping matches. So a match of
+   another rule can only be hidden if it starts inside a reported span. Those spans
+   (usually a handful of short ones) are probed with the candidate rules, and this
+   recovers every hit a per-regex `search` would have found. Each rule keeps the
+   non-overlapping matches its own `finditer` would report, which redaction relies on.
+
+Cost is one pass over the text plus work proportional to the number of hits, so it
+stays roughly flat as the rule list grows.
+"""
+from __future__ import annotations
+
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+try:  # optional C extension; the regex prefilter below is the fallback
+    import ahocorasick  # type: ignore
+except ImportError:  # pragma: no cover - depends on environment
+    ahocorasick = None
+
+
+@dataclass(frozen=True)
+class ScanRule:
+    rule_id: str
+    kind: str  # "pii" | "injection"
+    label: str  # pii key (e.g. "email") or injection hit text
+    pattern: str
+    flags: int = 0
+    weight: float = 0.0
+    replacement: str = ""
+    # any-of literals (lowercase) that every match must contain; empty => always a candidate
+    literals: Tuple[str, ...] = ()
+
+    def compiled(self) -> "re.Pattern[str]":
+        return re.compile(self.pattern, self.flags)
+
+
+@dataclass(frozen=True)
+class ScanMatch:
+    rule_id: str
+    kind: str
+    label: str
+    start: int
+    end: int
+
+
+_DIGITS = tuple("0123456789")
+_SEP = "\x00"  # joins texts for Scanner.scan_many; no rule matches it
+
+
+def _case_fold_table() -> Dict[int, str]:
+    # Non-ASCII characters that re.I matches against an ASCII letter (İ ı ſ K). All of them
+    # are in the BMP; asking the engine keeps this in step with the running Python.
+    bmp = "".join(map(chr, range(0x80, 0x10000)))
+    return {
+        ord(c): next(a for a in "abcdefghijklmnopqrstuvwxyz" if re.fullmatch(a, c, re.I))
+        for c in re.findall(r"(?i:[a-z])", bmp)
+    }
+
+
+_CASE_FOLD = _case_fold_table()
+_NON_ASCII_DIGIT = re.compile(r"(?![0-9])\d")
+
+
+def fold(text: str) -> str:
+    """
+    Lowercases `text` for the literal prefilter, also mapping every non-ASCII character
+    a rule could match as an ASCII literal (re.I letters, \\d digits) onto it. The
+    length is preserved, so offsets into the folded text are offsets into `text`.
+    """
+    if text.isascii():
+        return text.lower()
+    return _NON_ASCII_DIGIT.sub("0", text.translate(_CASE_FOLD)).lower()
+
+
+PII_RULES: List[ScanRule] = [
+    ScanRule("PII_EMAIL", "pii", "email", r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+",
+             replacement="[REDACTED_EMAIL]", literals=("@",)),
+    # India-ish phone: simple demo heuristic (10 digits, optional +91, spaces/dashes)
+    ScanRule("PII_PHONE", "pii", "phone", r"(\+?91[\s-]?)?\b[6-9]\d{9}\b",
+             replacement="[REDACTED_PHONE]", literals=_DIGITS),
+    ScanRule("PII_AADHAAR_LIKE", "pii", "aadhaar_like", r"\b\d{4}[\s-]?\d{4}[\s-]?\d{4}\b",
+             replacement="[REDACTED_ID]", literals=_DIGITS),
+]
+
+# Heuristic patterns (simple + demoable). The label is the pattern text, which is what
+# downstream policy matches its critical markers against.
+INJECTION_RULES: List[ScanRule] = [
+    ScanRule("INJ_IGNORE", "injection", r"ignore (all|previous) instructions",
+             r"ignore (all|previous) instructions", re.I, 0.35, literals=("ignore ",)),
+    ScanRule("INJ_REVEAL_PROMPT", "injection", r"reveal (the )?system prompt",
+             r"reveal (the )?system prompt", re.I, 0.45, literals=("reveal ",)),
+    ScanRule("INJ_ROLE", "injection", r"you are (now )?(developer|system)",
+             r"you are (now )?(developer|system)", re.I, 0.25, literals=("you are ",)),
+    ScanRule("INJ_JAILBREAK", "injection", r"bypass|jailbreak|do anything now",
+             r"bypass|jailbreak|do anything now", re.I, 0.35,
+             literals=("bypass", "jailbreak", "do anything now")),
+    ScanRule("INJ_TOOL", "injection", r"call (the )?tool|use (the )?tool",
+             r"call (the )?tool|use (the )?tool", re.I, 0.15, literals=("tool",)),
+    ScanRule("INJ_EXFIL", "injection", r"exfiltrate|leak|dump|print secrets",
+             r"exfiltrate|leak|dump|print secrets", re.I, 0.45,
+             literals=("exfiltrate", "leak", "dump", "print secrets")),
+]
+
+
+class _LiteralPrefilter:
+    """Returns the set of literals present in a folded text (see `fold`)."""
+
+    def __init__(self, literals: Sequence[str]):
+        self.literals = sorted(set(literals), key=lambda s: (-len(s), s))
+        # a literal found at some position also implies every literal contained in it
+        self._implied: Dict[str, FrozenSet[str]] = {
+            lit: frozenset(o for o in self.literals if o in lit) for lit in self.literals
+        }
+        self._automaton = None
+        self._rx: Optional["re.Pattern[str]"] = None
+        if not self.literals:
+            return
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for lit in self.literals:
+                automaton.add_word(lit, lit)
+            automaton.make_automaton()
+            self._automaton = automaton
+        else:
+            # zero-width lookahead => tried at every position; longest literal wins per position
+            self._rx = re.compile("(?=(" + "|".join(re.escape(x) for x in self.literals) + "))")
+
+    def present(self, folded: str) -> FrozenSet[str]:
+        found = set()
+        if self._automaton is not None:
+            for _, lit in self._automaton.iter(folded):
+                found.add(lit)
+            return frozenset(found)
+        if self._rx is not None:
+            for m in self._rx.finditer(folded):
+                lit = m.group(1)
+                if lit not in found:
+                    found |= self._implied[lit]
+        return frozenset(found)
+
+    def positions(self, folded: str) -> Iterator[Tuple[int, str]]:
+        """(start, literal) for every literal occurrence; literals implied by a hit share its start."""
+        if self._automaton is not None:
+            for end, lit in self._automaton.iter(folded):
+                yield end - len(lit) + 1, lit
+        elif self._rx is not None:
+            for m in self._rx.finditer(folded):
+                for lit in self._implied[m.group(1)]:
+                    yield m.start(), lit
+
+
+def _offsets(texts: Sequence[str]) -> List[int]:
+    """Start offset of each text in `_SEP.join(texts)`."""
+    offsets: List[int] = []
+    pos = 0
+    for t in texts:
+        offsets.append(pos)
+        pos += len(t) + 1
+    return offsets
+
+
+class ScanResult:
+    def __init__(self, scanner: "Scanner", text: str, matches: List[ScanMatch]):
+        self.scanner = scanner
+        self.text = text
+        self.matches = matches
+
+    @property
+    def pii_spans(self) -> List[ScanMatch]:
+        return [m for m in self.matches if m.kind == "pii"]
+
+    def with_pii_spans(self, spans: Sequence[ScanMatch]) -> "ScanResult":
+        """The same scan plus PII spans found by another detector over the same text."""
+        return ScanResult(self.scanner, self.text, self.matches + list(spans))
+
+    @property
+    def pii(self) -> Dict[str, bool]:
+        found = {m.label for m in self.matches if m.kind == "pii"}
+        return {label: label in found for label in self.scanner.pii_labels}
+
+    @property
+    def injection_hits(self) -> List[str]:
+        found = {m.rule_id for m in self.matches if m.kind == "injection"}
+        return [r.label for r in self.scanner.rules if r.kind == "injection" and r.rule_id in found]
+
+    @property
+    def injection_score(self) -> float:
+        found = {m.rule_id for m in self.matches if m.kind == "injection"}
+        score = 0.0
+        for r in self.scanner.rules:
+            if r.kind == "injection" and r.rule_id in found:
+                score += r.weight
+        # clamp 0..1
+        return min(1.0, score)
+
+
+class Scanner:
+    def __init__(self, rules: Sequence[ScanRule]):
+        self.rules: List[ScanRule] = list(rules)
+        self._compiled = [r.compiled() for r in self.rules]
+        self.pii_labels: List[str] = [r.label for r in self.rules if r.kind == "pii"]
+        self._replacements = {r.rule_id: r.replacement for r in self.rules}
+        self._always = frozenset(i for i, r in enumerate(self.rules) if not r.literals)
+        self._by_literal: Dict[str, FrozenSet[int]] = {}
+        for i, r in enumerate(self.rules):
+            for lit in r.literals:
+                self._by_literal[lit] = self._by_literal.get(lit, frozenset()) | {i}
+        self._prefilter = _LiteralPrefilter(list(self._by_literal))
+        self._combined = lru_cache(maxsize=256)(self._build_combined)
+
+    def _build_combined(self, candidates: Tuple[int, ...]) -> "re.Pattern[str]":
+        parts = []
+        for i in candidates:
+            r = self.rules[i]
+            body = f"(?i:{r.pattern})" if r.flags & re.I else r.pattern
+            parts.append(f"(?P<r{i}>{body})")
+        return re.compile("|".join(parts))
+
+    def _candidates(self, text: str) -> Tuple[int, ...]:
+        return self._candidates_for(self._prefilter.present(fold(text)))
+
+    def _candidates_for(self, literals: Iterable[str]) -> Tuple[int, ...]:
+        idx = set(self._always)
+        for lit in literals:
+            idx |= self._by_literal[lit]
+        return tuple(sorted(idx))
+
+    def _find(self, text: str, candidates: Tuple[int, ...]) -> Dict[Tuple[int, int], int]:
+        """
+        (rule index, start) -> end for the matches each candidate rule's own `finditer`
+        reports in `text`.
+        """
+        reported: List[Tuple[int, int, int]] = []
+        for m in self._combined(candidates).finditer(text):
+            reported.append((int(m.lastgroup[1:]), m.start(), m.end()))
+
+        found: Dict[Tuple[int, int], int] = {(i, s): e for i, s, e in reported}
+        # probe reported spans for matches the alternation could not report
+        next_ok = {i: 0 for i in candidates}
+        for k, s, e in reported:
+            next_ok[k] = max(next_ok[k], e)
+            for p in range(s, e):
+                for j in candidates:
+                    if (p == s and j <= k) or p < next_ok[j]:
+                        continue
+                    pm = self._compiled[j].match(text, p)
+                    if pm is not None:
+                        found.setdefault((j, p), pm.end())
+                        next_ok[j] = pm.end()
+
+        # A rule's match found by probing can overlap one of its reported matches (e.g. an
+        # email starting inside an earlier hit of another rule). finditer would have
+        # resumed after the first of them instead, so redo such (rare) rules directly.
+        last_end: Dict[int, int] = {}
+        redo: Set[int] = set()
+        for i, s in sorted(found):
+            if s < last_end.get(i, 0):
+                redo.add(i)
+            last_end[i] = found[(i, s)]
+        for i in redo:
+            for key in [key for key in found if key[0] == i]:
+                del found[key]
+            for m in self._compiled[i].finditer(text):
+                found[(i, m.start())] = m.end()
+        return found
+
+    def _result(self, text: str, found: Dict[Tuple[int, int], int]) -> ScanResult:
+        matches = [
+            ScanMatch(self.rules[i].rule_id, self.rules[i].kind, self.rules[i].label, s, e)
+            for (i, s), e in sorted(found.items(), key=lambda kv: (kv[0][1], kv[0][0]))
+        ]
+        return ScanResult(self, text, matches)
+
+    def scan(self, text: str) -> ScanResult:
+        text = text or ""
+        candidates = self._candidates(text)
+        if not candidates:
+            return ScanResult(self, text, [])
+        return self._result(text, self._find(text, candidates))
+
+    def scan_many(self, texts: Sequence[str]) -> List[ScanResult]:
+        """
+        Scans many texts with one prefilter pass and one `finditer` per distinct candidate set.
+
+        The texts are joined with NUL. The prefilter runs once over the joined text and
+        its hits are mapped back to per-text candidate sets. Texts that share a candidate
+        set are joined again and scanned as one with that set's combined pattern, and the
+        matches are mapped back by offset. Texts with no candidates cost nothing beyond
+        the prefilter.
+
+        Results equal `[self.scan(t) for t in texts]`. Texts that contain NUL themselves,
+        or that a match spans into (not possible with the default rules), are rescanned
+        on their own.
+        """
+        texts = [t or "" for t in texts]
+        out: List[Optional[ScanResult]] = [None] * len(texts)
+        joined_idx: List[int] = []
+        for i, t in enumerate(texts):
+            if _SEP in t:
+                out[i] = self.scan(t)
+            else:
+                joined_idx.append(i)
+        if not joined_idx:
+            return out  # type: ignore[return-value]
+
+        joined = _SEP.join(texts[i] for i in joined_idx)
+        offsets = _offsets([texts[i] for i in joined_idx])
+        literals: List[Set[str]] = [set() for _ in joined_idx]
+        for start, lit in self._prefilter.positions(fold(joined)):
+            literals[bisect_right(offsets, start) - 1].add(lit)
+        candidate_sets = [self._candidates_for(lits) for lits in literals]
+
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for k, candidates in enumerate(candidate_sets):
+            groups.setdefault(candidates, []).append(joined_idx[k])
+
+        for candidates, idx in groups.items():
+            if not candidates:
+                for i in idx:
+                    out[i] = ScanResult(self, texts[i], [])
+                continue
+            offsets = _offsets([texts[i] for i in idx])
+            per_text: List[Dict[Tuple[int, int], int]] = [{} for _ in idx]
+            rescan: Set[int] = set()
+            for (rule, s), e in self._find(_SEP.join(texts[i] for i in idx), candidates).items():
+                k = bisect_right(offsets, s) - 1
+                base = offsets[k]
+                if e > base + len(texts[idx[k]]):
+                    rescan.update(range(k, bisect_right(offsets, e - 1)))
+                    continue
+                per_text[k][(rule, s - base)] = e - base
+            for k, i in enumerate(idx):
+                out[i] = self.scan(texts[i]) if k in rescan else self._result(texts[i], per_text[k])
+        return out  # type: ignore[return-value]
+
+    def redact(self, text: str, spans: Optional[Sequence[ScanMatch]] = None) -> str:
+        """
+        Replaces PII spans with their redaction label. Overlapping spans (e.g. a phone
+        number running into an email, or a Presidio entity over a regex hit) are merged
+        and redacted once, under the label of the leftmost, longest of them.
+        """
+        if spans is None:
+            spans = self.scan(text).pii_spans
+        out: List[str] = []
+        pos = 0
+        label = ""
+        for m in sorted(spans, key=lambda m: (m.start, -(m.end - m.start))):
+            if m.start < pos:
+                pos = max(pos, m.end)  # overlaps the span being redacted: widen it
+                continue
+            out.append(label)
+            out.append(text[pos:m.start])
+            label = self._replacements.get(m.rule_id) or f"[REDACTED_{m.label.upper()}]"
+            pos = m.end
+        out.append(label)
+        out.append(text[pos:])
+        return "".join(out)
+
+
+DEFAULT_SCANNER = Scanner(PII_RULES + INJECTION_RULES)
+
+
+def scan_text(text: str) -> ScanResult:
+    """
+    Scans `text` with the default rules. Non-ASCII look-alikes match as re.I would:
+
+    >>> [scan_text(t).injection_score for t in ("bypaſs the filter", "İgnore all instructions")]
+    [0.35, 0.35]
+    >>> scan_text("pleaſe print ſecrets").injection_hits
+    ['exfiltrate|leak|dump|print secrets']
+    """
+    return DEFAULT_SCANNER.scan(text)
+
+
+def scan_texts(texts: Sequence[str]) -> List[ScanResult]:
+    return DEFAULT_SCANNER.scan_many(texts)
+
+
+def external_pii_spans(spans: Sequence[Sequence[Any]], source: str) -> List[ScanMatch]:
+    """
+    ScanMatch objects for [start, end, entity, ...] spans from another detector (e.g. Presidio).
+    They redact as [REDACTED_<ENTITY>].
+    """
+    return [
+        ScanMatch(f"{source}:{s[2]}", "pii", str(s[2]).lower(), int(s[0]), int(s[1]))
+        for s in spans
+    ]
+
+
+def redact_pii_spans(text: str, scan: Optional[ScanResult] = None) -> str:
+    """
+    Redacts PII in `text`, reusing `scan` when it was computed for this exact text.
+
+    >>> redact_pii_spans("use tool@x.y+z@foo.com")
+    'use [REDACTED_EMAIL][REDACTED_EMAIL]'
+    >>> redact_pii_spans("+91 9876543210+tool@x.y")
+    '[REDACTED_PHONE]'
+    """
+    if scan is not None and scan.text == text:
+        return DEFAULT_SCANNER.redact(text, scan.pii_spans)
+    return DEFAULT_SCANNER.redact(text)
@@ -0,0 +1,37 @@
+"""
+Request coalescing: concurrent calls with the same key share one execution.
+
+The first caller (the leader) starts the work as its own task. Every caller, the
+leader included, awaits it through asyncio.shield, so one disconnecting client
+cannot cancel the result the others are waiting on. The key is released as soon
+as the task finishes, so only calls that are in flight at the same time are
+coalesced; nothing is cached.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, Generic, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """SINGLEFLIGHT_ENABLED=true"""
+
+    def __init__(self):
+        self.enabled = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+        self._inflight: Dict[str, "asyncio.Task[T]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Returns (result, is_leader). Followers get the leader's result or exception."""
+        task = self._inflight.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._inflight.pop(k, None) if self._inflight.get(k) is t else None)
+        return await asyncio.shield(task), leader
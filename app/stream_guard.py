@@ -0,0 +1,78 @@
+"""
+Incremental leak-marker detection for streamed LLM output.
+
+The markers are the `leak_markers` set from opa/policies/genai.rego. Matching is
+case-insensitive and substring-based, like the rego's
+`contains(lower(output_text), m)`.
+
+Any trailing text that could be the start of a marker is held back until the next
+chunk decides it. A marker split across chunk boundaries is therefore still found,
+and no complete marker is ever forwarded before the caller has seen the hit.
+"""
+from __future__ import annotations
+
+import os
+import re
+from typing import Iterable, List, Optional, Tuple
+
+_DEFAULT_REGO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opa", "policies", "genai.rego")
+
+# used when the rego file is not shipped next to the app (mirrors genai.rego)
+DEFAULT_LEAK_MARKERS = ("api key", "credentials", "developer message", "system prompt")
+
+_SET_RE = re.compile(r"^leak_markers\s*:=\s*\{(.*?)\}", re.S | re.M)
+_STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+def load_leak_markers(path: Optional[str] = None) -> Tuple[str, ...]:
+    """Reads the leak_markers set literal from genai.rego (OPA_REGO_PATH)."""
+    path = path or os.getenv("OPA_REGO_PATH", _DEFAULT_REGO)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            m = _SET_RE.search(f.read())
+    except OSError:
+        return DEFAULT_LEAK_MARKERS
+    if m is None:
+        return DEFAULT_LEAK_MARKERS
+    markers = {s.encode("utf-8").decode("unicode_escape").lower() for s in _STRING_RE.findall(m.group(1))}
+    return tuple(sorted(markers)) or DEFAULT_LEAK_MARKERS
+
+
+class StreamLeakGuard:
+    """
+    Feed output deltas in order; each call returns (text safe to forward, markers newly seen).
+
+    Text is withheld whenever its suffix is a proper prefix of some marker. When a marker
+    completes, nothing is released: the caller decides (e.g. via the response stage) and
+    either stops the stream or calls feed("") to release the held text and continue.
+    """
+
+    def __init__(self, markers: Iterable[str]):
+        self.markers = tuple(m.lower() for m in markers if m)
+        self._prefixes = {m[:i] for m in self.markers for i in range(1, len(m))}
+        self._max_hold = max((len(m) for m in self.markers), default=1) - 1
+        self._pending = ""
+        self.hits: List[str] = []
+
+    def _hold(self, text: str) -> int:
+        for k in range(min(len(text), self._max_hold), 0, -1):
+            if text[-k:].lower() in self._prefixes:
+                return k
+        return 0
+
+    def feed(self, chunk: str) -> Tuple[str, List[str]]:
+        window = self._pending + chunk
+        lowered = window.lower()
+        new = [m for m in self.markers if m not in self.hits and m in lowered]
+        if new:
+            self.hits.extend(new)
+            self._pending = window
+            return "", new
+        hold = self._hold(window)
+        self._pending = window[len(window) - hold:] if hold else ""
+        return window[:len(window) - hold], []
+
+    def flush(self) -> str:
+        """End of stream: whatever is held cannot complete a marker any more."""
+        rest, self._pending = self._pending, ""
+        return rest
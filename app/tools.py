@@ -42,6 +42,17 @@ def execute_http_get(args: Dict[str, Any]) -> Dict[str, Any]:
             "body_preview": text
         }
 
+async def aexecute_http_get(args: Dict[str, Any], client: httpx.AsyncClient) -> Dict[str, Any]:
+    url = args.get("url", "")
+    r = await client.get(url)
+    text = r.text[:500]  # keep small
+    return {
+        "tool": "http_get",
+        "status": "ok",
+        "http_status": r.status_code,
+        "body_preview": text
+    }
+
 def get_domain(url: str) -> Optional[str]:
     # very lightweight domain parse (good enough for demo)
     m = re.match(r"^https?://([^/]+)/?", url.strip(), re.I)
@@ -53,8 +64,31 @@ class ToolProxy:
             "sql_query": execute_sql_query,
             "http_get": execute_http_get,
         }
+        # I/O-bound tools get a non-blocking implementation sharing one client
+        self.async_registry = {
+            "http_get": aexecute_http_get,
+        }
+        self._async_client: Optional[httpx.AsyncClient] = None
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(timeout=5.0, follow_redirects=True)
+        return self._async_client
 
     def execute(self, tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
         if tool_name not in self.registry:
             return {"tool": tool_name, "status": "error", "error": "Unknown tool"}
         return self.registry[tool_name](args)
+
+    async def aexecute(self, tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        if tool_name not in self.registry:
+            return {"tool": tool_name, "status": "error", "error": "Unknown tool"}
+        if tool_name in self.async_registry:
+            return await self.async_registry[tool_name](args, self._get_async_client())
+        # CPU-only tools (e.g. sql_query demo) are cheap enough to run inline
+        return self.registry[tool_name](args)
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
@@ -0,0 +1,150 @@
+"""
+In-process evaluation of opa/policies/genai.rego compiled to WebAssembly.
+
+Build the module with opa/build_wasm.sh, which runs `opa build -t wasm -e genai/decision`.
+It is loaded with the optional `opa-wasm` package (wasmtime based). One instance is
+kept per worker process. Calls are serialized because a Wasm instance's linear memory
+is not thread-safe, and a single evaluation takes microseconds. When the .wasm file
+or the data file changes on disk, a fresh instance is built and swapped in atomically.
+
+build_wasm.sh also writes the compiled Rego next to the module (policy.wasm ->
+policy.rego), headed by `# wasm sha256: <module digest>`. It is the policy source that
+StageSkipper / InputProjector analyse, and only counts when the digest matches the
+loaded module.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+_REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_WASM_PATH = os.path.join(_REPO_ROOT, "opa", "wasm", "policy.wasm")
+DEFAULT_DATA_PATH = os.path.join(_REPO_ROOT, "opa", "data", "data.json")
+
+
+def _file_sig(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read_source(path: str, module: bytes) -> Optional[str]:
+    """The Rego source at `path` if its header names `module`'s digest, else None."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+    except OSError:
+        return None
+    if text.partition("\n")[0].strip() != f"# wasm sha256: {hashlib.sha256(module).hexdigest()}":
+        return None
+    return text
+
+
+class WasmPolicy:
+    """
+    OPA_WASM_PATH=opa/wasm/policy.wasm
+    OPA_WASM_DATA=opa/data/data.json
+    OPA_WASM_RELOAD_CHECK_S=2      (how often the files are stat()ed for hot-swap)
+    """
+
+    def __init__(
+        self,
+        wasm_path: str,
+        data_path: Optional[str] = None,
+        reload_check_s: float = 2.0,
+        on_reload: Optional[Callable[[str], None]] = None,
+    ):
+        self.wasm_path = wasm_path
+        self.data_path = data_path
+        self.reload_check_s = reload_check_s
+        self.on_reload = on_reload
+        self.source_path = os.path.splitext(wasm_path)[0] + ".rego"
+        self.revision = ""
+        # (revision, Rego source or None) of the loaded module, replaced as a whole
+        self._source: Tuple[str, Optional[str]] = ("", None)
+        self._policy: Any = None
+        self._sig: Optional[tuple] = None
+        self._next_check = 0.0
+        self._eval_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def from_env(cls, on_reload: Optional[Callable[[str], None]] = None) -> "WasmPolicy":
+        return cls(
+            wasm_path=os.getenv("OPA_WASM_PATH", DEFAULT_WASM_PATH),
+            data_path=os.getenv("OPA_WASM_DATA", DEFAULT_DATA_PATH),
+            reload_check_s=float(os.getenv("OPA_WASM_RELOAD_CHECK_S", "2")),
+            on_reload=on_reload,
+        )
+
+    def _signature(self) -> tuple:
+        return (
+            _file_sig(self.wasm_path),
+            _file_sig(self.data_path) if self.data_path else None,
+            _file_sig(self.source_path),
+        )
+
+    def _load(self) -> None:
+        from opa_wasm import OPAPolicy  # optional dependency: pip install opa-wasm
+
+        sig = self._signature()
+        with open(self.wasm_path, "rb") as f:
+            module = f.read()
+        data: Dict[str, Any] = {}
+        if self.data_path and os.path.exists(self.data_path):
+            with open(self.data_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+        policy = OPAPolicy(self.wasm_path)
+        policy.set_data(data)
+
+        source = _read_source(self.source_path, module)
+
+        digest = hashlib.sha256(module + json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        revision = f"wasm@{digest}"
+        source_revision = revision
+        if source is not None:
+            source_revision += "/" + hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+        with self._eval_lock:
+            self._policy = policy
+            self._sig = sig
+            self.revision = revision
+            self._source = (source_revision, source)
+        if self.on_reload is not None:
+            self.on_reload(self.revision)
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_check_s
+        if self._signature() == self._sig:
+            return
+        if not self._load_lock.acquire(blocking=False):
+            return  # another thread is already swapping
+        try:
+            if self._signature() != self._sig:
+                self._load()
+        finally:
+            self._load_lock.release()
+
+    def policy_source(self) -> Tuple[str, Optional[str]]:
+        """(revision, Rego source) of the loaded module; the source is None if it did not ship one."""
+        self._maybe_reload()
+        return self._source
+
+    def evaluate(self, opa_input: Dict[str, Any]) -> Dict[str, Any]:
+        """Same contract as OPAClient.decide: the `genai/decision` result, or {} if undefined."""
+        self._maybe_reload()
+        with self._eval_lock:
+            results = self._policy.evaluate(opa_input)
+        if not results:
+            return {}
+        return results[0].get("result") or {}
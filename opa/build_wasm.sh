@@ -0,0 +1,20 @@
+#!/usr/bin/env sh
+# Compiles genai.rego (+ data) to opa/wasm/policy.wasm for POLICY_BACKEND=opa-wasm.
+# Requires the `opa` CLI. Re-run after changing the policy; running gateways hot-swap the file.
+# wasm/policy.rego is the compiled source, tagged with the module's digest, for the gateway's
+# static analysis (stage skipping, input projection).
+set -eu
+cd "$(dirname "$0")"
+mkdir -p wasm/.build
+opa build -t wasm -e genai/decision policies/genai.rego data/data.json -o wasm/.build/bundle.tar.gz
+tar -xzf wasm/.build/bundle.tar.gz -C wasm/.build /policy.wasm
+{
+  echo "# wasm sha256: $(sha256sum wasm/.build/policy.wasm | cut -d' ' -f1)"
+  cat policies/genai.rego
+} > wasm/.build/policy.rego
+# rename is atomic, so a gateway never loads a half-written module (the source goes first: until
+# the module follows, its digest does not match and the gateway just skips the analysis)
+mv wasm/.build/policy.rego wasm/policy.rego
+mv wasm/.build/policy.wasm wasm/policy.wasm
+rm -rf wasm/.build
+echo "wrote $(pwd)/wasm/policy.wasm"
@@ -0,0 +1,98 @@
+"""
+Throughput of /getAns/batch against one request at a time on /getAns.
+
+    uvicorn main:app --port 8000        (from app/, LLM_MODE=stub)
+    python scripts/bench_batch.py --url http://127.0.0.1:8000 --count 500 [--detectors]
+
+The prompts are the bodies of requests.jsonl, cycled up to --count. Both runs use a
+single client connection. The one-at-a-time run posts to /getAns, or to
+/getAns/guardRailsAI with --detectors. The batch run posts all prompts as one
+/getAns/batch call and reads the NDJSON stream. Add --in-process to also time the
+scanner alone (scan_text per prompt vs one scan_texts call), without a server.
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def _prompts(count: int) -> List[Dict[str, Any]]:
+    with open(os.path.join(ROOT, "requests.jsonl"), encoding="utf-8") as f:
+        bodies = [json.loads(line)["body"] for line in f if line.strip()]
+    return [{"message": bodies[i % len(bodies)][:500] + f" #{i}", "user_role": "analyst"} for i in range(count)]
+
+
+def _post(conn: http.client.HTTPConnection, path: str, body: Any) -> bytes:
+    conn.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    data = resp.read()
+    if resp.status != 200:
+        raise SystemExit(f"{path}: HTTP {resp.status}: {data[:200]!r}")
+    return data
+
+
+def _one_at_a_time(url: str, path: str, prompts: List[Dict[str, Any]]) -> float:
+    u = urlparse(url)
+    conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=120)
+    t0 = time.perf_counter()
+    for p in prompts:
+        _post(conn, path, p)
+    return time.perf_counter() - t0
+
+
+def _batch(url: str, prompts: List[Dict[str, Any]], detectors: bool) -> float:
+    u = urlparse(url)
+    conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=600)
+    t0 = time.perf_counter()
+    lines = _post(conn, "/getAns/batch" + ("?detectors=true" if detectors else ""), prompts).splitlines()
+    elapsed = time.perf_counter() - t0
+    errors = [json.loads(line) for line in lines if b'"error"' in line[:40]]
+    if len(lines) != len(prompts) or errors:
+        print(f"  batch: {len(lines)} lines for {len(prompts)} prompts, {len(errors)} errors")
+    return elapsed
+
+
+def _in_process(prompts: List[Dict[str, Any]]) -> None:
+    sys.path.insert(0, os.path.join(ROOT, "app"))
+    from scanner import scan_text, scan_texts
+
+    texts = [p["message"] for p in prompts]
+    t0 = time.perf_counter()
+    for t in texts:
+        scan_text(t)
+    single = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    scan_texts(texts)
+    batched = time.perf_counter() - t0
+    print(f"scanner   one-at-a-time {single * 1000:8.1f} ms   scan_texts {batched * 1000:8.1f} ms")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--count", type=int, default=500)
+    ap.add_argument("--detectors", action="store_true", help="compare with /getAns/guardRailsAI")
+    ap.add_argument("--in-process", action="store_true", help="also time the scanner without a server")
+    args = ap.parse_args()
+
+    prompts = _prompts(args.count)
+    if args.in_process:
+        _in_process(prompts)
+
+    path = "/getAns/guardRailsAI" if args.detectors else "/getAns"
+    single = _one_at_a_time(args.url, path, prompts)
+    batched = _batch(args.url, prompts, args.detectors)
+    print(f"{path:<22} {len(prompts) / single:8.1f} req/s")
+    print(f"{'/getAns/batch':<22} {len(prompts) / batched:8.1f} req/s   ({single / batched:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
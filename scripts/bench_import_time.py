@@ -0,0 +1,90 @@
+"""
+Cold-start benchmark: wall time, self-reported import time and peak RSS of importing
+the gateway in a fresh interpreter.
+
+    python scripts/bench_import_time.py [--module main] [--runs 5] [--top 15] [--max-ms 1500]
+
+Each run is a new subprocess with `-X importtime`. The slowest imports (cumulative)
+of the last run are listed. With --max-ms the script exits 1 when the median wall time
+exceeds the budget, so cold start can be gated in CI.
+
+Heavy detector backends (NeMo, Guardrails/Presidio) are loaded lazily by
+detectors.DetectorRegistry and must not show up here; --forbid lists modules whose
+presence fails the run.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S.*)$")
+
+
+def _run_once(module: str) -> Tuple[float, int, List[Tuple[int, str]]]:
+    env = {**os.environ, "PYTHONPATH": APP_DIR + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR, env=env, capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - t0) * 1000
+    rss_kb = max(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss, before)
+    if proc.returncode != 0:
+        tail = "\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:"))[-2000:]
+        raise SystemExit(f"import {module} failed:\n{tail}")
+
+    imports: List[Tuple[int, str]] = []  # (cumulative us, module) for every module imported
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            imports.append((int(m.group(2)), m.group(3).strip()))
+    return wall_ms, rss_kb, imports
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--module", default="main")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--max-ms", type=float, default=0.0)
+    ap.add_argument("--forbid", default="nemoguardrails,guardrails,presidio_analyzer,spacy,torch")
+    args = ap.parse_args()
+
+    walls: List[float] = []
+    imports: List[Tuple[int, str]] = []
+    rss_kb = 0
+    for _ in range(args.runs):
+        wall_ms, rss_kb, imports = _run_once(args.module)
+        walls.append(wall_ms)
+
+    median = statistics.median(walls)
+    print(f"import {args.module}: median {median:.0f} ms, min {min(walls):.0f} ms over {args.runs} runs")
+    print(f"peak RSS (max over children): {rss_kb / 1024:.1f} MiB")
+    print("\nslowest imports (cumulative, last run):")
+    for us, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"  {us / 1000:9.1f} ms  {name}")
+
+    failed = False
+    loaded = {name for _, name in imports}
+    forbidden = sorted(m for m in args.forbid.split(",") if m and m in loaded)
+    if forbidden:
+        print(f"\nFAIL: heavy modules imported at startup: {', '.join(forbidden)}")
+        failed = True
+    if args.max_ms and median > args.max_ms:
+        print(f"\nFAIL: median {median:.0f} ms exceeds budget {args.max_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
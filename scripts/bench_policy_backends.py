@@ -0,0 +1,89 @@
+"""
+Micro-benchmark: PolicyEngine.evaluate_stage latency per backend.
+
+    python scripts/bench_policy_backends.py [--iterations 5000] [--backends rules,python,opa]
+
+The decision cache is disabled so every call really evaluates. The OPA backend is
+skipped (with a note) when OPA_URL is not reachable.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+os.environ["DECISION_CACHE_ENABLED"] = "false"
+
+from models import ToolRequest  # noqa: E402
+from policy_engine import PolicyEngine  # noqa: E402
+
+CASES: List[Tuple[str, Dict[str, Any], Any]] = [
+    ("pre", {"user_role": "analyst", "pii_any": False, "injection_score": 0.0, "injection_hits": []}, None),
+    ("pre", {"user_role": "analyst", "pii_any": True, "injection_score": 0.0, "injection_hits": []}, None),
+    ("pre", {"user_role": "analyst", "pii_any": False, "injection_score": 0.8,
+             "injection_hits": ["reveal (the )?system prompt", "bypass|jailbreak|do anything now"]}, None),
+    ("tool", {"user_role": "analyst", "tool_name": "sql_query", "sql_is_destructive": True},
+     ToolRequest(name="sql_query", args={"query": "DROP TABLE patients"})),
+    ("tool", {"user_role": "analyst", "tool_name": "http_get", "tool_domain": "cdc.gov"},
+     ToolRequest(name="http_get", args={"url": "https://cdc.gov/"})),
+    ("post", {"user_role": "analyst", "pii_any": False}, None),
+    ("response", {"user_role": "analyst"}, None),
+]
+
+
+def _bench(engine: PolicyEngine, iterations: int) -> List[float]:
+    samples: List[float] = []
+    llm_out = {"output_text": "Here is a short, harmless answer."}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(iterations):
+            stage, signals, tool = CASES[i % len(CASES)]
+            t0 = time.perf_counter()
+            engine.evaluate_stage(
+                stage=stage,
+                message="what is the weather like",
+                signals=signals,
+                tool=tool,
+                tool_result=None,
+                llm_out=llm_out if stage == "response" else None,
+            )
+            samples.append((time.perf_counter() - t0) * 1e6)
+    return samples
+
+
+def _opa_reachable(engine: PolicyEngine) -> bool:
+    try:
+        engine._get_opa().decide({"stage": "pre"})
+        return True
+    except Exception:
+        return False
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=5000)
+    ap.add_argument("--backends", default="rules,python,opa")
+    args = ap.parse_args()
+
+    print(f"{'backend':<8} {'p50 us':>10} {'p99 us':>10} {'mean us':>10} {'ops/s':>10}")
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        os.environ["POLICY_BACKEND"] = backend
+        engine = PolicyEngine()
+        if backend == "opa" and not _opa_reachable(engine):
+            print(f"{backend:<8} skipped (OPA not reachable at {engine._get_opa().base_url})")
+            continue
+        _bench(engine, min(200, args.iterations))  # warm-up
+        samples = sorted(_bench(engine, args.iterations))
+        p50 = samples[len(samples) // 2]
+        p99 = samples[int(len(samples) * 0.99) - 1]
+        mean = statistics.fmean(samples)
+        print(f"{backend:<8} {p50:>10.1f} {p99:>10.1f} {mean:>10.1f} {1e6 / mean:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Parity check: genai.rego via OPA over HTTP vs. the compiled Wasm module in-process.
+
+    opa/build_wasm.sh
+    python scripts/check_wasm_parity.py [--corpus opa/parity_corpus.jsonl] [--generated 500]
+
+Every input goes through OPAClient.decide and WasmPolicy.evaluate, and the raw
+results must be identical. The script exits 1 on the first mismatches (up to 20 are
+printed), so it can gate CI or a deploy.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, Iterator, List
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+from opa_client import OPAClient  # noqa: E402
+from wasm_policy import WasmPolicy  # noqa: E402
+
+HITS = [
+    "ignore (all|previous) instructions",
+    "reveal (the )?system prompt",
+    "you are (now )?(developer|system)",
+    "bypass|jailbreak|do anything now",
+    "call (the )?tool|use (the )?tool",
+    "exfiltrate|leak|dump|print secrets",
+]
+DOMAINS = ["", "cdc.gov", "www.cdc.gov", "nih.gov", "www.nih.gov", "example.com"]
+TEXTS = ["ok", "the system prompt is", "api key: x", "developer message", "credentials here", ""]
+
+
+def load_corpus(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def generated(n: int, seed: int) -> Iterator[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    for _ in range(n):
+        tool_name = rnd.choice(["sql_query", "http_get", "other", None])
+        yield {
+            "stage": rnd.choice(["pre", "tool", "post", "response"]),
+            "signals": {
+                "injection_score": round(rnd.random(), 2),
+                "injection_hits": rnd.sample(HITS, rnd.randint(0, 3)),
+                "pii_any": rnd.random() < 0.3,
+                "tool_domain": rnd.choice(DOMAINS),
+                "sql_is_destructive": rnd.random() < 0.3,
+                "sql_is_select": rnd.random() < 0.5,
+                "sql_has_limit": rnd.random() < 0.5,
+                "mode": rnd.choice(["enforce", "monitor", "Monitor"]),
+            },
+            "tool": None if tool_name is None else {"name": tool_name, "args": {}},
+            "llm_out": {"output_text": rnd.choice(TEXTS)},
+        }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--corpus", default=os.path.join(ROOT, "opa", "parity_corpus.jsonl"))
+    ap.add_argument("--generated", type=int, default=500, help="extra random inputs")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    opa = OPAClient()
+    wasm = WasmPolicy.from_env()
+
+    inputs: List[Dict[str, Any]] = list(load_corpus(args.corpus)) + list(generated(args.generated, args.seed))
+    mismatches = 0
+    for i, opa_input in enumerate(inputs):
+        want = opa.decide(opa_input)
+        got = wasm.evaluate(opa_input)
+        if want != got:
+            mismatches += 1
+            if mismatches <= 20:
+                print(f"MISMATCH #{i}\n  input: {json.dumps(opa_input)}\n  http:  {want}\n  wasm:  {got}")
+
+    print(f"{len(inputs)} inputs, {mismatches} mismatches (wasm {wasm.revision})")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
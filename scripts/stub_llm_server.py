@@ -0,0 +1,163 @@
+"""
+Local stand-in for an OpenAI-compatible chat-completions API, for exercising the
+LLM provider layer (pooling, LLM_MAX_IN_FLIGHT, retries/budget, timeouts, streaming)
+without a real upstream.
+
+    python scripts/stub_llm_server.py --port 8089 --latency-ms 200 --fail-rate 0.2
+
+    LLM_MODE=openai OPENAI_API_KEY=stub LLM_BASE_URL=http://127.0.0.1:8089/v1 uvicorn main:app
+
+POST /v1/chat/completions echoes the last user message, as JSON or (stream=true) as
+SSE chunks. --fail-rate answers that fraction of requests with --fail-status.
+GET /stats reports request counts and the peak number of concurrent requests.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def enter(self) -> None:
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def leave(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+            }
+
+
+def make_handler(args: argparse.Namespace, stats: _Stats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so client-side pooling is observable
+
+        def log_message(self, fmt: str, *a: Any) -> None:
+            if args.verbose:
+                super().log_message(fmt, *a)
+
+        def _json(self, status: int, body: Dict[str, Any]) -> None:
+            raw = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self) -> None:
+            if self.path == "/stats":
+                self._json(200, stats.snapshot())
+            else:
+                self._json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self._json(404, {"error": {"message": "not found"}})
+                return
+            stats.enter()
+            try:
+                time.sleep(args.latency_ms / 1000.0)
+                if random.random() < args.fail_rate:
+                    with stats.lock:
+                        stats.failures += 1
+                    self._json(args.fail_status, {"error": {"message": "stub failure", "type": "server_error"}})
+                    return
+                prompt = next((m.get("content", "") for m in reversed(body.get("messages", []))
+                               if m.get("role") == "user"), "")
+                text = f"(stub upstream) {prompt[:200]}"
+                if body.get("stream"):
+                    self._stream(body, text)
+                else:
+                    self._json(200, {
+                        "id": f"chatcmpl-{uuid.uuid4().hex}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "stub"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": text}}],
+                        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4,
+                                  "total_tokens": (len(prompt) + len(text)) // 4},
+                    })
+            finally:
+                stats.leave()
+
+        def _stream(self, body: Dict[str, Any], text: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            cid = f"chatcmpl-{uuid.uuid4().hex}"
+
+            def send(payload: str) -> None:
+                raw = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(raw):x}\r\n".encode("ascii") + raw + b"\r\n")
+                self.wfile.flush()
+
+            words = text.split(" ")
+            for i, word in enumerate(words):
+                delta = word if i == len(words) - 1 else word + " "
+                send(json.dumps({
+                    "id": cid, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+                }))
+                time.sleep(args.token_delay_ms / 1000.0)
+            send(json.dumps({
+                "id": cid, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency-ms", type=float, default=100.0)
+    ap.add_argument("--token-delay-ms", type=float, default=20.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--fail-status", type=int, default=503)
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+
+    stats = _Stats()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, stats))
+    print(f"stub chat-completions on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()